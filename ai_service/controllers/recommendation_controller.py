@@ -3,8 +3,12 @@ from fastapi import APIRouter, HTTPException
 from services.recommendation import (
     analyze_and_save_user_recommendation,
     batch_analyze_users,
-    get_user_recommendation_data
+    get_user_recommendation_data,
+    get_user_recommended_products
 )
+from models.recommendation.registry import registry
+from utils.product_features import get_product_cache_stats
+from services.training_jobs import TrainingInProgressError, find_job, list_jobs, start_training_job
 from pydantic import BaseModel
 from typing import List, Optional
 
@@ -21,6 +25,12 @@ class BatchAnalyzeRequest(BaseModel):
 class GetRecommendationRequest(BaseModel):
     customer_id: str
 
+class ActivateModelRequest(BaseModel):
+    version: str
+
+class TrainRequest(BaseModel):
+    kind: str = "full_retrain"
+
 @router.post("/recommendation/analyze-user")
 async def analyze_user_behavior(payload: AnalyzeUserRequest):
     """API để phân tích behavior của 1 user và lưu vào recommendation collection"""
@@ -51,8 +61,9 @@ async def batch_analyze_users_endpoint(payload: BatchAnalyzeRequest):
             payload.user_ids, payload.analysis_days
         )
         return {
-            "success": True, 
-            "message": result
+            "success": True,
+            "message": f"Analyzed {result['succeeded']}/{result['total']} users successfully",
+            "data": result
         }
         
     except Exception as e:
@@ -79,12 +90,17 @@ async def get_recommendation_data(payload: GetRecommendationRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/recommendation/user/{customer_id}")
-async def get_user_recommendations(customer_id: str):
-    """API GET để lấy recommendation data theo customer_id"""
+async def get_user_recommendations(customer_id: str, limit: int = 10):
+    """API GET để lấy recommendation data theo customer_id, kèm top sản phẩm gợi ý"""
     try:
         data = await get_user_recommendation_data(customer_id)
-        
+        products = await get_user_recommended_products(customer_id, data, limit)
+
+        if data is None and products["product_ids"]:
+            data = {"customer_id": customer_id}
         if data:
+            data["recommended_product_ids"] = products["product_ids"]
+            data["recommended_source"] = products["source"]
             return {
                 "success": True,
                 "customer_id": customer_id,
@@ -97,4 +113,57 @@ async def get_user_recommendations(customer_id: str):
             }
             
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/recommendation/behavior-stats")
+async def get_behavior_stats():
+    """API để xem thống kê cache đặc trưng sản phẩm dùng khi phân tích hành vi (hit/miss, ...)"""
+    return {"success": True, "data": {"product_cache": get_product_cache_stats()}}
+
+@router.get("/recommendation/model")
+async def get_model_info():
+    """API để xem phiên bản model recommendation đang phục vụ và các phiên bản có sẵn"""
+    try:
+        return {"success": True, "data": registry.info()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/recommendation/model/activate")
+async def activate_model_version(payload: ActivateModelRequest):
+    """API để chuyển sang một phiên bản model đã có (rollback)"""
+    try:
+        registry.activate(payload.version)
+        return {"success": True, "message": f"Activated model version {payload.version}"}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/recommendation/train")
+async def train_recommendation_model(payload: Optional[TrainRequest] = None):
+    """API để chạy job recommendation ở background (full_retrain, fold_in, materialize, profile_rebuild)"""
+    try:
+        job = await start_training_job(payload.kind if payload is not None else "full_retrain")
+        return {"success": True, "data": job}
+    except TrainingInProgressError as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "job": e.job})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/recommendation/train")
+async def list_training_jobs():
+    """API để xem các lần huấn luyện gần đây"""
+    return {"success": True, "data": list_jobs()}
+
+@router.get("/recommendation/train/{job_id}")
+async def get_training_job(job_id: str):
+    """API để xem trạng thái của một lần huấn luyện"""
+    try:
+        job = await find_job(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Training job {job_id} not found")
+    return {"success": True, "data": job}
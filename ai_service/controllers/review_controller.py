@@ -1,22 +1,99 @@
-from fastapi import APIRouter, HTTPException
+import json
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import AsyncIterator, List, Dict, Optional
 from datetime import datetime
-from services.review_analysis import analyze_stores_sentiment
+from services.review_analysis import analyze_stores_sentiment, iter_stores_sentiment, start_sentiment_backfill, get_backfill_status
+from services.review_sentiment_store import get_watermarks
+from utils.sentiment_analysis import get_cache_stats, get_executor_stats, get_batcher_stats, get_pass_stats, get_model_version
+from utils.inference_executor import InferenceQueueFullError
 router = APIRouter()
 
 class AnalyzeRequest(BaseModel):
     store_ids: List[str]  # Thay đổi từ store_id thành store_ids (list)
+    stream: bool = False  # True = trả về NDJSON, mỗi dòng là kết quả của một store
+
+class BackfillRequest(BaseModel):
+    max_stores: Optional[int] = None  # None = tất cả store đang giữ kết quả cũ
 
 @router.post("/reviews/analyze")
 async def analyze_stores_comments(request: AnalyzeRequest) -> List[Dict]:
     """
     API endpoint để phân tích comments tiêu cực của các store
-    Input: {"store_ids": ["store_id_1", "store_id_2", ...]}
+    Input: {"store_ids": ["store_id_1", "store_id_2", ...], "stream": false}
     Output: List các store với comments tiêu cực
+            (stream=true: NDJSON, mỗi store một dòng ngay khi phân tích xong)
     """
     try:
+        if request.stream:
+            return await _stream_stores_comments(request.store_ids)
         result = await analyze_stores_sentiment(store_ids=request.store_ids)
         return result
+    except InferenceQueueFullError as e:
+        raise HTTPException(status_code=503, detail=f"Sentiment analysis is busy, please retry later: {str(e)}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error analyzing store comments: {str(e)}")
+
+async def _stream_stores_comments(store_ids: List[str]) -> StreamingResponse:
+    """Tạo response NDJSON; store đầu tiên được chờ trước để lỗi sớm vẫn trả về đúng mã HTTP"""
+    results = iter_stores_sentiment(store_ids)
+    try:
+        first = await results.__anext__()
+    except StopAsyncIteration:
+        first = None
+
+    async def ndjson_lines() -> AsyncIterator[str]:
+        try:
+            if first is not None:
+                yield json.dumps(first, ensure_ascii=False) + "\n"
+            async for result in results:
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        except InferenceQueueFullError as e:
+            # Header đã gửi đi nên báo lỗi bằng một dòng riêng, caller thử lại các store còn thiếu
+            yield json.dumps({"error": f"Sentiment analysis is busy, please retry later: {str(e)}",
+                              "retryable": True}) + "\n"
+        finally:
+            await results.aclose()
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+@router.get("/reviews/sentiment-stats")
+async def get_sentiment_stats() -> Dict:
+    """
+    API endpoint để xem thống kê của bộ phân tích cảm xúc (cache hit/miss, ...)
+    """
+    return {
+        "cache": get_cache_stats(),
+        "executor": get_executor_stats(),
+        "batcher": get_batcher_stats(),
+        "second_pass": get_pass_stats(),
+    }
+
+@router.post("/reviews/sentiment-backfill")
+async def start_backfill(request: BackfillRequest) -> Dict:
+    """
+    API endpoint để chấm lại các review đã lưu bằng phiên bản model hiện tại (chạy ở background)
+    Input: {"max_stores": 100} (tùy chọn)
+    """
+    try:
+        return start_sentiment_backfill(max_stores=request.max_stores)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error starting sentiment backfill: {str(e)}")
+
+@router.get("/reviews/sentiment-backfill")
+async def backfill_status() -> Dict:
+    """
+    API endpoint để xem tiến độ backfill và phiên bản model hiện tại
+    """
+    return {"model_version": get_model_version(), "backfill": get_backfill_status()}
+
+@router.get("/reviews/sentiment-watermarks")
+async def sentiment_watermarks(store_ids: Optional[List[str]] = Query(None)) -> List[Dict]:
+    """
+    API endpoint để xem mốc chấm điểm (phiên bản model, lần chạy cuối) của các store
+    """
+    try:
+        return await get_watermarks(store_ids)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error analyzing store comments: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error getting sentiment watermarks: {str(e)}")
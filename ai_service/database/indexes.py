@@ -0,0 +1,27 @@
+# database/indexes.py
+# Tạo các index mà truy vấn của AI service cần (create_index không làm gì nếu index đã có)
+from loguru import logger
+from pymongo import ASCENDING, DESCENDING
+
+from database.mongo import user_action_collection
+
+INDEXES = [
+    # UserBehaviorAnalyzer._get_user_actions: customer_id bằng, sắp xếp/lọc theo timestamp,
+    # lọc action_type, chỉ đọc product_id -> truy vấn đọc hoàn toàn từ index
+    (user_action_collection, [
+        ("customer_id", ASCENDING),
+        ("timestamp", DESCENDING),
+        ("action_type", ASCENDING),
+        ("product_id", ASCENDING),
+    ], "customer_timestamp_action_product"),
+]
+
+
+async def ensure_indexes() -> None:
+    """Tạo các index còn thiếu, lỗi chỉ được log lại để service vẫn khởi động được"""
+    for collection, keys, name in INDEXES:
+        try:
+            await collection.create_index(keys, name=name)
+            logger.info(f"Ensured index {name} on {collection.name}")
+        except Exception as e:
+            logger.error(f"Error creating index {name} on {collection.name}: {str(e)}")
@@ -13,3 +13,7 @@ product_collection = db["products"]
 review_collection = db["reviews"]
 categories_collection = db["categories"]
 recommendation_collection = db["recommendations"]
+review_sentiment_collection = db["reviewsentiments"]
+review_sentiment_watermark_collection = db["reviewsentimentwatermarks"]
+review_sentiment_backfill_collection = db["reviewsentimentbackfills"]
+training_job_collection = db["trainingjobs"]
@@ -1,7 +1,13 @@
+import os
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from controllers import logging_controller, recommendation_controller, review_controller, predict_controller
+from database.indexes import ensure_indexes
+from services.review_analysis import start_sentiment_backfill
+from services.training_jobs import shutdown_executor, start_fold_in_schedule, start_materialize_schedule
+from utils.sentiment_analysis import shutdown_inference_executor
 
 app = FastAPI()
 
@@ -19,3 +25,32 @@ app.include_router(logging_controller.router, prefix="/api")
 app.include_router(recommendation_controller.router, prefix="/api")
 app.include_router(review_controller.router, prefix="/api")
 app.include_router(predict_controller.router, prefix="/api")
+
+@app.on_event("startup")
+async def create_indexes():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def backfill_review_sentiments():
+    # Đổi phiên bản model sentiment thì chấm lại dần các review đã lưu ở background,
+    # chỉ một worker chạy (các worker khác thấy khóa đang bị giữ và bỏ qua)
+    if os.getenv("REVIEW_SENTIMENT_AUTO_BACKFILL", "true").lower() in ("1", "true", "yes"):
+        start_sentiment_backfill()
+
+@app.on_event("startup")
+async def schedule_recommender_fold_in():
+    # Thêm user/sản phẩm mới vào model giữa các lần huấn luyện lại (RECOMMENDER_FOLD_IN_INTERVAL_MINUTES)
+    start_fold_in_schedule()
+
+@app.on_event("startup")
+async def schedule_recommendation_materialization():
+    # Tính trước top-N sản phẩm cho mọi user hằng ngày (RECOMMENDER_MATERIALIZE_AT, rỗng = tắt)
+    start_materialize_schedule()
+
+@app.on_event("shutdown")
+async def stop_training_executor():
+    shutdown_executor()
+
+@app.on_event("shutdown")
+async def stop_sentiment_executor():
+    shutdown_inference_executor()
@@ -0,0 +1,229 @@
+# models/recommendation/ann_index.py
+# Chỉ mục IVF (chia sản phẩm thành các cụm bằng k-means) trên nhân tố sản phẩm của SVD
+#
+# Điểm SVD (bỏ qua phần hằng số của user) là tích vô hướng [pu, 1] . [qi, bi], nên tìm
+# sản phẩm điểm cao nhất là bài toán maximum inner product search. Thêm một chiều
+# sqrt(M^2 - |x|^2) vào vector sản phẩm (và 0 vào vector truy vấn) để đổi thành tìm
+# láng giềng gần nhất theo khoảng cách Euclid, rồi gom cụm bằng k-means. Khi truy vấn
+# chỉ chấm điểm chính xác các sản phẩm trong nprobe cụm gần nhất.
+#
+# Định dạng lưu trên đĩa (cùng thư mục phiên bản với scorer):
+#     ann_centroids.npy, ann_order.npy, ann_offsets.npy, ann.json
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+from loguru import logger
+
+from models.recommendation.scorer import SVDScorer, top_n_matrix
+
+ANN_CONFIG_FILENAME = "ann.json"
+ANN_ARRAY_NAMES = ("centroids", "order", "offsets")
+
+# Bật/tắt việc dựng chỉ mục khi publish, số sản phẩm tối thiểu (ít hơn thì chấm toàn bộ đã đủ nhanh)
+ANN_ENABLED = os.getenv("RECOMMENDER_ANN_ENABLED", "true").lower() in ("1", "true", "yes")
+ANN_MIN_ITEMS = int(os.getenv("RECOMMENDER_ANN_MIN_ITEMS", "5000"))
+# Số cụm (0 = khoảng sqrt(số sản phẩm)) và số cụm được xét mỗi truy vấn (0 = 1/8 số cụm)
+ANN_LISTS = int(os.getenv("RECOMMENDER_ANN_LISTS", "0"))
+ANN_NPROBE = int(os.getenv("RECOMMENDER_ANN_NPROBE", "0"))
+ANN_KMEANS_ITERATIONS = int(os.getenv("RECOMMENDER_ANN_KMEANS_ITERATIONS", "10"))
+# Đánh giá recall@N so với chấm toàn bộ trên một mẫu user, chỉ dùng chỉ mục khi đạt ngưỡng
+ANN_EVAL_USERS = int(os.getenv("RECOMMENDER_ANN_EVAL_USERS", "200"))
+ANN_EVAL_TOP_N = int(os.getenv("RECOMMENDER_ANN_EVAL_TOP_N", "10"))
+ANN_MIN_RECALL = float(os.getenv("RECOMMENDER_ANN_MIN_RECALL", "0.9"))
+# Recall chưa đạt thì tăng gấp đôi nprobe và đo lại, tới tối đa tỉ lệ này của số cụm
+# (xét nhiều cụm hơn thì chỉ mục không còn nhanh hơn chấm toàn bộ bao nhiêu)
+ANN_MAX_NPROBE_FRACTION = float(os.getenv("RECOMMENDER_ANN_MAX_NPROBE_FRACTION", "0.5"))
+
+# Số hàng mỗi khối khi tính khoảng cách tới các tâm cụm
+_BLOCK_ROWS = 8192
+
+
+def _item_vectors(scorer: SVDScorer) -> np.ndarray:
+    """Vector sản phẩm [qi, bi] (model không bias: chỉ qi)"""
+    qi = np.asarray(scorer.qi, dtype=np.float64)
+    if scorer.biased:
+        return np.hstack([qi, np.asarray(scorer.bi, dtype=np.float64)[:, None]])
+    return qi
+
+
+def _query_vector(scorer: SVDScorer, user_row: int) -> np.ndarray:
+    pu = np.asarray(scorer.pu[user_row], dtype=np.float64)
+    return np.append(pu, 1.0) if scorer.biased else pu
+
+
+def _augment(vectors: np.ndarray) -> np.ndarray:
+    """Thêm chiều sqrt(M^2 - |x|^2) để tích vô hướng lớn nhất = khoảng cách nhỏ nhất"""
+    norms = np.einsum("ij,ij->i", vectors, vectors)
+    extra = np.sqrt(np.maximum(norms.max(initial=0.0) - norms, 0.0))
+    return np.hstack([vectors, extra[:, None]])
+
+
+def _nearest_centroids(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Tâm cụm gần nhất của từng điểm, tính theo khối để giới hạn bộ nhớ"""
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), _BLOCK_ROWS):
+        block = points[start:start + _BLOCK_ROWS]
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2, bỏ |x|^2 vì không đổi theo c
+        labels[start:start + _BLOCK_ROWS] = np.argmin(centroid_norms - 2.0 * block @ centroids.T, axis=1)
+    return labels
+
+
+def _kmeans(points: np.ndarray, n_lists: int, iterations: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centroids = points[rng.choice(len(points), n_lists, replace=False)].copy()
+    labels = _nearest_centroids(points, centroids)
+    for _ in range(max(1, iterations)):
+        counts = np.bincount(labels, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Cụm rỗng: lấy lại một điểm ngẫu nhiên làm tâm
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = points[rng.choice(len(points), len(empty), replace=False)]
+        labels = _nearest_centroids(points, centroids)
+    return centroids, labels
+
+
+class ItemFactorIndex:
+    """
+    Chỉ mục IVF trên nhân tố sản phẩm của một phiên bản model
+
+    Các sản phẩm được xếp theo cụm: order[offsets[l]:offsets[l + 1]] là chỉ số
+    hàng (trong qi) của các sản phẩm thuộc cụm l.
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray,
+                 nprobe: int = 0, recall: Optional[float] = None):
+        """
+        Args:
+            centroids: Tâm cụm trong không gian đã thêm chiều (số cụm, d + 1)
+            order: Chỉ số sản phẩm xếp theo cụm
+            offsets: Vị trí bắt đầu của từng cụm trong order (số cụm + 1)
+            nprobe: Số cụm xét mặc định mỗi truy vấn (0 = 1/8 số cụm)
+            recall: Recall@N đo được khi dựng chỉ mục
+        """
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe if nprobe > 0 else max(1, self.n_lists // 8)
+        self.recall = recall
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, scorer: SVDScorer, n_lists: int = ANN_LISTS, nprobe: int = ANN_NPROBE,
+              iterations: int = ANN_KMEANS_ITERATIONS) -> "ItemFactorIndex":
+        """Gom cụm nhân tố sản phẩm của scorer"""
+        points = _augment(_item_vectors(scorer))
+        if n_lists <= 0:
+            n_lists = int(np.sqrt(len(points)))
+        n_lists = max(1, min(n_lists, len(points)))
+        centroids, labels = _kmeans(points, n_lists, iterations)
+        order = np.argsort(labels, kind="stable").astype(np.int64)
+        offsets = np.searchsorted(labels[order], np.arange(n_lists + 1)).astype(np.int64)
+        return cls(centroids, order, offsets, nprobe=nprobe or ANN_NPROBE)
+
+    def candidates(self, scorer: SVDScorer, user_row: int, nprobe: Optional[int] = None) -> np.ndarray:
+        """
+        Chỉ số sản phẩm trong nprobe cụm gần vector của user nhất
+
+        Args:
+            scorer: Scorer của cùng phiên bản model
+            user_row: Chỉ số hàng của user trong pu
+            nprobe: Số cụm xét (None = mặc định của chỉ mục), càng lớn recall càng cao
+        """
+        nprobe = min(self.n_lists, nprobe or self.nprobe)
+        query = np.append(_query_vector(scorer, user_row), 0.0)
+        # Gần nhất theo Euclid: lớn nhất theo 2 q.c - |c|^2
+        closeness = 2.0 * self.centroids @ query - np.einsum("ij,ij->i", self.centroids, self.centroids)
+        if nprobe < self.n_lists:
+            lists = np.argpartition(-closeness, nprobe - 1)[:nprobe]
+        else:
+            lists = np.arange(self.n_lists)
+        return np.concatenate([self.order[self.offsets[l]:self.offsets[l + 1]] for l in lists])
+
+    def evaluate_recall(self, scorer: SVDScorer, n_users: int = ANN_EVAL_USERS, top_n: int = ANN_EVAL_TOP_N,
+                        nprobe: Optional[int] = None, seed: int = 0) -> float:
+        """
+        Recall@top_n so với chấm toàn bộ sản phẩm, trên một mẫu user ngẫu nhiên
+
+        Returns:
+            Tỉ lệ sản phẩm trong top_n chính xác mà chỉ mục cũng tìm được
+        """
+        if scorer.n_users == 0 or scorer.n_items == 0:
+            return 1.0
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(scorer.n_users, min(n_users, scorer.n_users), replace=False)
+        exact = top_n_matrix(scorer.score_users(scorer.user_ids[rows]), top_n)
+
+        found = total = 0
+        for row, expected in zip(rows, exact):
+            customer_id = scorer.user_ids[row]
+            expected = expected[expected >= 0]
+            approx_scores = np.sort(scorer.score_items_at(customer_id, self.candidates(scorer, int(row), nprobe)))
+            approx_scores = approx_scores[::-1][:len(expected)]
+            # So theo điểm: sản phẩm khác nhưng bằng điểm ở biên top_n (ví dụ cùng bị cắt
+            # về điểm cao nhất) vẫn được tính là tìm đúng, chừa sai số làm tròn của phép nhân
+            threshold = scorer.score_items_at(customer_id, expected).min(initial=np.inf)
+            found += int(np.sum(approx_scores >= threshold - 1e-9))
+            total += len(expected)
+        return found / total if total else 1.0
+
+    def save(self, path: str) -> None:
+        """Lưu chỉ mục vào thư mục phiên bản"""
+        for name in ANN_ARRAY_NAMES:
+            np.save(os.path.join(path, f"ann_{name}.npy"), getattr(self, name))
+        config = {"n_lists": self.n_lists, "nprobe": self.nprobe, "recall": self.recall}
+        with open(os.path.join(path, ANN_CONFIG_FILENAME), "w", encoding="utf-8") as handle:
+            json.dump(config, handle, indent=2)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = "r") -> Optional["ItemFactorIndex"]:
+        """Mở chỉ mục đã lưu, None nếu phiên bản không có chỉ mục"""
+        config_path = os.path.join(path, ANN_CONFIG_FILENAME)
+        if not os.path.exists(config_path):
+            return None
+        with open(config_path, "r", encoding="utf-8") as handle:
+            config = json.load(handle)
+        arrays = {name: np.load(os.path.join(path, f"ann_{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ANN_ARRAY_NAMES}
+        # ANN_NPROBE cho phép chỉnh recall/độ trễ khi phục vụ mà không cần dựng lại chỉ mục
+        return cls(nprobe=ANN_NPROBE or config["nprobe"], recall=config.get("recall"), **arrays)
+
+    def info(self) -> Dict[str, Any]:
+        return {"n_lists": self.n_lists, "nprobe": self.nprobe, "recall": self.recall}
+
+
+def build_item_index(scorer: SVDScorer) -> Optional[ItemFactorIndex]:
+    """
+    Dựng và đánh giá chỉ mục cho scorer vừa huấn luyện (gọi trước khi publish)
+
+    nprobe bắt đầu từ giá trị cấu hình và được tăng gấp đôi tới khi recall đạt ANN_MIN_RECALL
+    (tối đa ANN_MAX_NPROBE_FRACTION số cụm); nprobe và recall đo được được lưu cùng chỉ mục.
+
+    Returns:
+        Chỉ mục, hoặc None khi bị tắt, quá ít sản phẩm hoặc recall dưới ANN_MIN_RECALL
+    """
+    if not ANN_ENABLED or scorer.n_items < ANN_MIN_ITEMS:
+        return None
+    index = ItemFactorIndex.build(scorer)
+    max_nprobe = max(index.nprobe, int(index.n_lists * ANN_MAX_NPROBE_FRACTION))
+    while True:
+        index.recall = round(index.evaluate_recall(scorer), 4)
+        logger.info(f"Item factor index: {index.n_lists} lists, nprobe {index.nprobe}, "
+                    f"recall@{ANN_EVAL_TOP_N} {index.recall}")
+        if index.recall >= ANN_MIN_RECALL or index.nprobe >= max_nprobe:
+            break
+        index.nprobe = min(max_nprobe, index.nprobe * 2)
+    if index.recall < ANN_MIN_RECALL:
+        logger.warning(f"Item factor index recall {index.recall} is below {ANN_MIN_RECALL} "
+                       f"with nprobe {index.nprobe}, using exact scoring")
+        return None
+    return index
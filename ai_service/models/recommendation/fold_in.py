@@ -0,0 +1,195 @@
+# models/recommendation/fold_in.py
+# Thêm user/sản phẩm mới vào model đang phục vụ mà không huấn luyện lại toàn bộ
+#
+# Nhân tố của user/sản phẩm đã có được giữ nguyên, chỉ nhân tố (và bias) của
+# phần tử mới được giải bằng vài bước ALS trên các hành động gần đây. Huấn luyện
+# lại toàn bộ định kỳ (services/training_jobs.py) sẽ sửa phần sai lệch tích lũy.
+import asyncio
+import os
+import time
+from concurrent.futures import Executor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from models.recommendation.ann_index import build_item_index
+from models.recommendation.registry import registry
+from models.recommendation.scorer import SVDScorer
+from models.recommendation.trainer import get_user_behavior
+
+# Số vòng ALS (user mới -> sản phẩm mới) và hệ số regularization (nhân với số rating của phần tử)
+FOLD_IN_STEPS = int(os.getenv("RECOMMENDER_FOLD_IN_STEPS", "3"))
+FOLD_IN_REG = float(os.getenv("RECOMMENDER_FOLD_IN_REG", "0.1"))
+# Khoảng thời gian lấy hành động khi phiên bản đang phục vụ không ghi data_until
+FOLD_IN_WINDOW_HOURS = float(os.getenv("RECOMMENDER_FOLD_IN_WINDOW_HOURS", "72"))
+
+
+def _solve_rows(entities: np.ndarray, features: np.ndarray, targets: np.ndarray,
+                n_entities: int, reg: float) -> np.ndarray:
+    """
+    Giải ridge regression cho từng phần tử: (X^T X + reg * n I) w = X^T y
+
+    Args:
+        entities: Phần tử (0..n_entities-1) của từng rating
+        features: Vector của phía còn lại cho từng rating (số rating, d)
+        targets: Giá trị cần khớp cho từng rating
+        n_entities: Số phần tử cần giải
+        reg: Hệ số regularization
+
+    Returns:
+        Ma trận nghiệm (n_entities, d), phần tử không có rating giữ vector 0
+    """
+    dim = features.shape[1]
+    solution = np.zeros((n_entities, dim))
+    order = np.argsort(entities, kind="stable")
+    bounds = np.searchsorted(entities[order], np.arange(n_entities + 1))
+    identity = np.eye(dim)
+    for entity in range(n_entities):
+        rows = order[bounds[entity]:bounds[entity + 1]]
+        if len(rows) == 0:
+            continue
+        x = features[rows]
+        solution[entity] = np.linalg.solve(x.T @ x + reg * len(rows) * identity, x.T @ targets[rows])
+    return solution
+
+
+def fold_in(scorer: SVDScorer, customer_ids: np.ndarray, product_ids: np.ndarray, ratings: np.ndarray,
+            steps: int = FOLD_IN_STEPS, reg: float = FOLD_IN_REG) -> Tuple[Optional[SVDScorer], Dict[str, int]]:
+    """
+    Tạo scorer mới có thêm các user/sản phẩm chưa có trong scorer
+
+    Args:
+        scorer: Model đang phục vụ
+        customer_ids: Raw id user của từng rating
+        product_ids: Raw id sản phẩm của từng rating
+        ratings: Tổng điểm hành động của từng cặp (cùng cách tính với trainer)
+        steps: Số vòng ALS
+        reg: Hệ số regularization
+
+    Returns:
+        (scorer mới hoặc None nếu không có phần tử mới, thống kê)
+    """
+    customer_ids = np.asarray(customer_ids, dtype=str)
+    product_ids = np.asarray(product_ids, dtype=str)
+    ratings = np.asarray(ratings, dtype=np.float64)
+
+    user_rows = scorer.user_indices(customer_ids)
+    item_rows = scorer.item_indices(product_ids)
+    new_users = np.unique(customer_ids[user_rows < 0])
+    new_items = np.unique(product_ids[item_rows < 0])
+    stats = {"ratings": len(ratings), "new_users": len(new_users), "new_items": len(new_items)}
+    if not len(new_users) and not len(new_items):
+        return None, stats
+
+    # Phần tử mới được nối vào cuối các ma trận nhân tố
+    n_users, n_items = scorer.n_users, scorer.n_items
+    is_new_user = user_rows < 0
+    is_new_item = item_rows < 0
+    user_rows[is_new_user] = n_users + np.searchsorted(new_users, customer_ids[is_new_user])
+    item_rows[is_new_item] = n_items + np.searchsorted(new_items, product_ids[is_new_item])
+
+    n_factors = scorer.qi.shape[1]
+    pu = np.vstack([scorer.pu, np.zeros((len(new_users), n_factors))])
+    qi = np.vstack([scorer.qi, np.zeros((len(new_items), n_factors))])
+    bu = np.concatenate([scorer.bu, np.zeros(len(new_users))])
+    bi = np.concatenate([scorer.bi, np.zeros(len(new_items))])
+
+    def features(factors: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        # Model có bias: giải cả bias của phần tử mới bằng một cột hằng số 1
+        if scorer.biased:
+            return np.hstack([factors[rows], np.ones((len(rows), 1))])
+        return factors[rows]
+
+    def targets(other_biases: np.ndarray, rows: np.ndarray, selected: np.ndarray) -> np.ndarray:
+        if scorer.biased:
+            return ratings[selected] - scorer.global_mean - other_biases[rows]
+        return ratings[selected]
+
+    user_selected = np.flatnonzero(is_new_user)
+    item_selected = np.flatnonzero(is_new_item)
+    for _ in range(max(1, steps)):
+        if len(new_users):
+            rows = item_rows[user_selected]
+            solution = _solve_rows(user_rows[user_selected] - n_users, features(qi, rows),
+                                   targets(bi, rows, user_selected), len(new_users), reg)
+            pu[n_users:] = solution[:, :n_factors]
+            if scorer.biased:
+                bu[n_users:] = solution[:, n_factors]
+        if len(new_items):
+            rows = user_rows[item_selected]
+            solution = _solve_rows(item_rows[item_selected] - n_items, features(pu, rows),
+                                   targets(bu, rows, item_selected), len(new_items), reg)
+            qi[n_items:] = solution[:, :n_factors]
+            if scorer.biased:
+                bi[n_items:] = solution[:, n_factors]
+
+    folded = SVDScorer(
+        pu=pu, qi=qi, bu=bu, bi=bi,
+        global_mean=scorer.global_mean,
+        user_ids=np.concatenate([scorer.user_ids, new_users]),
+        item_ids=np.concatenate([scorer.item_ids, new_items]),
+        rating_scale=(scorer.lower, scorer.higher),
+        biased=scorer.biased,
+    )
+    # Sản phẩm mới làm thay đổi các cụm nên dựng lại chỉ mục
+    folded.ann_index = build_item_index(folded)
+    return folded, stats
+
+
+async def run_fold_in(executor: Optional[Executor] = None,
+                      on_phase: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Fold-in các user/sản phẩm mới từ hành động sau lần huấn luyện trước và publish phiên bản mới
+
+    Args:
+        executor: Nơi chạy fold_in (None = executor mặc định của event loop)
+        on_phase: Hàm được gọi khi chuyển bước (extracting, fitting, publishing)
+
+    Returns:
+        Thông tin lần cập nhật (version = None khi không có gì mới)
+    """
+    def phase(name: str) -> None:
+        if on_phase is not None:
+            on_phase(name)
+
+    phase("extracting")
+    started = time.perf_counter()
+    base = registry.get_scorer()
+    meta = registry.metadata()
+    data_until = datetime.utcnow()
+    since = (datetime.fromisoformat(meta["data_until"]) if meta.get("data_until")
+             else data_until - timedelta(hours=FOLD_IN_WINDOW_HOURS))
+
+    interactions = await get_user_behavior(since=since)
+    size = len(interactions)
+    customer_ids = interactions.user_ids[interactions.user_codes[:size]] if size else np.empty(0, dtype=str)
+    product_ids = interactions.product_ids[interactions.product_codes[:size]] if size else np.empty(0, dtype=str)
+    extracted = time.perf_counter()
+
+    phase("fitting")
+    scorer, stats = await asyncio.get_running_loop().run_in_executor(
+        executor, fold_in, base, customer_ids, product_ids, interactions.scores[:size]
+    )
+    fitted = time.perf_counter()
+
+    version = None
+    if scorer is not None:
+        phase("publishing")
+        version = registry.publish(scorer, {
+            "kind": "fold_in",
+            "base_version": meta.get("version"),
+            # User/sản phẩm đã có chỉ được cập nhật thêm ở lần huấn luyện lại toàn bộ
+            "data_until": data_until.isoformat(),
+            **stats,
+        })
+
+    return {
+        "version": version,
+        "since": since.isoformat(),
+        **stats,
+        "users": scorer.n_users if scorer is not None else base.n_users,
+        "products": scorer.n_items if scorer is not None else base.n_items,
+        "extract_seconds": round(extracted - started, 3),
+        "fit_seconds": round(fitted - extracted, 3),
+    }
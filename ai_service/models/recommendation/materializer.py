@@ -0,0 +1,113 @@
+# models/recommendation/materializer.py
+# Tính trước top-N sản phẩm cho mọi user của model và lưu vào recommendations
+#
+# recommendations: {customer_id, ..., recommended_product_ids, recommended_model_version, recommended_at}
+# (các trường khác do UserBehaviorAnalyzer ghi, không bị thay đổi)
+import asyncio
+import os
+import time
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+from bson import ObjectId
+from loguru import logger
+from pymongo import UpdateOne
+
+from database.mongo import recommendation_collection
+from models.recommendation.recommender import catalog_item_indices, get_seen_product_ids_for_users
+from models.recommendation.registry import registry
+from models.recommendation.scorer import SVDScorer, top_n_matrix
+from utils.product_catalog import CatalogSnapshot, product_catalog
+
+# Số sản phẩm lưu cho mỗi user và số user chấm điểm cùng lúc (giới hạn bộ nhớ: số user x số sản phẩm)
+MATERIALIZE_TOP_N = int(os.getenv("RECOMMENDER_MATERIALIZE_TOP_N", "50"))
+MATERIALIZE_BLOCK_USERS = int(os.getenv("RECOMMENDER_MATERIALIZE_BLOCK_USERS", "256"))
+
+
+def _top_products_block(scorer: SVDScorer, snapshot: CatalogSnapshot, item_indices: np.ndarray,
+                        customer_ids: List[str], seen: Dict[str, set], top_n: int) -> List[List[str]]:
+    """
+    Top_n sản phẩm trong catalog cho một khối user, bỏ qua sản phẩm đã xem
+
+    Cùng kết quả với recommend_product_ids(exact=True) cho từng user.
+    """
+    known = item_indices >= 0
+
+    scores = np.empty((len(customer_ids), len(snapshot)))
+    # Sản phẩm model chưa biết nhận điểm mặc định của từng user
+    scores[:] = np.asarray([scorer.unknown_item_score(cid) for cid in customer_ids])[:, None]
+    if known.any():
+        scores[:, known] = scorer.score_users(customer_ids, item_indices[known])
+
+    exclude = np.zeros(scores.shape, dtype=bool)
+    for row, cid in enumerate(customer_ids):
+        positions = [snapshot.positions[pid] for pid in seen.get(cid, ()) if pid in snapshot.positions]
+        exclude[row, positions] = True
+
+    top = top_n_matrix(scores, top_n, exclude)
+    return [snapshot.product_ids[indices[indices >= 0]].tolist() for indices in top]
+
+
+async def run_materialization(executor: Optional[Executor] = None,
+                              on_phase: Optional[Callable[[str], None]] = None,
+                              top_n: int = MATERIALIZE_TOP_N,
+                              block_users: int = MATERIALIZE_BLOCK_USERS) -> Dict[str, Any]:
+    """
+    Chấm điểm mọi user của model theo từng khối và ghi top_n sản phẩm bằng bulk_write
+
+    Args:
+        executor: Nơi chạy phần tính điểm (None = executor mặc định của event loop)
+        on_phase: Hàm được gọi khi chuyển bước (scoring)
+        top_n: Số sản phẩm lưu cho mỗi user
+        block_users: Số user mỗi khối
+
+    Returns:
+        Thông tin lần chạy: phiên bản model, số user đã ghi, thời gian
+    """
+    if on_phase is not None:
+        on_phase("scoring")
+    started = time.perf_counter()
+    scorer = registry.get_scorer()
+    # Phiên bản đi cùng scorer đang dùng, không đọc lại CURRENT (có thể đã đổi sau khi tải)
+    version = scorer.version or "legacy"
+    snapshot = await product_catalog.get_snapshot()
+    item_indices = catalog_item_indices(snapshot, scorer)
+    loop = asyncio.get_running_loop()
+
+    # customer_id trong recommendations là ObjectId
+    customer_ids = [cid for cid in scorer.user_ids.tolist() if ObjectId.is_valid(cid)]
+    written = 0
+    block_users = max(1, block_users)
+    for start in range(0, len(customer_ids), block_users):
+        block = customer_ids[start:start + block_users]
+        seen = await get_seen_product_ids_for_users(block)
+        top_products = await loop.run_in_executor(
+            executor, _top_products_block, scorer, snapshot, item_indices, block, seen, top_n
+        )
+
+        generated_at = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {"customer_id": ObjectId(cid)},
+                {"$set": {
+                    "recommended_product_ids": products,
+                    "recommended_model_version": version,
+                    "recommended_at": generated_at,
+                }},
+                upsert=True
+            )
+            for cid, products in zip(block, top_products)
+        ]
+        await recommendation_collection.bulk_write(operations, ordered=False)
+        written += len(operations)
+        logger.info(f"Materialized recommendations: {written}/{len(customer_ids)} users")
+
+    return {
+        "version": version,
+        "users": written,
+        "products": len(snapshot),
+        "top_n": top_n,
+        "duration_seconds": round(time.perf_counter() - started, 3),
+    }
@@ -1,74 +1,153 @@
-import joblib
 import os
-from database.mongo import user_action_collection, product_collection
+import numpy as np
+from bson import ObjectId
+from database.mongo import user_action_collection
+from models.recommendation.registry import registry
+from models.recommendation.scorer import SVDScorer, top_n_indices
+from utils.product_catalog import CatalogSnapshot, product_catalog
 
-MODEL_PATH = "models/recommendation/model.pkl"
+# Cách tổng hợp keyword mặc định của recommend_keywords
+KEYWORD_WEIGHTINGS = ("score", "count")
+KEYWORD_WEIGHTING = os.getenv("RECOMMENDER_KEYWORD_WEIGHTING", "score")
 
 def load_model():
-    if not os.path.exists(MODEL_PATH):
-        raise FileNotFoundError("Model not found. Train first.")
-    return joblib.load(MODEL_PATH)
+    # Model (SVDScorer) được giữ trong bộ nhớ, chỉ tải lại khi trainer publish phiên bản mới
+    return registry.get_scorer()
 
 
 async def get_all_product_ids():
-    cursor = product_collection.find({}, {"_id": 1})
-    docs = await cursor.to_list(length=None)
-    return [str(p["_id"]) for p in docs]
-
-
-async def get_user_seen_product_ids(customer_id: str):
-    cursor = user_action_collection.find({"customer_id": customer_id}, {"product_id": 1})
-    docs = await cursor.to_list(length=None)
-    return set(str(doc["product_id"]) for doc in docs)
-
-
-async def recommend_product_ids(customer_id: str, top_n: int = 10) -> list:
-    model =  load_model()
-    all_products = await get_all_product_ids()
-    seen_products = await get_user_seen_product_ids(customer_id)
-
-    candidates = [pid for pid in all_products if pid not in seen_products]
-
-    predictions = [
-        (pid, model.predict(customer_id, pid).est) for pid in candidates
-    ]
-    sorted_preds = sorted(predictions, key=lambda x: x[1], reverse=True)[:top_n]
-    return [pid for pid, _ in sorted_preds]
-
-async def recommend_keywords(customer_id: str, top_n: int = 10) -> list[str]:
-    model = load_model()
-
-    # Lấy toàn bộ sản phẩm kèm theo keyword
-    cursor = product_collection.find({}, {"_id": 1, "keywords": 1})
-    products = await cursor.to_list(length=None)
-    all_products = [
-        {"product_id": str(p["_id"]), "keywords": p.get("keywords", [])}
-        for p in products
-    ]
+    # Đọc từ catalog trong bộ nhớ thay vì quét collection products mỗi request
+    snapshot = await product_catalog.get_snapshot()
+    return snapshot.product_ids.tolist()
+
+
+def catalog_item_indices(snapshot: CatalogSnapshot, scorer: SVDScorer) -> np.ndarray:
+    """Chỉ số trong model của từng sản phẩm trong catalog (tính một lần cho mỗi cặp catalog/model)"""
+    return snapshot.cached("item_indices", lambda: scorer.item_indices(snapshot.product_ids), owner=scorer)
+
+
+def catalog_item_positions(snapshot: CatalogSnapshot, scorer: SVDScorer) -> np.ndarray:
+    """Vị trí trong catalog của từng sản phẩm trong model, -1 nếu sản phẩm không còn trong catalog"""
+    def build() -> np.ndarray:
+        item_indices = catalog_item_indices(snapshot, scorer)
+        positions = np.full(scorer.n_items, -1, dtype=np.int64)
+        known = item_indices >= 0
+        positions[item_indices[known]] = np.flatnonzero(known)
+        return positions
+    return snapshot.cached("item_positions", build, owner=scorer)
+
+
+def ann_top_positions(scorer: SVDScorer, snapshot: CatalogSnapshot, customer_id: str,
+                      top_n: int, exclude: np.ndarray):
+    """
+    Top_n vị trí trong catalog tìm qua chỉ mục sản phẩm của model
+
+    Chỉ chấm điểm các sản phẩm trong các cụm gần user nhất, cộng với các sản phẩm
+    trong catalog mà model chưa biết (cùng một điểm mặc định).
+
+    Returns:
+        Mảng vị trí theo điểm giảm dần, None khi cần chấm toàn bộ (không có chỉ mục,
+        user chưa có trong model hoặc không đủ ứng viên)
+    """
+    index = scorer.ann_index
+    user_row = scorer.user_index(customer_id)
+    if index is None or user_row is None:
+        return None
+
+    items = index.candidates(scorer, user_row)
+    positions = catalog_item_positions(snapshot, scorer)[items]
+    keep = positions >= 0
+    keep[keep] = ~exclude[positions[keep]]
+    items, positions = items[keep], positions[keep]
+    unknown = np.flatnonzero((catalog_item_indices(snapshot, scorer) < 0) & ~exclude)
+    if len(positions) + len(unknown) < top_n:
+        return None
+
+    candidates = np.concatenate([positions, unknown])
+    scores = np.concatenate([
+        scorer.score_items_at(customer_id, items),
+        np.full(len(unknown), scorer.unknown_item_score(customer_id)),
+    ])
+    # Xếp ứng viên theo vị trí trong catalog để điểm bằng nhau giữ thứ tự như khi chấm toàn bộ
+    order = np.argsort(candidates, kind="stable")
+    candidates, scores = candidates[order], scores[order]
+    return candidates[top_n_indices(scores, top_n)]
+
+
+async def get_seen_product_ids_for_users(customer_ids: list) -> dict:
+    """
+    Sản phẩm đã tương tác của nhiều user bằng một truy vấn $in
+
+    customer_id trong useractions có thể là ObjectId hoặc chuỗi nên tìm theo cả hai dạng.
+
+    Returns:
+        Dict customer_id (chuỗi) -> set product_id
+    """
+    seen = {str(cid): set() for cid in customer_ids}
+    values = list(seen) + [ObjectId(cid) for cid in seen if ObjectId.is_valid(cid)]
+    cursor = user_action_collection.find({"customer_id": {"$in": values}}, {"customer_id": 1, "product_id": 1})
+    async for doc in cursor:
+        seen[str(doc["customer_id"])].add(str(doc["product_id"]))
+    return seen
+
+
+def seen_mask(product_ids: list, seen_products: set) -> np.ndarray:
+    """Mảng bool đánh dấu các sản phẩm user đã tương tác"""
+    if not seen_products:
+        return np.zeros(len(product_ids), dtype=bool)
+    return np.isin(np.asarray(product_ids, dtype=str), np.asarray(list(seen_products), dtype=str))
+
+
+async def recommend_product_ids(customer_id: str, top_n: int = 10, exact: bool = False) -> list:
+    scorer = registry.get_scorer()
+    snapshot = await product_catalog.get_snapshot()
+    seen_products = (await get_seen_product_ids_for_users([customer_id]))[str(customer_id)]
+    exclude = seen_mask(snapshot.product_ids, seen_products)
+
+    # Có chỉ mục sản phẩm thì chỉ chấm các sản phẩm gần user (exact=True để chấm toàn bộ)
+    top = None if exact else ann_top_positions(scorer, snapshot, customer_id, top_n, exclude)
+    if top is None:
+        # Điểm của mọi sản phẩm tính bằng một phép nhân ma trận, bỏ qua sản phẩm đã xem
+        scores = scorer.score_products(customer_id, snapshot.product_ids, catalog_item_indices(snapshot, scorer))
+        top = top_n_indices(scores, top_n, exclude=exclude)
+    return snapshot.product_ids[top].tolist()
+
+async def recommend_keywords(customer_id: str, top_n: int = 10, weighting: str = KEYWORD_WEIGHTING) -> list[str]:
+    """
+    Gợi ý keyword từ các sản phẩm user chưa xem
+
+    Tổng hợp bằng một phép nhân ma trận thưa keyword x sản phẩm với vector trọng
+    số của sản phẩm.
+
+    Args:
+        customer_id: ID của user
+        top_n: Số keyword trả về
+        weighting: "score" = mỗi sản phẩm góp điểm dự đoán của nó,
+                   "count" = mỗi sản phẩm góp 1 (đếm tần suất như trước)
+    """
+    if weighting not in KEYWORD_WEIGHTINGS:
+        raise ValueError(f"Unsupported keyword weighting '{weighting}', expected one of {KEYWORD_WEIGHTINGS}")
+
+    scorer = registry.get_scorer()
+
+    # Toàn bộ sản phẩm kèm theo keyword lấy từ catalog trong bộ nhớ
+    snapshot = await product_catalog.get_snapshot()
+    keyword_matrix, vocabulary = snapshot.keyword_matrix()
+    if not len(vocabulary):
+        return []
 
     # Lấy sản phẩm đã xem
-    seen_cursor = user_action_collection.find({"customer_id": customer_id}, {"product_id": 1})
-    seen_docs = await seen_cursor.to_list(length=None)
-    seen_products = {str(doc["product_id"]) for doc in seen_docs}
-
-    # Lọc ra sản phẩm chưa xem
-    unseen_products = [p for p in all_products if p["product_id"] not in seen_products]
-
-    # Dự đoán điểm
-    predictions = [
-        (p["keywords"], model.predict(customer_id, p["product_id"]).est)
-        for p in unseen_products if p["keywords"]
-    ]
-
-    # Sắp xếp theo điểm
-    sorted_keywords = sorted(predictions, key=lambda x: x[1], reverse=True)
-
-    # Gộp tất cả keyword lại và đếm tần suất (tránh trùng)
-    from collections import Counter
-    flat_keywords = [kw for kws, _ in sorted_keywords for kw in kws]
-    keyword_counts = Counter(flat_keywords)
-
-    # Trả về các keyword phổ biến nhất
-    recommended_keywords = [kw for kw, _ in keyword_counts.most_common(top_n)]
-
-    return recommended_keywords
+    seen_products = (await get_seen_product_ids_for_users([customer_id]))[str(customer_id)]
+    unseen = ~seen_mask(snapshot.product_ids, seen_products)
+
+    # Trọng số của từng sản phẩm chưa xem
+    if weighting == "score":
+        weights = scorer.score_products(customer_id, snapshot.product_ids, catalog_item_indices(snapshot, scorer))
+        weights[~unseen] = 0.0
+    else:
+        weights = unseen.astype(np.float64)
+
+    # Tổng trọng số của từng keyword, lấy các keyword cao nhất
+    keyword_scores = keyword_matrix @ weights
+    top = top_n_indices(keyword_scores, top_n, exclude=keyword_scores <= 0)
+    return vocabulary[top].tolist()
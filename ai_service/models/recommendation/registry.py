@@ -0,0 +1,220 @@
+# models/recommendation/registry.py
+# Quản lý các phiên bản model recommendation trên đĩa và model đang phục vụ trong bộ nhớ
+#
+# Cấu trúc thư mục:
+#     models/recommendation/versions/<version>/*.npy, scorer.json  <- xem models/recommendation/scorer.py
+#     models/recommendation/versions/<version>/ann_*.npy, ann.json  <- chỉ mục tùy chọn, xem ann_index.py
+#     models/recommendation/versions/<version>/meta.json
+#     models/recommendation/CURRENT          <- tên phiên bản đang phục vụ
+#     models/recommendation/model.pkl        <- model surprise cũ (dùng khi chưa có CURRENT)
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import joblib
+from loguru import logger
+
+from models.recommendation.ann_index import ItemFactorIndex
+from models.recommendation.scorer import SVDScorer
+
+BASE_DIR = "models/recommendation"
+MODEL_FILENAME = "model.pkl"
+
+# Số phiên bản giữ lại trên đĩa (để rollback), thời gian tối thiểu giữa hai lần kiểm tra CURRENT
+KEEP_VERSIONS = int(os.getenv("RECOMMENDER_KEEP_VERSIONS", "5"))
+RELOAD_CHECK_SECONDS = float(os.getenv("RECOMMENDER_RELOAD_CHECK_SECONDS", "5"))
+# Mở các mảng bằng mmap để các uvicorn worker dùng chung page cache thay vì mỗi worker một bản
+USE_MMAP = os.getenv("RECOMMENDER_MMAP", "true").lower() in ("1", "true", "yes")
+
+
+class ModelRegistry:
+    """
+    Giữ model recommendation đã tải trong bộ nhớ và tự đổi sang phiên bản mới
+
+    Trainer ghi model vào thư mục phiên bản mới rồi đổi file CURRENT bằng
+    os.replace, các worker phát hiện CURRENT thay đổi (mtime/nội dung) và tải
+    phiên bản mới. Request đang chạy vẫn dùng model cũ cho tới khi xong.
+
+    Model được phục vụ dưới dạng SVDScorer (chỉ gồm các mảng cần cho việc chấm
+    điểm), không giữ đối tượng surprise SVD và trainset của nó.
+    """
+
+    def __init__(self, base_dir: str = BASE_DIR, keep_versions: int = KEEP_VERSIONS,
+                 reload_check_seconds: float = RELOAD_CHECK_SECONDS):
+        """
+        Args:
+            base_dir: Thư mục gốc chứa versions/ và CURRENT
+            keep_versions: Số phiên bản giữ lại trên đĩa
+            reload_check_seconds: Khoảng thời gian tối thiểu giữa hai lần kiểm tra phiên bản mới
+        """
+        self.base_dir = base_dir
+        self.versions_dir = os.path.join(base_dir, "versions")
+        self.current_path = os.path.join(base_dir, "CURRENT")
+        self.legacy_path = os.path.join(base_dir, MODEL_FILENAME)
+        self.keep_versions = max(1, int(keep_versions))
+        self.reload_check_seconds = max(0.0, float(reload_check_seconds))
+        self._lock = threading.Lock()
+        self._scorer: Optional[SVDScorer] = None
+        self._version: Optional[str] = None
+        self._source_mtime: Optional[float] = None
+        self._loaded_at: Optional[datetime] = None
+        self._last_check = 0.0
+        self.reloads = 0
+
+    def _resolve(self) -> Optional[Dict[str, Any]]:
+        """Tìm phiên bản cần phục vụ: theo CURRENT, không có thì dùng model.pkl cũ"""
+        try:
+            with open(self.current_path, "r", encoding="utf-8") as handle:
+                version = handle.read().strip()
+            path = os.path.join(self.versions_dir, version)
+            if version and os.path.isdir(path):
+                return {"version": version, "path": path, "mtime": os.path.getmtime(self.current_path)}
+            logger.warning(f"CURRENT points to missing recommender version '{version}'")
+        except FileNotFoundError:
+            pass
+
+        if os.path.exists(self.legacy_path):
+            return {"version": "legacy", "path": self.base_dir, "mtime": os.path.getmtime(self.legacy_path)}
+        return None
+
+    def _load(self, path: str) -> SVDScorer:
+        """Tải scorer từ thư mục phiên bản (định dạng .npy, hoặc pickle surprise cũ)"""
+        if SVDScorer.is_saved_at(path):
+            mmap_mode = "r" if USE_MMAP else None
+            scorer = SVDScorer.load(path, mmap_mode=mmap_mode)
+            scorer.ann_index = ItemFactorIndex.load(path, mmap_mode=mmap_mode)
+            return scorer
+        return SVDScorer.from_surprise(joblib.load(os.path.join(path, MODEL_FILENAME)))
+
+    def get_scorer(self) -> SVDScorer:
+        """
+        Lấy scorer của model đang phục vụ, tải lại nếu có phiên bản mới
+
+        Raises:
+            FileNotFoundError: Khi chưa có model nào được huấn luyện
+        """
+        now = time.monotonic()
+        if self._scorer is not None and now - self._last_check < self.reload_check_seconds:
+            return self._scorer
+
+        with self._lock:
+            self._last_check = now
+            target = self._resolve()
+            if target is None:
+                if self._scorer is not None:
+                    return self._scorer
+                raise FileNotFoundError("Model not found. Train first.")
+
+            if (self._scorer is None or target["version"] != self._version
+                    or target["mtime"] != self._source_mtime):
+                started = time.perf_counter()
+                scorer = self._load(target["path"])
+                scorer.version = target["version"]
+                # Đổi tham chiếu một lần, request khác thấy model cũ hoặc mới, không thấy nửa chừng
+                self._scorer = scorer
+                self._version = target["version"]
+                self._source_mtime = target["mtime"]
+                self._loaded_at = datetime.now()
+                self.reloads += 1
+                logger.info(f"Serving recommender version {self._version} "
+                            f"(loaded in {(time.perf_counter() - started) * 1000:.1f} ms)")
+            return self._scorer
+
+    def publish(self, scorer: SVDScorer, metadata: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Lưu model thành phiên bản mới và chuyển sang phục vụ phiên bản đó
+
+        Args:
+            scorer: Model đã huấn luyện (SVDScorer.from_surprise(model)), lưu kèm scorer.ann_index nếu có
+            metadata: Thông tin thêm lưu kèm (số tương tác, thời gian huấn luyện, ...)
+
+        Returns:
+            Tên phiên bản mới
+        """
+        os.makedirs(self.versions_dir, exist_ok=True)
+        version = datetime.now().strftime("%Y%m%d%H%M%S")
+        while os.path.exists(os.path.join(self.versions_dir, version)):
+            version = datetime.now().strftime("%Y%m%d%H%M%S%f")
+
+        # Ghi vào thư mục tạm rồi đổi tên để không worker nào thấy phiên bản ghi dở
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.versions_dir)
+        try:
+            scorer.save(staging)
+            if scorer.ann_index is not None:
+                scorer.ann_index.save(staging)
+            meta = {"version": version, "created_at": datetime.now().isoformat(), **(metadata or {})}
+            with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as handle:
+                json.dump(meta, handle, indent=2)
+            os.replace(staging, os.path.join(self.versions_dir, version))
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        self.activate(version)
+        self._prune()
+        return version
+
+    def activate(self, version: str) -> None:
+        """Chuyển CURRENT sang một phiên bản đã có (dùng cả khi rollback)"""
+        if not os.path.isdir(os.path.join(self.versions_dir, version)):
+            raise ValueError(f"Recommender version '{version}' does not exist")
+        fd, tmp_path = tempfile.mkstemp(prefix=".CURRENT-", dir=self.base_dir)
+        with os.fdopen(fd, "w", encoding="utf-8") as handle:
+            handle.write(version)
+        os.replace(tmp_path, self.current_path)
+        # Kiểm tra lại ngay ở lần get_model kế tiếp của tiến trình này
+        self._last_check = 0.0
+        logger.info(f"Activated recommender version {version}")
+
+    def list_versions(self) -> List[str]:
+        """Các phiên bản có trên đĩa, mới nhất trước"""
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(
+            (name for name in os.listdir(self.versions_dir)
+             if not name.startswith(".") and os.path.isdir(os.path.join(self.versions_dir, name))),
+            reverse=True
+        )
+
+    def _prune(self) -> None:
+        """Xóa các phiên bản cũ, luôn giữ phiên bản đang phục vụ"""
+        target = self._resolve()
+        for version in self.list_versions()[self.keep_versions:]:
+            if target is not None and version == target["version"]:
+                continue
+            shutil.rmtree(os.path.join(self.versions_dir, version), ignore_errors=True)
+            logger.info(f"Removed old recommender version {version}")
+
+    def metadata(self) -> Dict[str, Any]:
+        """meta.json của phiên bản trong CURRENT (rỗng với model cũ hoặc khi chưa có model)"""
+        target = self._resolve()
+        if target is None or target["version"] == "legacy":
+            return {}
+        meta_path = os.path.join(target["path"], "meta.json")
+        if not os.path.exists(meta_path):
+            return {}
+        with open(meta_path, "r", encoding="utf-8") as handle:
+            return json.load(handle)
+
+    def info(self) -> Dict[str, Any]:
+        """Thông tin phiên bản đang phục vụ và các phiên bản có sẵn"""
+        target = self._resolve()
+        meta = self.metadata()
+        return {
+            "serving_version": self._version,
+            "current_version": target["version"] if target else None,
+            "loaded_at": self._loaded_at.isoformat() if self._loaded_at else None,
+            "reloads": self.reloads,
+            "ann_index": self._scorer.ann_index.info()
+            if self._scorer is not None and self._scorer.ann_index is not None else None,
+            "metadata": meta,
+            "available_versions": self.list_versions(),
+        }
+
+
+registry = ModelRegistry()
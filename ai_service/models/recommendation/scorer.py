@@ -0,0 +1,328 @@
+# models/recommendation/scorer.py
+# Tính điểm SVD cho toàn bộ sản phẩm bằng phép nhân ma trận thay vì gọi model.predict từng sản phẩm
+#
+# Định dạng lưu trên đĩa (một thư mục phiên bản):
+#     pu.npy, qi.npy, bu.npy, bi.npy   <- nhân tố và bias
+#     user_ids.npy, item_ids.npy       <- raw id đã sắp xếp, vị trí = chỉ số hàng
+#     scorer.json                      <- global mean, rating_scale, biased
+import json
+import os
+from typing import Any, List, Optional, Sequence
+
+import numpy as np
+
+ARRAY_NAMES = ("pu", "qi", "bu", "bi", "user_ids", "item_ids")
+SCORER_CONFIG_FILENAME = "scorer.json"
+
+
+class SVDScorer:
+    """
+    Chấm điểm từ các ma trận nhân tố của SVD (pu, qi, bu, bi, global mean)
+
+    Cho cùng kết quả với surprise SVD.predict (kể cả user/sản phẩm chưa có trong
+    tập huấn luyện và việc cắt điểm theo rating_scale), nhưng tính điểm mọi
+    sản phẩm của một user bằng một phép nhân ma trận-vector.
+
+    Raw id được giữ dưới dạng mảng đã sắp xếp (hàng của ma trận theo cùng thứ tự)
+    và tra bằng searchsorted, nên mở bằng mmap không phải dựng lại dict nào.
+    """
+
+    def __init__(self, pu: np.ndarray, qi: np.ndarray, bu: np.ndarray, bi: np.ndarray,
+                 global_mean: float, user_ids: Sequence[str], item_ids: Sequence[str],
+                 rating_scale: Sequence[float] = (1, 10), biased: bool = True):
+        """
+        Args:
+            pu: Nhân tố user (số user, số nhân tố)
+            qi: Nhân tố sản phẩm (số sản phẩm, số nhân tố)
+            bu: Bias của user
+            bi: Bias của sản phẩm
+            global_mean: Điểm trung bình của tập huấn luyện
+            user_ids: Raw id của user theo thứ tự hàng của pu/bu
+            item_ids: Raw id của sản phẩm theo thứ tự hàng của qi/bi
+            rating_scale: Khoảng điểm (thấp nhất, cao nhất) dùng để cắt kết quả
+            biased: Model có dùng bias hay không
+        """
+        user_ids = np.asarray(user_ids, dtype=str)
+        item_ids = np.asarray(item_ids, dtype=str)
+        # Sắp xếp id (kèm các hàng tương ứng) để tra bằng searchsorted
+        if len(user_ids) > 1 and not np.all(user_ids[:-1] < user_ids[1:]):
+            order = np.argsort(user_ids, kind="stable")
+            user_ids, pu, bu = user_ids[order], pu[order], bu[order]
+        if len(item_ids) > 1 and not np.all(item_ids[:-1] < item_ids[1:]):
+            order = np.argsort(item_ids, kind="stable")
+            item_ids, qi, bi = item_ids[order], qi[order], bi[order]
+
+        self.pu = pu
+        self.qi = qi
+        self.bu = bu
+        self.bi = bi
+        self.global_mean = float(global_mean)
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.lower, self.higher = float(rating_scale[0]), float(rating_scale[1])
+        self.biased = bool(biased)
+        # Chỉ mục tìm sản phẩm gần đúng (models/recommendation/ann_index.py), None = chấm toàn bộ
+        self.ann_index = None
+        # Phiên bản trong registry, được gán khi registry tải model (None = chưa publish)
+        self.version: Optional[str] = None
+
+    @classmethod
+    def from_surprise(cls, model: Any) -> "SVDScorer":
+        """Tạo scorer từ model surprise SVD đã huấn luyện"""
+        trainset = model.trainset
+        return cls(
+            pu=np.asarray(model.pu),
+            qi=np.asarray(model.qi),
+            bu=np.asarray(model.bu),
+            bi=np.asarray(model.bi),
+            global_mean=trainset.global_mean,
+            user_ids=[trainset.to_raw_uid(inner) for inner in range(trainset.n_users)],
+            item_ids=[trainset.to_raw_iid(inner) for inner in range(trainset.n_items)],
+            rating_scale=trainset.rating_scale,
+            biased=model.biased,
+        )
+
+    def save(self, path: str) -> None:
+        """Lưu scorer vào thư mục (mỗi mảng một file .npy)"""
+        os.makedirs(path, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        config = {
+            "global_mean": self.global_mean,
+            "rating_scale": [self.lower, self.higher],
+            "biased": self.biased,
+            "n_users": self.n_users,
+            "n_items": self.n_items,
+            "n_factors": int(self.qi.shape[1]) if self.qi.ndim == 2 else 0,
+        }
+        with open(os.path.join(path, SCORER_CONFIG_FILENAME), "w", encoding="utf-8") as handle:
+            json.dump(config, handle, indent=2)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = "r") -> "SVDScorer":
+        """
+        Mở scorer đã lưu bằng save
+
+        Args:
+            path: Thư mục phiên bản
+            mmap_mode: "r" = ánh xạ file vào bộ nhớ, các worker dùng chung page cache
+                       của hệ điều hành; None = đọc hẳn vào bộ nhớ
+        """
+        with open(os.path.join(path, SCORER_CONFIG_FILENAME), "r", encoding="utf-8") as handle:
+            config = json.load(handle)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAY_NAMES}
+        return cls(
+            global_mean=config["global_mean"],
+            rating_scale=config["rating_scale"],
+            biased=config["biased"],
+            **arrays,
+        )
+
+    @staticmethod
+    def is_saved_at(path: str) -> bool:
+        """Thư mục có chứa scorer đã lưu hay không"""
+        return os.path.exists(os.path.join(path, SCORER_CONFIG_FILENAME))
+
+    @property
+    def n_users(self) -> int:
+        return len(self.user_ids)
+
+    @property
+    def n_items(self) -> int:
+        return len(self.item_ids)
+
+    @staticmethod
+    def _lookup(sorted_ids: np.ndarray, raw_ids: np.ndarray) -> np.ndarray:
+        """Tra vị trí của raw_ids trong mảng id đã sắp xếp, -1 nếu không có"""
+        if len(sorted_ids) == 0:
+            return np.full(len(raw_ids), -1, dtype=np.int64)
+        positions = np.searchsorted(sorted_ids, raw_ids)
+        positions[positions >= len(sorted_ids)] = 0
+        return np.where(sorted_ids[positions] == raw_ids, positions, -1).astype(np.int64)
+
+    def user_index(self, customer_id: str) -> Optional[int]:
+        """Chỉ số hàng của user, None nếu user chưa có trong tập huấn luyện"""
+        index = int(self._lookup(self.user_ids, np.asarray([str(customer_id)]))[0])
+        return index if index >= 0 else None
+
+    def user_indices(self, customer_ids: Sequence[str]) -> np.ndarray:
+        """Chỉ số hàng của nhiều user, -1 với user chưa có trong tập huấn luyện"""
+        return self._lookup(self.user_ids, np.asarray([str(cid) for cid in customer_ids], dtype=str))
+
+    def item_indices(self, product_ids: Sequence[str]) -> np.ndarray:
+        """Chỉ số hàng của nhiều sản phẩm, -1 với sản phẩm chưa có trong tập huấn luyện"""
+        return self._lookup(self.item_ids, np.asarray([str(pid) for pid in product_ids], dtype=str))
+
+    def _clip(self, scores: np.ndarray) -> np.ndarray:
+        return np.clip(scores, self.lower, self.higher, out=scores)
+
+    def score_items(self, customer_id: str) -> np.ndarray:
+        """
+        Điểm của user cho tất cả sản phẩm đã biết (theo thứ tự của item_ids)
+
+        Args:
+            customer_id: Raw id của user
+
+        Returns:
+            Mảng điểm (số sản phẩm,)
+        """
+        u = self.user_index(customer_id)
+        if not self.biased:
+            if u is None:
+                return self._clip(np.full(self.n_items, self.global_mean))
+            return self._clip(self.qi @ self.pu[u])
+
+        if u is None:
+            return self._clip(self.global_mean + self.bi)
+        return self._clip(self.qi @ self.pu[u] + (self.bi + (self.global_mean + self.bu[u])))
+
+    def score_items_at(self, customer_id: str, item_indices: np.ndarray) -> np.ndarray:
+        """
+        Điểm của user cho một tập con sản phẩm đã biết (chỉ nhân các hàng cần thiết)
+
+        Args:
+            customer_id: Raw id của user
+            item_indices: Chỉ số hàng (>= 0) của các sản phẩm
+        """
+        u = self.user_index(customer_id)
+        if not self.biased:
+            if u is None:
+                return self._clip(np.full(len(item_indices), self.global_mean))
+            return self._clip(self.qi[item_indices] @ self.pu[u])
+
+        if u is None:
+            return self._clip(self.global_mean + self.bi[item_indices])
+        return self._clip(self.qi[item_indices] @ self.pu[u] + (self.bi[item_indices] + (self.global_mean + self.bu[u])))
+
+    def unknown_item_score(self, customer_id: str) -> float:
+        """Điểm của user cho sản phẩm chưa có trong tập huấn luyện"""
+        u = self.user_index(customer_id)
+        score = self.global_mean
+        if self.biased and u is not None:
+            score += self.bu[u]
+        return float(min(self.higher, max(self.lower, score)))
+
+    def score_products(self, customer_id: str, product_ids: Sequence[str],
+                       item_indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Điểm của user cho một danh sách sản phẩm bất kỳ (ví dụ toàn bộ catalog)
+
+        Args:
+            customer_id: Raw id của user
+            product_ids: Danh sách raw id sản phẩm
+            item_indices: Inner id đã tính sẵn cho product_ids (tùy chọn)
+
+        Returns:
+            Mảng điểm theo thứ tự product_ids
+        """
+        if item_indices is None:
+            item_indices = self.item_indices(product_ids)
+        scores = np.full(len(item_indices), self.unknown_item_score(customer_id))
+        known = item_indices >= 0
+        if known.any():
+            scores[known] = self.score_items(customer_id)[item_indices[known]]
+        return scores
+
+    def score_users(self, customer_ids: Sequence[str], item_indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Điểm của nhiều user cho tất cả sản phẩm đã biết bằng một phép nhân ma trận
+
+        Args:
+            customer_ids: Danh sách raw id user
+            item_indices: Chỉ tính các sản phẩm này (chỉ số hàng >= 0), None = tất cả
+
+        Returns:
+            Ma trận điểm (số user, số sản phẩm)
+        """
+        qi = self.qi if item_indices is None else self.qi[item_indices]
+        bi = self.bi if item_indices is None else self.bi[item_indices]
+        indices = self.user_indices(customer_ids)
+        known = indices >= 0
+        rows = indices[known]
+        scores = np.empty((len(customer_ids), len(qi)))
+
+        if self.biased:
+            scores[:] = self.global_mean + bi
+            if len(rows):
+                scores[known] += self.pu[rows] @ qi.T + self.bu[rows][:, None]
+        else:
+            # User chưa biết: surprise trả về global mean
+            scores[:] = self.global_mean
+            if len(rows):
+                scores[known] = self.pu[rows] @ qi.T
+        return self._clip(scores)
+
+
+def top_n_indices(scores: np.ndarray, top_n: int, exclude: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Vị trí của top_n điểm cao nhất, bỏ qua các vị trí bị loại
+
+    Chọn bằng argpartition rồi chỉ sắp xếp phần nhỏ đã chọn. Các điểm bằng nhau
+    giữ thứ tự vị trí ban đầu, giống sorted(..., reverse=True) trên danh sách.
+
+    Args:
+        scores: Mảng điểm
+        top_n: Số phần tử cần lấy
+        exclude: Mảng bool cùng kích thước, True = bỏ qua (ví dụ sản phẩm đã xem)
+
+    Returns:
+        Mảng vị trí theo điểm giảm dần
+    """
+    candidates = np.flatnonzero(~exclude) if exclude is not None else np.arange(len(scores))
+    if top_n <= 0 or len(candidates) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    candidate_scores = scores[candidates]
+    if top_n < len(candidates):
+        # Ngưỡng là điểm thứ top_n, lấy mọi phần tử >= ngưỡng để không mất phần tử bằng điểm
+        threshold = candidate_scores[np.argpartition(-candidate_scores, top_n - 1)[top_n - 1]]
+        selected = np.flatnonzero(candidate_scores >= threshold)
+    else:
+        selected = np.arange(len(candidates))
+
+    order = np.lexsort((selected, -candidate_scores[selected]))[:top_n]
+    return candidates[selected[order]]
+
+
+def top_n_matrix(scores: np.ndarray, top_n: int, exclude: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Top_n vị trí cho từng hàng của ma trận điểm (nhiều user cùng lúc)
+
+    Args:
+        scores: Ma trận điểm (số user, số sản phẩm)
+        top_n: Số phần tử mỗi hàng
+        exclude: Ma trận bool cùng kích thước, True = bỏ qua
+
+    Returns:
+        Ma trận vị trí (số user, min(top_n, số sản phẩm)), điểm giảm dần trong mỗi hàng,
+        điểm bằng nhau giữ thứ tự cột. Hàng có ít ứng viên hơn top_n được đệm bằng -1.
+    """
+    n_rows, n_cols = scores.shape
+    k = min(top_n, n_cols)
+    if k <= 0:
+        return np.empty((n_rows, 0), dtype=np.int64)
+
+    masked = scores.astype(np.float64, copy=True)
+    if exclude is not None:
+        masked[exclude] = -np.inf
+    if k < n_cols:
+        # Lấy mọi phần tử lớn hơn điểm thứ k, phần còn thiếu lấy các phần tử bằng điểm
+        # thứ k theo thứ tự cột (giống top_n_indices)
+        kth = -np.partition(-masked, k - 1, axis=1)[:, k - 1:k]
+        greater = masked > kth
+        ties = masked == kth
+        needed = k - greater.sum(axis=1, keepdims=True)
+        selected = greater | (ties & (np.cumsum(ties, axis=1) <= needed))
+        part = np.nonzero(selected)[1].reshape(n_rows, k)
+    else:
+        part = np.tile(np.arange(n_cols), (n_rows, 1))
+    part_scores = np.take_along_axis(masked, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind="stable")
+    result = np.take_along_axis(part, order, axis=1)
+    result[np.take_along_axis(part_scores, order, axis=1) == -np.inf] = -1
+    return result
+
+
+def map_top_products(indices: np.ndarray, product_ids: Sequence[str]) -> List[str]:
+    """Đổi vị trí trong danh sách sản phẩm sang product id"""
+    return [product_ids[i] for i in indices if i >= 0]
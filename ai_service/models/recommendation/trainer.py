@@ -1,53 +1,208 @@
+import asyncio
 import os
+import time
+from concurrent.futures import Executor
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
 import pandas as pd
 from surprise import Dataset, Reader, SVD
-import joblib
 from database.mongo import user_action_collection, recommendation_collection, categories_collection
+from models.recommendation.ann_index import build_item_index
+from models.recommendation.registry import registry
+from models.recommendation.scorer import SVDScorer
 
-MODEL_PATH = "models/recommendation/model.pkl"
 RATING_SCALE = (1, 10)
 ACTION_SCORE = {"click": 1, "cart": 2, "purchase": 3, "search": 3}
+# Số cặp (user, sản phẩm) đọc mỗi lô từ kết quả aggregation
+EXTRACT_BATCH_SIZE = int(os.getenv("RECOMMENDER_EXTRACT_BATCH_SIZE", "10000"))
 
 
-async def get_user_behavior():
-    cursor = user_action_collection.find({
-        "action_type": {"$in": list(ACTION_SCORE.keys())}
-    }, {
-        "customer_id": 1,
-        "product_id": 1,
-        "action_type": 1
-    })
-    return await cursor.to_list(length=None)
+class InteractionArrays:
+    """
+    Các cặp (user, sản phẩm) và tổng điểm, lưu bằng mảng NumPy
 
+    Id được mã hóa thành số nguyên (chỉ số trong user_ids/product_ids) nên bộ
+    nhớ tỉ lệ với số cặp user-sản phẩm, không tỉ lệ với số hành động.
+    """
 
-def transform_data(raw_data: list) -> pd.DataFrame:
-    if not raw_data:
-        raise ValueError("No user behavior data found for training.")
+    def __init__(self, capacity: int = 1024):
+        self.user_codes = np.empty(capacity, dtype=np.int32)
+        self.product_codes = np.empty(capacity, dtype=np.int32)
+        self.scores = np.empty(capacity, dtype=np.float32)
+        self.size = 0
+        self._user_index: dict[str, int] = {}
+        self._product_index: dict[str, int] = {}
 
-    df = pd.DataFrame(raw_data)
-    df["customer_id"] = df["customer_id"].astype(str)
-    df["product_id"] = df["product_id"].astype(str)
-    df["score"] = df["action_type"].map(ACTION_SCORE)
+    def __len__(self) -> int:
+        return self.size
 
-    agg = df.groupby(['customer_id', 'product_id'])['score'].sum().reset_index()
-    return agg
+    @property
+    def user_ids(self) -> np.ndarray:
+        return np.asarray(list(self._user_index), dtype=object)
 
+    @property
+    def product_ids(self) -> np.ndarray:
+        return np.asarray(list(self._product_index), dtype=object)
 
-async def train_model():
-    raw_data = await get_user_behavior()
-    if not raw_data:
-        return "⚠️ No user behavior data found. Cannot train model."
+    def _reserve(self, extra: int) -> None:
+        """Mở rộng mảng (gấp đôi) khi không đủ chỗ"""
+        needed = self.size + extra
+        if needed <= len(self.scores):
+            return
+        capacity = max(needed, 2 * len(self.scores))
+        for name in ("user_codes", "product_codes", "scores"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def extend(self, rows: list[dict]) -> None:
+        """Thêm một lô kết quả $group: {_id: {customer_id, product_id}, score}"""
+        self._reserve(len(rows))
+        end = self.size + len(rows)
+        users, products = self._user_index, self._product_index
+        self.user_codes[self.size:end] = [users.setdefault(row["_id"]["customer_id"], len(users)) for row in rows]
+        self.product_codes[self.size:end] = [
+            products.setdefault(row["_id"]["product_id"], len(products)) for row in rows
+        ]
+        self.scores[self.size:end] = [row["score"] for row in rows]
+        self.size = end
+
+
+def _score_expression() -> dict:
+    """Điểm của một hành động theo ACTION_SCORE"""
+    return {"$switch": {
+        "branches": [
+            {"case": {"$eq": ["$action_type", action]}, "then": score}
+            for action, score in ACTION_SCORE.items()
+        ],
+        "default": 0
+    }}
+
+
+async def get_user_behavior(batch_size: int = EXTRACT_BATCH_SIZE,
+                            since: Optional[datetime] = None) -> InteractionArrays:
+    """
+    Tổng điểm hành động của từng cặp (user, sản phẩm), cộng dồn ngay trên MongoDB
+
+    Kết quả được đọc theo từng lô vào InteractionArrays thay vì tải toàn bộ
+    useractions vào một list.
+
+    Args:
+        batch_size: Số cặp đọc mỗi lô
+        since: Chỉ tính các hành động từ thời điểm này (None = tất cả)
+    """
+    match = {"action_type": {"$in": list(ACTION_SCORE.keys())}}
+    if since is not None:
+        match["timestamp"] = {"$gte": since}
+    pipeline = [
+        {"$match": match},
+        # Đổi id sang chuỗi trước khi group để ObjectId và chuỗi cùng giá trị được gộp chung
+        {"$group": {
+            "_id": {
+                "customer_id": {"$toString": "$customer_id"},
+                "product_id": {"$toString": "$product_id"},
+            },
+            "score": {"$sum": _score_expression()}
+        }},
+    ]
+    cursor = user_action_collection.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+
+    interactions = InteractionArrays()
+    while True:
+        rows = await cursor.to_list(length=batch_size)
+        if not rows:
+            break
+        interactions.extend(rows)
+    return interactions
+
+
+def transform_data(interactions: InteractionArrays) -> pd.DataFrame:
+    if not len(interactions):
+        raise ValueError("No user behavior data found for training.")
+
+    size = len(interactions)
+    return pd.DataFrame({
+        "customer_id": interactions.user_ids[interactions.user_codes[:size]],
+        "product_id": interactions.product_ids[interactions.product_codes[:size]],
+        "score": interactions.scores[:size],
+    })
 
-    agg_df = transform_data(raw_data)
 
+def fit_scorer(agg_df: pd.DataFrame) -> SVDScorer:
+    """
+    Huấn luyện SVD trên các cặp (user, sản phẩm) đã cộng điểm
+
+    Hàm chỉ dùng CPU và không cần event loop nên có thể chạy trong process khác
+    (xem services/training_jobs.py), kết quả SVDScorer chỉ gồm các mảng NumPy.
+    """
     reader = Reader(rating_scale=RATING_SCALE)
     data = Dataset.load_from_df(agg_df[['customer_id', 'product_id', 'score']], reader)
     trainset = data.build_full_trainset()
 
     model = SVD()
     model.fit(trainset)
+    scorer = SVDScorer.from_surprise(model)
+    # Dựng chỉ mục sản phẩm ngay trong process huấn luyện, được lưu cùng phiên bản khi publish
+    scorer.ann_index = build_item_index(scorer)
+    return scorer
+
+
+async def run_training(executor: Optional[Executor] = None,
+                       on_phase: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """
+    Lấy dữ liệu, huấn luyện và publish một phiên bản model mới
+
+    Args:
+        executor: Nơi chạy fit_scorer (None = executor mặc định của event loop)
+        on_phase: Hàm được gọi khi chuyển bước (extracting, fitting, publishing)
+
+    Returns:
+        Thông tin lần huấn luyện: số tương tác, số user/sản phẩm, phiên bản, thời gian từng bước
+
+    Raises:
+        ValueError: Khi không có dữ liệu hành vi
+    """
+    def phase(name: str) -> None:
+        if on_phase is not None:
+            on_phase(name)
 
-    os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
-    joblib.dump(model, MODEL_PATH)
+    phase("extracting")
+    started = time.perf_counter()
+    # Các hành động sau mốc này chưa có trong model, fold-in sẽ bắt đầu từ đây
+    data_until = datetime.utcnow()
+    interactions = await get_user_behavior()
+    agg_df = transform_data(interactions)
+    extracted = time.perf_counter()
+
+    phase("fitting")
+    scorer = await asyncio.get_running_loop().run_in_executor(executor, fit_scorer, agg_df)
+    fitted = time.perf_counter()
+
+    # Chỉ lưu các mảng cần cho việc chấm điểm, các worker tự chuyển sang model mới
+    phase("publishing")
+    version = registry.publish(scorer, {
+        "kind": "full_retrain",
+        "interactions": len(agg_df),
+        "data_until": data_until.isoformat(),
+    })
+
+    return {
+        "version": version,
+        "interactions": len(agg_df),
+        "users": scorer.n_users,
+        "products": scorer.n_items,
+        "extract_seconds": round(extracted - started, 3),
+        "fit_seconds": round(fitted - extracted, 3),
+    }
+
+
+async def train_model():
+    try:
+        result = await run_training()
+    except ValueError:
+        return "⚠️ No user behavior data found. Cannot train model."
 
-    return f"✅ Model trained on {len(agg_df)} user-product interactions"
+    return f"✅ Model trained on {result['interactions']} user-product interactions (version {result['version']})"
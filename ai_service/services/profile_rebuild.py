@@ -0,0 +1,109 @@
+# services/profile_rebuild.py
+# Dựng lại profile hành vi (recommendations) của mọi user có action trong một lần duyệt
+#
+# Thay vì mỗi user hai query (actions + sản phẩm) như analyze_user_behavior, đặc trưng sản phẩm
+# lấy từ catalog dùng chung (utils/product_catalog.py) và useractions trong cửa sổ thời gian
+# được đọc bằng một cursor sắp theo customer_id (mới nhất trước trong từng user, dùng index
+# customer_id/timestamp). Profile của một user được tính ngay khi hết các action của user đó,
+# nên bộ nhớ chỉ gồm bảng sản phẩm và actions của một user. Kết quả giống analyze_user_behavior engine "python".
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from loguru import logger
+from pymongo import UpdateOne
+
+from database.mongo import recommendation_collection, user_action_collection
+from utils.product_features import product_feature_index
+from utils.user_behavior_analyzer import ACTION_PROJECTION, UserBehaviorAnalyzer
+
+# Số ngày phân tích, số profile mỗi lần bulk_write và số document mỗi batch của cursor
+PROFILE_REBUILD_DAYS = int(os.getenv("BEHAVIOR_REBUILD_DAYS", "30"))
+PROFILE_REBUILD_CHUNK_SIZE = int(os.getenv("BEHAVIOR_REBUILD_CHUNK_SIZE", "1000"))
+PROFILE_REBUILD_BATCH_SIZE = int(os.getenv("BEHAVIOR_REBUILD_BATCH_SIZE", "5000"))
+
+
+async def run_profile_rebuild(on_phase: Optional[Callable[[str], None]] = None,
+                              analysis_days: int = PROFILE_REBUILD_DAYS,
+                              chunk_size: int = PROFILE_REBUILD_CHUNK_SIZE,
+                              batch_size: int = PROFILE_REBUILD_BATCH_SIZE) -> Dict[str, Any]:
+    """
+    Tính lại profile của mọi user có action trong analysis_days ngày gần nhất
+
+    User không có action nào trong khoảng thời gian giữ nguyên profile cũ.
+
+    Args:
+        on_phase: Hàm được gọi khi chuyển bước (loading_products, profiling)
+        analysis_days: Số ngày gần nhất được phân tích
+        chunk_size: Số profile mỗi lần bulk_write
+        batch_size: Số document mỗi batch đọc từ MongoDB
+
+    Returns:
+        Thông tin lần chạy: số user, số action, số sản phẩm, thời gian
+    """
+    def phase(name: str) -> None:
+        if on_phase is not None:
+            on_phase(name)
+
+    started = time.perf_counter()
+    analyzer = UserBehaviorAnalyzer()
+    end_date = datetime.utcnow()
+    start_date = end_date - timedelta(days=analysis_days)
+
+    phase("loading_products")
+    products = await product_feature_index.get_all()
+    loaded = time.perf_counter()
+
+    phase("profiling")
+    # customer_id là ObjectId như các action mà analyze_user_behavior đọc
+    cursor = user_action_collection.find({
+        "customer_id": {"$type": "objectId"},
+        "timestamp": {"$gte": start_date, "$lte": end_date},
+        "action_type": {"$in": list(analyzer.ACTION_WEIGHTS.keys())},
+    }, {**ACTION_PROJECTION, "customer_id": 1}).sort([("customer_id", 1), ("timestamp", -1)]).batch_size(batch_size)
+
+    operations: List[UpdateOne] = []
+    stats = {"users": 0, "actions": 0}
+
+    def finish_user(customer_id: ObjectId, actions: List[Dict]) -> None:
+        aggregates = analyzer._aggregate_actions(actions, products)
+        profile = analyzer._build_recommendation_data(
+            str(customer_id), aggregates, start_date, end_date, analysis_days
+        )
+        operations.append(UpdateOne({"customer_id": profile["customer_id"]}, {"$set": profile}, upsert=True))
+        stats["users"] += 1
+
+    async def flush() -> None:
+        if operations:
+            await recommendation_collection.bulk_write(operations, ordered=False)
+            logger.info(f"Rebuilt behavior profiles: {stats['users']} users, {stats['actions']} actions")
+            operations.clear()
+
+    current_id = None
+    actions: List[Dict] = []
+    async for action in cursor:
+        customer_id = action.pop("customer_id", None)
+        if customer_id != current_id:
+            if actions:
+                finish_user(current_id, actions)
+                if len(operations) >= chunk_size:
+                    await flush()
+            current_id = customer_id
+            actions = []
+        stats["actions"] += 1
+        # Giống _get_user_actions: chỉ giữ max_actions action mới nhất của mỗi user
+        if not analyzer.max_actions or len(actions) < analyzer.max_actions:
+            actions.append(action)
+    if actions:
+        finish_user(current_id, actions)
+    await flush()
+
+    return {
+        **stats,
+        "products": len(products),
+        "analysis_days": analysis_days,
+        "load_seconds": round(loaded - started, 3),
+        "duration_seconds": round(time.perf_counter() - started, 3),
+    }
@@ -1,13 +1,27 @@
 # services/recommendation.py
+import asyncio
+import os
+import time
 from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from typing import List, Dict, Optional
 from utils.user_behavior_analyzer import UserBehaviorAnalyzer
 from database.mongo import recommendation_collection
+from models.recommendation.recommender import get_seen_product_ids_for_users, recommend_product_ids
+from models.recommendation.registry import registry
+from utils.product_catalog import product_catalog
 
 # Khởi tạo analyzer
 analyzer = UserBehaviorAnalyzer()
 
+# batch_analyze_users: số user phân tích đồng thời và số user mỗi lần bulk_write
+BATCH_ANALYZE_CONCURRENCY = int(os.getenv("BEHAVIOR_BATCH_CONCURRENCY", "16"))
+BATCH_ANALYZE_CHUNK_SIZE = int(os.getenv("BEHAVIOR_BATCH_CHUNK_SIZE", "500"))
+# Số lỗi tối đa trả về trong kết quả (tổng số lỗi vẫn được đếm đủ)
+BATCH_ANALYZE_MAX_ERRORS = 100
+
 async def analyze_and_save_user_recommendation(user_id: str, analysis_days: int = 30) -> bool:
     """Phân tích user behavior và lưu vào recommendation collection"""
     try:
@@ -52,26 +66,122 @@ async def get_user_recommendation_data(customer_id: str) -> Optional[Dict]:
         print(f"❌ Error getting recommendation data for user {customer_id}: {str(e)}")
         return None
 
-async def batch_analyze_users(user_ids: List[str], analysis_days: int = 30) -> str:
-    """Phân tích nhiều users cùng lúc"""
-    success_count = 0
-    failed_users = []
-    
-    for user_id in user_ids:
-        success = await analyze_and_save_user_recommendation(user_id, analysis_days)
-        if success:
-            success_count += 1
-        else:
-            failed_users.append(user_id)
-    
-    result_msg = f"✅ Analyzed {success_count}/{len(user_ids)} users successfully."
-    
-    if failed_users:
-        result_msg += f" Failed users: {', '.join(failed_users[:5])}"
-        if len(failed_users) > 5:
-            result_msg += f" and {len(failed_users) - 5} more..."
-    
-    return result_msg
+async def get_user_recommended_products(customer_id: str, data: Optional[Dict] = None, limit: int = 10) -> Dict:
+    """
+    Lấy top sản phẩm gợi ý của user
+
+    Dùng danh sách đã tính trước (recommended_product_ids) trong document
+    recommendation khi nó được tính bằng phiên bản model đang phục vụ và còn đủ
+    limit sản phẩm sau khi bỏ các sản phẩm user đã tương tác từ đó tới nay và các
+    sản phẩm không còn trong catalog.
+    Ngược lại (chưa có, model đã đổi, limit lớn hơn danh sách) thì chấm điểm trực tiếp.
+
+    Args:
+        customer_id: ID của user
+        data: Document recommendation đã đọc (tránh đọc lại), None = đọc mới
+        limit: Số sản phẩm trả về
+    """
+    if data is None:
+        data = await get_user_recommendation_data(customer_id)
+    materialized = (data or {}).get("recommended_product_ids") or []
+    if len(materialized) >= limit:
+        try:
+            version = registry.get_scorer().version or "legacy"
+            if data.get("recommended_model_version") == version:
+                seen = (await get_seen_product_ids_for_users([customer_id])).get(customer_id, set())
+                snapshot = await product_catalog.get_snapshot()
+                product_ids = [product_id for product_id in materialized
+                               if product_id not in seen and product_id in snapshot.positions]
+                if len(product_ids) >= limit:
+                    return {"product_ids": product_ids[:limit], "source": "materialized", "model_version": version}
+        except FileNotFoundError:
+            pass  # Chưa huấn luyện model nào, xử lý ở nhánh chấm trực tiếp bên dưới
+        except Exception as e:
+            print(f"❌ Error checking materialized products for user {customer_id}: {str(e)}")
+
+    try:
+        return {"product_ids": await recommend_product_ids(customer_id, limit), "source": "live", "model_version": None}
+    except FileNotFoundError:
+        # Chưa huấn luyện model nào
+        return {"product_ids": [], "source": None, "model_version": None}
+    except Exception as e:
+        print(f"❌ Error scoring products for user {customer_id}: {str(e)}")
+        return {"product_ids": [], "source": None, "model_version": None}
+
+async def _analyze_chunk(user_ids: List[str], analysis_days: int,
+                         semaphore: asyncio.Semaphore) -> Dict[str, Dict]:
+    """Phân tích một nhóm user đồng thời (tối đa theo semaphore), trả về {user_id: dữ liệu hoặc lỗi}"""
+    async def analyze(user_id: str):
+        async with semaphore:
+            try:
+                return await analyzer.analyze_user_behavior(user_id, analysis_days)
+            except Exception as e:
+                return e
+
+    results = await asyncio.gather(*(analyze(user_id) for user_id in user_ids))
+    return dict(zip(user_ids, results))
+
+async def batch_analyze_users(user_ids: List[str], analysis_days: int = 30,
+                              concurrency: int = BATCH_ANALYZE_CONCURRENCY,
+                              chunk_size: int = BATCH_ANALYZE_CHUNK_SIZE) -> Dict:
+    """
+    Phân tích nhiều users cùng lúc
+
+    Mỗi nhóm chunk_size user được phân tích đồng thời (tối đa concurrency user một lúc)
+    rồi lưu bằng một lần bulk_write.
+
+    Args:
+        user_ids: Danh sách ID user
+        analysis_days: Số ngày gần nhất được phân tích
+        concurrency: Số user phân tích đồng thời
+        chunk_size: Số user mỗi lần ghi
+
+    Returns:
+        Số user đã xử lý/thành công/lỗi, lỗi của từng user và thời gian chạy
+    """
+    started = time.perf_counter()
+    user_ids = list(dict.fromkeys(user_ids))  # Bỏ user trùng, giữ thứ tự
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    chunk_size = max(1, chunk_size)
+    succeeded = 0
+    errors = []
+
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        results = await _analyze_chunk(chunk, analysis_days, semaphore)
+
+        saved_ids = []
+        operations = []
+        for user_id, result in results.items():
+            if isinstance(result, Exception):
+                errors.append({"user_id": user_id, "error": str(result)})
+            else:
+                saved_ids.append(user_id)
+                operations.append(UpdateOne({"customer_id": ObjectId(user_id)}, {"$set": result}, upsert=True))
+
+        if operations:
+            try:
+                await recommendation_collection.bulk_write(operations, ordered=False)
+                succeeded += len(operations)
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors", [])
+                for write_error in write_errors:
+                    errors.append({"user_id": saved_ids[write_error["index"]], "error": write_error.get("errmsg")})
+                succeeded += len(operations) - len(write_errors)
+            except Exception as e:
+                errors.extend({"user_id": user_id, "error": str(e)} for user_id in saved_ids)
+
+        processed = start + len(chunk)
+        print(f"📊 Batch analyze: {processed}/{len(user_ids)} users processed, {len(errors)} failed")
+
+    print(f"✅ Analyzed {succeeded}/{len(user_ids)} users successfully.")
+    return {
+        "total": len(user_ids),
+        "succeeded": succeeded,
+        "failed": len(errors),
+        "errors": errors[:BATCH_ANALYZE_MAX_ERRORS],
+        "duration_seconds": round(time.perf_counter() - started, 3),
+    }
 
 async def get_user_keywords(customer_id: str, limit: int = 10) -> List[str]:
     """Lấy keywords recommendation cho user"""
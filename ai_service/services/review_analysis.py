@@ -1,114 +1,408 @@
+import asyncio
+import os
+import uuid
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Dict, List
-from utils.sentiment_analysis import analyze_sentiment
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from utils.sentiment_analysis import analyze_sentiment_batch_async, get_model_version
+from utils.inference_executor import InferenceQueueFullError
 from loguru import logger
 from database.mongo import review_collection  # Thay đổi từ review_collection thành comment_collection
 from bson import ObjectId
+from services.review_sentiment_store import (
+    SentimentWriteBatch,
+    claim_backfill_lock,
+    find_stale_store_ids,
+    is_reusable,
+    load_stored_sentiments,
+    refresh_backfill_lock,
+    release_backfill_lock,
+)
 
-async def analyze_stores_sentiment(store_ids: List[str]) -> List[Dict]:
+# Số store trong mỗi truy vấn $in và số truy vấn chạy song song
+STORE_CHUNK_SIZE = int(os.getenv("REVIEW_STORE_CHUNK_SIZE", "100"))
+FETCH_CONCURRENCY = int(os.getenv("REVIEW_FETCH_CONCURRENCY", "4"))
+# Số document mỗi lần cursor lấy về từ MongoDB
+FETCH_BATCH_SIZE = int(os.getenv("REVIEW_FETCH_BATCH_SIZE", "1000"))
+
+# Backfill khi đổi phiên bản model: số store mỗi lượt, thời gian nghỉ giữa các lượt
+BACKFILL_STORE_BATCH = int(os.getenv("REVIEW_BACKFILL_STORE_BATCH", "20"))
+BACKFILL_PAUSE_SECONDS = float(os.getenv("REVIEW_BACKFILL_PAUSE_SECONDS", "1"))
+# Chu kỳ làm mới khóa backfill (phải nhỏ hơn REVIEW_BACKFILL_LOCK_STALE_SECONDS)
+BACKFILL_LOCK_HEARTBEAT_SECONDS = float(os.getenv("REVIEW_BACKFILL_LOCK_HEARTBEAT_SECONDS", "60"))
+
+REVIEW_PROJECTION = {
+    "_id": 1, "store_id": 1, "content": 1, "customer_id": 1, "created_at": 1, "updated_at": 1, "product_id": 1
+}
+
+# Trạng thái của lần backfill gần nhất
+_backfill_state: Dict = {"running": False}
+_backfill_task: Optional[asyncio.Task] = None
+
+
+async def _fetch_comments_by_store(store_object_ids: List[ObjectId], time_threshold: datetime,
+                                   current_time: datetime) -> Dict[str, List[Dict]]:
     """
-    Phân tích sentiment của comments cho danh sách các store
-    
+    Lấy comments của nhiều store bằng một truy vấn $in và nhóm theo store
+
     Args:
-        store_ids: Danh sách ID của các store cần phân tích
-        
+        store_object_ids: Danh sách ObjectId của các store
+        time_threshold: Thời điểm bắt đầu
+        current_time: Thời điểm kết thúc
+
+    Returns:
+        Dict store_id (chuỗi) -> danh sách comments
+    """
+    cursor = review_collection.find(
+        {
+            "store_id": {"$in": store_object_ids},
+            "created_at": {"$gte": time_threshold, "$lte": current_time}
+        },
+        REVIEW_PROJECTION
+    ).batch_size(FETCH_BATCH_SIZE)
+
+    grouped: Dict[str, List[Dict]] = defaultdict(list)
+    async for comment in cursor:
+        grouped[str(comment.get("store_id"))].append(comment)
+    return grouped
+
+
+async def _analyze_store_comments(store_id: str, comments: List[Dict], stored: Dict[str, Dict],
+                                  writes: SentimentWriteBatch) -> Dict:
+    """
+    Phân tích sentiment cho comments của một store và lọc ra comments tiêu cực
+
+    Comments đã được chấm bởi cùng phiên bản model và chưa bị sửa thì dùng lại
+    kết quả đã lưu, chỉ những comments mới hoặc đã sửa mới phải chạy model.
+
+    Args:
+        store_id: ID của store (giữ nguyên như caller gửi lên)
+        comments: Comments của store đã lấy từ database
+        stored: Kết quả đã lưu, theo review_id
+        writes: Nơi gom kết quả mới để ghi lại vào database
+
     Returns:
-        List các store với thông tin comments tiêu cực
+        Kết quả của store với danh sách comments tiêu cực
+    """
+    if not comments:
+        logger.info(f"No recent comments found for store {store_id}")
+        writes.mark_store(str(ObjectId(store_id)), comments, scored=0, reused=0)
+        return {
+            "store_id": store_id,
+            "negative_comments": []
+        }
+
+    negative_comments = []
+    valid_comments = []
+
+    for comment in comments:
+        comment_id = comment.get("_id")
+        content = comment.get("content")
+        created_at = comment.get("created_at")
+
+        # Kiểm tra dữ liệu hợp lệ
+        if not content or not isinstance(content, str) or content.strip() == "":
+            logger.warning(f"Invalid comment content for store {store_id}: {content}")
+            continue
+
+        if not comment_id or not created_at:
+            logger.warning(f"Missing comment_id or created_at for store {store_id}")
+            continue
+
+        valid_comments.append(comment)
+
+    sentiments: Dict[str, Tuple[str, float]] = {}
+    to_score = []
+    for comment in valid_comments:
+        previous = stored.get(str(comment["_id"]))
+        if is_reusable(previous, comment["content"], writes.model_version):
+            sentiments[str(comment["_id"])] = (previous["label"], previous["confidence"])
+        else:
+            to_score.append(comment)
+
+    # Phân tích sentiment cho các comments mới/đã sửa của store trong một lần
+    failed = 0
+    if to_score:
+        scored = await analyze_sentiment_batch_async([comment["content"] for comment in to_score])
+        for comment, (sentiment, confidence) in zip(to_score, scored):
+            sentiments[str(comment["_id"])] = (sentiment, confidence)
+            # "unknown" là kết quả tạm khi model lỗi: không lưu để lần sau chấm lại
+            if sentiment == "unknown":
+                failed += 1
+                continue
+            writes.add(str(ObjectId(store_id)), comment, sentiment, confidence)
+    # Store còn comment chưa chấm được thì giữ nguyên mốc (backfill sẽ thử lại)
+    if not failed:
+        writes.mark_store(str(ObjectId(store_id)), valid_comments, scored=len(to_score),
+                          reused=len(valid_comments) - len(to_score))
+
+    for comment in valid_comments:
+        sentiment, confidence = sentiments[str(comment["_id"])]
+        comment_id = comment.get("_id")
+        logger.debug(f"Comment {comment_id}: Sentiment={sentiment}, Confidence={confidence:.4f}")
+
+        # Chỉ lấy comments tiêu cực
+        if sentiment.lower() == "negative":
+            negative_comments.append({
+                "content": comment.get("content"),
+                "customer_id": str(comment.get("customer_id")),
+                "product_id": str(comment.get("product_id")),
+                "sentiment": "negative",
+                "_id": str(comment_id),  # Convert ObjectId to string
+                "confidence": round(confidence, 4),  # Thêm confidence score
+                "created_at": comment.get("created_at").isoformat()  # Thêm thời gian tạo
+            })
+
+    # Log thông tin tổng kết
+    logger.info(f"Store {store_id}: {len(negative_comments)}/{len(comments)} negative comments found "
+                f"({len(to_score)} scored, {len(valid_comments) - len(to_score)} reused)")
+
+    result = {
+        "store_id": store_id,
+        "negative_comments": negative_comments
+    }
+    if failed:
+        logger.warning(f"Store {store_id}: sentiment model failed for {failed}/{len(to_score)} comments")
+        result["error"] = f"Sentiment analysis failed for {failed} comments"
+    return result
+
+
+async def _analyze_chunk(chunk: List[str], grouped: Dict[str, List[Dict]], object_ids: Dict[str, ObjectId],
+                         model_version: str) -> AsyncIterator[Tuple[str, Dict]]:
+    """
+    Phân tích lần lượt các store của một chunk và ghi kết quả mới vào database
+
+    Args:
+        chunk: Danh sách store_id của chunk
+        grouped: Comments đã lấy, theo store_id (chuỗi ObjectId)
+        object_ids: store_id -> ObjectId
+        model_version: Phiên bản model hiện tại
+
+    Yields:
+        (store_id, kết quả của store) ngay khi store đó phân tích xong
     """
+    try:
+        stored = await load_stored_sentiments(
+            comment["_id"] for comments in grouped.values() for comment in comments if comment.get("_id")
+        )
+    except Exception as e:
+        logger.error(f"Error loading stored review sentiments, scoring all comments: {str(e)}")
+        stored = {}
+
+    writes = SentimentWriteBatch(model_version)
+    try:
+        for store_id in chunk:
+            try:
+                logger.info(f"Analyzing comments for store: {store_id}")
+                comments = grouped.get(str(object_ids[store_id]), [])
+                result = await _analyze_store_comments(store_id, comments, stored, writes)
+            except InferenceQueueFullError:
+                # Để controller trả về 503, caller sẽ thử lại sau
+                raise
+            except Exception as e:
+                logger.error(f"Error analyzing comments for store {store_id}: {str(e)}")
+                # Vẫn thêm store vào kết quả với danh sách rỗng khi có lỗi
+                result = {"store_id": store_id, "negative_comments": [], "error": str(e)}
+            yield store_id, result
+    finally:
+        # Giữ lại phần đã chấm kể cả khi phải dừng giữa chừng
+        await writes.flush()
+
+
+async def iter_stores_sentiment(store_ids: List[str]) -> AsyncIterator[Dict]:
+    """
+    Phân tích sentiment của comments cho danh sách các store, trả về từng store ngay khi xong
+
+    Comments được lấy bằng một số ít truy vấn $in (mỗi truy vấn STORE_CHUNK_SIZE
+    store, chạy song song) thay vì một truy vấn cho mỗi store. Store của chunk nào
+    lấy xong trước sẽ được đưa vào phân tích trước. Kết quả được lưu lại nên lần
+    sau chỉ comments mới hoặc đã sửa mới phải chạy model.
+
+    Args:
+        store_ids: Danh sách ID của các store cần phân tích
+
+    Yields:
+        Kết quả của từng store (theo thứ tự phân tích xong, mỗi store một lần)
+
+    Raises:
+        InferenceQueueFullError: Khi hàng đợi inference đã đầy
+    """
+    done = set()
     try:
         # Tính thời gian 7 ngày trước từ hiện tại
         current_time = datetime.now()
         time_threshold = current_time - timedelta(days=7)
-        
-        result = []
-        
+        model_version = get_model_version()
+
+        # ID không hợp lệ được trả lỗi riêng cho store đó, không làm hỏng cả truy vấn
+        object_ids: Dict[str, ObjectId] = {}
         for store_id in store_ids:
+            if store_id in object_ids or store_id in done:
+                continue
             try:
-                logger.info(f"Analyzing comments for store: {store_id}")
-                
-                # Query comments cho store_id trong 7 ngày gần nhất
-                cursor = review_collection.find(
-                    {
-                        "store_id": ObjectId(store_id),
-                        "created_at": {"$gte": time_threshold, "$lte": current_time}
-                    },
-                    {"_id": 1, "content": 1,"customer_id": 1, "created_at": 1,"product_id":1}  # Lấy thêm _id theo yêu cầu
-                )
-                comments = await cursor.to_list(length=None)
-                
-                if not comments:
-                    logger.info(f"No recent comments found for store {store_id}")
-                    result.append({
-                        "store_id": store_id,
-                        "negative_comments": []
-                    })
-                    continue
-                
-                negative_comments = []
-                
-                for comment in comments:
-                    comment_id = comment.get("_id")
-                    content = comment.get("content")
-                    customer_id = comment.get("customer_id")
-                    product_id = comment.get("product_id")
-                    created_at = comment.get("created_at")
-                    
-                    # Kiểm tra dữ liệu hợp lệ
-                    if not content or not isinstance(content, str) or content.strip() == "":
-                        logger.warning(f"Invalid comment content for store {store_id}: {content}")
-                        continue
-                    
-                    if not comment_id or not created_at:
-                        logger.warning(f"Missing comment_id or created_at for store {store_id}")
-                        continue
-                    
-                    try:
-                        # Phân tích sentiment
-                        sentiment, confidence = analyze_sentiment(content)
-                        logger.debug(f"Comment {comment_id}: Sentiment={sentiment}, Confidence={confidence:.4f}")
-                        
-                        # Chỉ lấy comments tiêu cực
-                        if sentiment.lower() == "negative":
-                            negative_comments.append({
-                                "content": content,
-                                "customer_id": str(customer_id),
-                                "product_id": str(product_id),
-                                "sentiment": "negative",
-                                "_id": str(comment_id),  # Convert ObjectId to string
-                                "confidence": round(confidence, 4),  # Thêm confidence score
-                                "created_at": created_at.isoformat()  # Thêm thời gian tạo
-                            })
-                            
-                    except Exception as e:
-                        logger.error(f"Error analyzing sentiment for comment {comment_id} in store {store_id}: {str(e)}")
-                        continue
-                
-                # Thêm kết quả cho store
-                store_result = {
-                    "store_id": store_id,
-                    "negative_comments": negative_comments
-                }
-                
-                # Log thông tin tổng kết
-                total_comments = len(comments)
-                negative_count = len(negative_comments)
-                logger.info(f"Store {store_id}: {negative_count}/{total_comments} negative comments found")
-                
-                result.append(store_result)
-                
+                object_ids[store_id] = ObjectId(store_id)
             except Exception as e:
                 logger.error(f"Error analyzing comments for store {store_id}: {str(e)}")
-                # Vẫn thêm store vào kết quả với danh sách rỗng khi có lỗi
-                result.append({
-                    "store_id": store_id,
-                    "negative_comments": [],
-                    "error": str(e)
-                })
-        
-        logger.info(f"Completed sentiment analysis for {len(store_ids)} stores")
-        return result
-        
+                done.add(store_id)
+                yield {"store_id": store_id, "negative_comments": [], "error": str(e)}
+
+        unique_ids = list(object_ids.keys())
+        chunk_size = max(1, STORE_CHUNK_SIZE)
+        chunks = [unique_ids[i:i + chunk_size] for i in range(0, len(unique_ids), chunk_size)]
+        semaphore = asyncio.Semaphore(max(1, FETCH_CONCURRENCY))
+
+        async def fetch_chunk(chunk: List[str]) -> Tuple[List[str], Dict[str, List[Dict]], Optional[Exception]]:
+            async with semaphore:
+                logger.info(f"Fetching comments for {len(chunk)} stores")
+                try:
+                    grouped = await _fetch_comments_by_store(
+                        [object_ids[store_id] for store_id in chunk], time_threshold, current_time
+                    )
+                    return chunk, grouped, None
+                except Exception as e:
+                    return chunk, {}, e
+
+        fetch_tasks = [asyncio.ensure_future(fetch_chunk(chunk)) for chunk in chunks]
+        try:
+            for next_chunk in asyncio.as_completed(fetch_tasks):
+                chunk, grouped, fetch_error = await next_chunk
+                if fetch_error is not None:
+                    for store_id in chunk:
+                        logger.error(f"Error analyzing comments for store {store_id}: {str(fetch_error)}")
+                        done.add(store_id)
+                        yield {"store_id": store_id, "negative_comments": [], "error": str(fetch_error)}
+                    continue
+                async for store_id, result in _analyze_chunk(chunk, grouped, object_ids, model_version):
+                    done.add(store_id)
+                    yield result
+        finally:
+            # Hủy các truy vấn còn lại nếu phải dừng giữa chừng (ví dụ hàng đợi inference đầy)
+            for task in fetch_tasks:
+                task.cancel()
+
+        logger.info(f"Completed sentiment analysis for {len(done)} stores")
+
+    except InferenceQueueFullError:
+        raise
     except Exception as e:
         logger.error(f"Error in analyze_stores_sentiment: {str(e)}")
-        # Trả về danh sách rỗng khi có lỗi tổng thể
-        return [{"store_id": store_id, "negative_comments": [], "error": str(e)} for store_id in store_ids]
+        # Các store chưa có kết quả được trả về với danh sách rỗng khi có lỗi tổng thể
+        for store_id in dict.fromkeys(store_ids):
+            if store_id not in done:
+                yield {"store_id": store_id, "negative_comments": [], "error": str(e)}
+
+
+async def analyze_stores_sentiment(store_ids: List[str]) -> List[Dict]:
+    """
+    Phân tích sentiment của comments cho danh sách các store
+
+    Args:
+        store_ids: Danh sách ID của các store cần phân tích
+
+    Returns:
+        List các store với thông tin comments tiêu cực (theo thứ tự của store_ids)
+    """
+    store_results: Dict[str, Dict] = {}
+    async for result in iter_stores_sentiment(store_ids):
+        store_results[result["store_id"]] = result
+    return [store_results[store_id] for store_id in store_ids]
+
+
+async def _backfill_heartbeat(owner: str) -> None:
+    """Định kỳ làm mới khóa để worker khác không coi backfill đang chạy là bị bỏ lại"""
+    while True:
+        await asyncio.sleep(BACKFILL_LOCK_HEARTBEAT_SECONDS)
+        await refresh_backfill_lock(owner)
+
+
+async def run_sentiment_backfill(max_stores: Optional[int] = None) -> Dict:
+    """
+    Chấm lại comments của các store đang giữ kết quả của phiên bản model cũ
+
+    Chạy từng lượt BACKFILL_STORE_BATCH store, nghỉ BACKFILL_PAUSE_SECONDS giữa
+    các lượt để không chiếm hết inference executor của các request thật. Mỗi lúc chỉ một
+    worker chạy (khóa trong reviewsentimentbackfills), worker khác bỏ qua lần chạy của mình.
+
+    Args:
+        max_stores: Số store tối đa xử lý trong lần chạy này (None = tất cả)
+
+    Returns:
+        Trạng thái của lần backfill
+    """
+    global _backfill_state
+    _backfill_state = {
+        "running": True,
+        "started_at": datetime.now().isoformat(),
+        "stores_done": 0,
+        "stores_failed": 0,
+    }
+    attempted: List[str] = []
+    owner = uuid.uuid4().hex
+    heartbeat: Optional[asyncio.Task] = None
+    try:
+        model_version = get_model_version()
+        _backfill_state["model_version"] = model_version
+        holder = await claim_backfill_lock(owner, model_version)
+        if holder is not None:
+            logger.info("Sentiment backfill skipped, another worker is running it")
+            _backfill_state["skipped"] = "another worker is running the backfill"
+            return _backfill_state
+        heartbeat = asyncio.ensure_future(_backfill_heartbeat(owner))
+
+        while max_stores is None or len(attempted) < max_stores:
+            batch_size = max(1, BACKFILL_STORE_BATCH)
+            if max_stores is not None:
+                batch_size = min(batch_size, max_stores - len(attempted))
+            stale_ids = await find_stale_store_ids(model_version, batch_size, exclude=attempted)
+            if not stale_ids:
+                break
+
+            current_time = datetime.now()
+            object_ids = {store_id: ObjectId(store_id) for store_id in stale_ids}
+            grouped = await _fetch_comments_by_store(
+                list(object_ids.values()), current_time - timedelta(days=7), current_time
+            )
+            try:
+                results = {store_id: result async for store_id, result in
+                           _analyze_chunk(stale_ids, grouped, object_ids, model_version)}
+            except InferenceQueueFullError:
+                # Nhường chỗ cho request thật rồi thử lại lượt này
+                logger.warning("Sentiment backfill paused, inference queue is full")
+                await asyncio.sleep(BACKFILL_PAUSE_SECONDS * 5)
+                continue
+
+            attempted.extend(stale_ids)
+            failed = sum(1 for result in results.values() if "error" in result)
+            _backfill_state["stores_done"] += len(results) - failed
+            _backfill_state["stores_failed"] += failed
+            logger.info(f"Sentiment backfill to {model_version}: {_backfill_state['stores_done']} stores done")
+            await asyncio.sleep(BACKFILL_PAUSE_SECONDS)
+    except Exception as e:
+        logger.error(f"Error in sentiment backfill: {str(e)}")
+        _backfill_state["error"] = str(e)
+    finally:
+        if heartbeat is not None:
+            heartbeat.cancel()
+            await release_backfill_lock(owner)
+        _backfill_state["running"] = False
+        _backfill_state["finished_at"] = datetime.now().isoformat()
+    return _backfill_state
+
+
+def start_sentiment_backfill(max_stores: Optional[int] = None) -> Dict:
+    """
+    Chạy backfill ở background nếu chưa có lần nào đang chạy
+
+    Returns:
+        Trạng thái hiện tại của backfill
+    """
+    global _backfill_task
+    if _backfill_task is None or _backfill_task.done():
+        _backfill_state["running"] = True
+        _backfill_task = asyncio.ensure_future(run_sentiment_backfill(max_stores))
+    return get_backfill_status()
+
+
+def get_backfill_status() -> Dict:
+    """Trạng thái của lần backfill gần nhất"""
+    return dict(_backfill_state)
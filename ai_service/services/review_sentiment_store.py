@@ -0,0 +1,195 @@
+# services/review_sentiment_store.py
+# Lưu kết quả sentiment của từng review và mốc "đã chấm tới đâu" của từng store
+#
+# reviewsentiments: {_id: review_id, store_id, label, confidence, model_version,
+#                    content_hash, review_created_at, scored_at}
+# reviewsentimentwatermarks: {_id: store_id, model_version, last_scored_at,
+#                             last_run_at, scored, reused}
+# reviewsentimentbackfills: {_id: "active_backfill", owner, model_version, heartbeat_at}: khóa backfill
+#                           dùng chung giữa các worker, owner = None khi không có lần nào chạy
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from loguru import logger
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database.mongo import (
+    review_sentiment_backfill_collection,
+    review_sentiment_collection,
+    review_sentiment_watermark_collection,
+)
+from utils.sentiment_cache import text_hash
+
+# Tắt để quay về cách cũ: chấm lại toàn bộ review mỗi lần
+PERSIST_ENABLED = os.getenv("REVIEW_SENTIMENT_PERSIST", "true").lower() in ("1", "true", "yes")
+# Số review mỗi truy vấn $in khi đọc kết quả đã lưu
+LOOKUP_CHUNK_SIZE = int(os.getenv("REVIEW_SENTIMENT_LOOKUP_CHUNK_SIZE", "1000"))
+# Thời gian (giây) khóa backfill không được làm mới thì bị coi là bỏ lại và worker khác được lấy
+BACKFILL_LOCK_STALE_SECONDS = float(os.getenv("REVIEW_BACKFILL_LOCK_STALE_SECONDS", "300"))
+
+BACKFILL_LOCK_ID = "active_backfill"
+
+
+def is_reusable(stored: Optional[Dict], content: str, model_version: str) -> bool:
+    """
+    Kiểm tra kết quả đã lưu có dùng lại được không
+
+    Chỉ dùng lại khi cùng phiên bản model và nội dung review chưa bị sửa.
+    """
+    return (
+        stored is not None
+        and stored.get("model_version") == model_version
+        and stored.get("content_hash") == text_hash(content)
+    )
+
+
+async def load_stored_sentiments(review_ids: Iterable[ObjectId]) -> Dict[str, Dict]:
+    """
+    Đọc kết quả sentiment đã lưu cho nhiều review
+
+    Args:
+        review_ids: Danh sách _id của review
+
+    Returns:
+        Dict review_id (chuỗi) -> bản ghi đã lưu
+    """
+    if not PERSIST_ENABLED:
+        return {}
+
+    ids = list(review_ids)
+    stored: Dict[str, Dict] = {}
+    chunk_size = max(1, LOOKUP_CHUNK_SIZE)
+    for start in range(0, len(ids), chunk_size):
+        cursor = review_sentiment_collection.find(
+            {"_id": {"$in": ids[start:start + chunk_size]}},
+            {"label": 1, "confidence": 1, "model_version": 1, "content_hash": 1}
+        )
+        async for doc in cursor:
+            stored[str(doc["_id"])] = doc
+    return stored
+
+
+async def get_watermarks(store_ids: Optional[List[str]] = None) -> List[Dict]:
+    """Lấy mốc chấm điểm của các store (None = tất cả)"""
+    query = {"_id": {"$in": store_ids}} if store_ids is not None else {}
+    watermarks = await review_sentiment_watermark_collection.find(query).to_list(length=None)
+    for watermark in watermarks:
+        watermark["store_id"] = watermark.pop("_id")
+    return watermarks
+
+
+async def find_stale_store_ids(model_version: str, limit: int, exclude: Optional[List[str]] = None) -> List[str]:
+    """Các store có kết quả được chấm bởi phiên bản model khác phiên bản hiện tại"""
+    query = {"model_version": {"$ne": model_version}}
+    if exclude:
+        query["_id"] = {"$nin": exclude}
+    cursor = review_sentiment_watermark_collection.find(query, {"_id": 1}).limit(limit)
+    return [doc["_id"] async for doc in cursor]
+
+
+async def claim_backfill_lock(owner: str, model_version: str) -> Optional[Dict]:
+    """
+    Lấy khóa backfill bằng một lệnh cập nhật có điều kiện để mỗi lúc chỉ một worker chấm lại
+
+    Returns:
+        None nếu lấy được khóa, ngược lại document khóa của lần backfill đang chạy
+    """
+    now = datetime.now()
+    try:
+        # Khóa đang bị giữ thì không document nào khớp, upsert trùng _id và bị từ chối
+        await review_sentiment_backfill_collection.update_one(
+            {"_id": BACKFILL_LOCK_ID, "$or": [
+                {"owner": None},
+                {"heartbeat_at": {"$lt": now - timedelta(seconds=BACKFILL_LOCK_STALE_SECONDS)}},
+            ]},
+            {"$set": {"owner": owner, "model_version": model_version, "heartbeat_at": now}},
+            upsert=True
+        )
+        return None
+    except DuplicateKeyError:
+        return await review_sentiment_backfill_collection.find_one({"_id": BACKFILL_LOCK_ID}) or {}
+
+
+async def refresh_backfill_lock(owner: str) -> None:
+    """Làm mới khóa backfill, lỗi ghi chỉ được log lại"""
+    try:
+        await review_sentiment_backfill_collection.update_one(
+            {"_id": BACKFILL_LOCK_ID, "owner": owner}, {"$set": {"heartbeat_at": datetime.now()}}
+        )
+    except Exception as e:
+        logger.error(f"Error refreshing sentiment backfill lock: {str(e)}")
+
+
+async def release_backfill_lock(owner: str) -> None:
+    """Trả khóa nếu vẫn đang giữ nó, lỗi ghi chỉ được log lại (khóa hết hạn sau BACKFILL_LOCK_STALE_SECONDS)"""
+    try:
+        await review_sentiment_backfill_collection.update_one(
+            {"_id": BACKFILL_LOCK_ID, "owner": owner}, {"$set": {"owner": None}}
+        )
+    except Exception as e:
+        logger.error(f"Error releasing sentiment backfill lock: {str(e)}")
+
+
+class SentimentWriteBatch:
+    """
+    Gom kết quả mới và mốc của các store để ghi một lần bằng bulk_write
+    """
+
+    def __init__(self, model_version: str):
+        self.model_version = model_version
+        self._sentiment_ops: List[UpdateOne] = []
+        self._watermark_ops: List[UpdateOne] = []
+
+    def add(self, store_id: str, review: Dict, label: str, confidence: float) -> None:
+        """Thêm kết quả vừa chấm của một review"""
+        self._sentiment_ops.append(UpdateOne(
+            {"_id": review["_id"]},
+            {"$set": {
+                "store_id": store_id,
+                "label": label,
+                "confidence": float(confidence),
+                "model_version": self.model_version,
+                "content_hash": text_hash(review["content"]),
+                "review_created_at": review.get("created_at"),
+                "scored_at": datetime.now(),
+            }},
+            upsert=True
+        ))
+
+    def mark_store(self, store_id: str, reviews: List[Dict], scored: int, reused: int) -> None:
+        """Cập nhật mốc của store sau khi đã chấm xong các review của nó"""
+        last_scored_at = max(
+            (review.get("updated_at") or review.get("created_at") for review in reviews),
+            default=None
+        )
+        update = {
+            "model_version": self.model_version,
+            "last_run_at": datetime.now(),
+            "scored": scored,
+            "reused": reused,
+        }
+        operation = {"$set": update}
+        if last_scored_at is not None:
+            # Mốc chỉ tiến lên, không lùi lại khi chạy với cửa sổ thời gian ngắn hơn
+            operation["$max"] = {"last_scored_at": last_scored_at}
+        self._watermark_ops.append(UpdateOne({"_id": store_id}, operation, upsert=True))
+
+    async def flush(self) -> None:
+        """Ghi tất cả thay đổi đang chờ, lỗi ghi chỉ được log lại"""
+        if not PERSIST_ENABLED:
+            return
+        try:
+            if self._sentiment_ops:
+                await review_sentiment_collection.bulk_write(self._sentiment_ops, ordered=False)
+            if self._watermark_ops:
+                await review_sentiment_watermark_collection.bulk_write(self._watermark_ops, ordered=False)
+            logger.info(f"Persisted {len(self._sentiment_ops)} review sentiments "
+                        f"and {len(self._watermark_ops)} store watermarks")
+        except Exception as e:
+            logger.error(f"Error persisting review sentiments: {str(e)}")
+        finally:
+            self._sentiment_ops = []
+            self._watermark_ops = []
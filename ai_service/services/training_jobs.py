@@ -0,0 +1,350 @@
+# services/training_jobs.py
+# Chạy huấn luyện model recommendation ở background, mỗi lúc chỉ một lần (kể cả khi có nhiều uvicorn worker)
+#
+# trainingjobs: {_id: job_id, kind, status, phase, created_at, started_at,
+#                finished_at, duration_seconds, result, error}
+#               {_id: "active_job", job_id, kind, heartbeat_at}: khóa dùng chung giữa các worker,
+#               job_id = None khi không có job nào chạy
+import asyncio
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+
+from loguru import logger
+from pymongo.errors import DuplicateKeyError
+
+from database.mongo import training_job_collection
+from models.recommendation.fold_in import run_fold_in
+from models.recommendation.materializer import run_materialization
+from models.recommendation.registry import registry
+from models.recommendation.trainer import run_training
+from services.profile_rebuild import run_profile_rebuild
+
+# Số job gần nhất giữ trong bộ nhớ (các job cũ hơn vẫn đọc được từ MongoDB)
+KEEP_JOBS = int(os.getenv("TRAINING_KEEP_JOBS", "20"))
+# Chu kỳ tự fold-in user/sản phẩm mới (phút), 0 = tắt
+FOLD_IN_INTERVAL_MINUTES = float(os.getenv("RECOMMENDER_FOLD_IN_INTERVAL_MINUTES", "0"))
+# Giờ chạy tính trước top-N hằng ngày ("HH:MM" theo giờ server), rỗng = tắt
+MATERIALIZE_AT = os.getenv("RECOMMENDER_MATERIALIZE_AT", "02:00")
+# Chu kỳ làm mới khóa của job đang chạy và thời gian (giây) không được làm mới thì khóa bị coi là
+# bỏ lại (worker giữ khóa đã chết) và worker khác được lấy
+LOCK_HEARTBEAT_SECONDS = float(os.getenv("TRAINING_LOCK_HEARTBEAT_SECONDS", "60"))
+LOCK_STALE_SECONDS = float(os.getenv("TRAINING_LOCK_STALE_SECONDS", "300"))
+
+LOCK_ID = "active_job"
+
+# full_retrain: huấn luyện lại toàn bộ trong process riêng
+# fold_in: thêm user/sản phẩm mới vào model đang phục vụ (nhẹ, chạy trên thread)
+# materialize: tính trước top-N sản phẩm cho mọi user vào recommendations
+# profile_rebuild: tính lại profile hành vi của mọi user có action (một lần duyệt useractions)
+JOB_KINDS = ("full_retrain", "fold_in", "materialize", "profile_rebuild")
+
+ACTIVE_STATUSES = ("queued", "running")
+
+_jobs: Dict[str, Dict] = {}
+_active_job_id: Optional[str] = None
+# Giữ tham chiếu tới các task chạy nền để chúng không bị thu hồi khi đang chạy
+_tasks: Set[asyncio.Future] = set()
+_executor: Optional[ProcessPoolExecutor] = None
+_fold_in_schedule: Optional[asyncio.Task] = None
+_materialize_schedule: Optional[asyncio.Task] = None
+
+
+class TrainingInProgressError(RuntimeError):
+    """Đã có một lần huấn luyện đang chạy"""
+
+    def __init__(self, job: Dict):
+        super().__init__(f"Training job {job['job_id']} is already {job['status']}")
+        self.job = job
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Process riêng cho SVD.fit để không chặn event loop và GIL của API"""
+    global _executor
+    if _executor is None:
+        # spawn: không fork process đang giữ event loop và kết nối MongoDB
+        _executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def _save_job(job: Dict) -> None:
+    """Ghi trạng thái job vào MongoDB, lỗi ghi chỉ được log lại"""
+    document = {key: value for key, value in job.items() if key != "job_id"}
+    try:
+        await training_job_collection.update_one({"_id": job["job_id"]}, {"$set": document}, upsert=True)
+    except Exception as e:
+        logger.error(f"Error saving training job {job['job_id']}: {str(e)}")
+
+
+async def _save_phase(job_id: str, phase: str) -> None:
+    """Ghi bước hiện tại, chỉ khi job vẫn đang chạy để lần ghi trễ không đè trạng thái cuối"""
+    try:
+        await training_job_collection.update_one({"_id": job_id, "status": "running"}, {"$set": {"phase": phase}})
+    except Exception as e:
+        logger.error(f"Error saving training job {job_id}: {str(e)}")
+
+
+def _spawn(coroutine) -> asyncio.Future:
+    """Chạy coroutine ở background và giữ tham chiếu tới khi nó kết thúc"""
+    task = asyncio.ensure_future(coroutine)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def _claim_lock(job: Dict) -> Optional[Dict]:
+    """
+    Lấy khóa job trong trainingjobs bằng một lệnh cập nhật có điều kiện
+
+    Returns:
+        None nếu lấy được khóa, ngược lại document khóa của job đang chạy
+    """
+    now = datetime.now()
+    try:
+        # Khóa đang bị giữ thì không document nào khớp, upsert trùng _id và bị từ chối
+        await training_job_collection.update_one(
+            {"_id": LOCK_ID, "$or": [
+                {"job_id": None},
+                {"heartbeat_at": {"$lt": now - timedelta(seconds=LOCK_STALE_SECONDS)}},
+            ]},
+            {"$set": {"job_id": job["job_id"], "kind": job["kind"], "heartbeat_at": now}},
+            upsert=True
+        )
+        return None
+    except DuplicateKeyError:
+        return await training_job_collection.find_one({"_id": LOCK_ID}) or {}
+
+
+async def _release_lock(job_id: str) -> None:
+    """Trả khóa nếu job vẫn đang giữ nó, lỗi ghi chỉ được log lại (khóa hết hạn sau LOCK_STALE_SECONDS)"""
+    try:
+        await training_job_collection.update_one({"_id": LOCK_ID, "job_id": job_id}, {"$set": {"job_id": None}})
+    except Exception as e:
+        logger.error(f"Error releasing training job lock {job_id}: {str(e)}")
+
+
+async def _heartbeat(job_id: str) -> None:
+    """Định kỳ làm mới khóa để worker khác không coi job đang chạy là bị bỏ lại"""
+    while True:
+        await asyncio.sleep(LOCK_HEARTBEAT_SECONDS)
+        try:
+            await training_job_collection.update_one(
+                {"_id": LOCK_ID, "job_id": job_id}, {"$set": {"heartbeat_at": datetime.now()}}
+            )
+        except Exception as e:
+            logger.error(f"Error refreshing training job lock {job_id}: {str(e)}")
+
+
+def _prune_jobs() -> None:
+    """Chỉ giữ KEEP_JOBS job gần nhất trong bộ nhớ"""
+    finished = [job_id for job_id, job in _jobs.items() if job["status"] not in ACTIVE_STATUSES]
+    for job_id in finished[:max(0, len(_jobs) - KEEP_JOBS)]:
+        del _jobs[job_id]
+
+
+async def _run_job(job: Dict) -> None:
+    """Chạy một job huấn luyện và cập nhật trạng thái của nó"""
+    global _active_job_id
+
+    def on_phase(phase: str) -> None:
+        job["phase"] = phase
+        _spawn(_save_phase(job["job_id"], phase))
+
+    heartbeat = _spawn(_heartbeat(job["job_id"]))
+    job["status"] = "running"
+    job["started_at"] = datetime.now()
+    await _save_job(dict(job))
+    try:
+        if job["kind"] == "fold_in":
+            job["result"] = await run_fold_in(None, on_phase)
+        elif job["kind"] == "materialize":
+            job["result"] = await run_materialization(None, on_phase)
+        elif job["kind"] == "profile_rebuild":
+            job["result"] = await run_profile_rebuild(on_phase)
+        else:
+            job["result"] = await run_training(_get_executor(), on_phase)
+        job["status"] = "done"
+        logger.info(f"Training job {job['job_id']} ({job['kind']}) finished, "
+                    f"version {job['result'].get('version')}")
+    except Exception as e:
+        logger.error(f"Training job {job['job_id']} failed: {str(e)}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+    finally:
+        job["finished_at"] = datetime.now()
+        job["duration_seconds"] = round((job["finished_at"] - job["started_at"]).total_seconds(), 3)
+        job["phase"] = None
+        heartbeat.cancel()
+        _active_job_id = None
+        await _save_job(dict(job))
+        await _release_lock(job["job_id"])
+        _prune_jobs()
+
+
+async def start_training_job(kind: str = "full_retrain") -> Dict:
+    """
+    Tạo job huấn luyện mới và chạy ở background
+
+    Args:
+        kind: Loại job (xem JOB_KINDS)
+
+    Returns:
+        Trạng thái ban đầu của job
+
+    Raises:
+        ValueError: Khi kind không hợp lệ
+        TrainingInProgressError: Khi đã có job đang chờ hoặc đang chạy (ở worker này hoặc worker khác)
+    """
+    global _active_job_id
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unsupported training job kind '{kind}', expected one of {JOB_KINDS}")
+    if _active_job_id is not None:
+        raise TrainingInProgressError(get_job_status(_active_job_id))
+
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "kind": kind,
+        "status": "queued",
+        "phase": None,
+        "created_at": datetime.now(),
+        "started_at": None,
+        "finished_at": None,
+        "duration_seconds": None,
+        "result": None,
+        "error": None,
+    }
+    _active_job_id = job["job_id"]
+    try:
+        holder = await _claim_lock(job)
+    except Exception:
+        _active_job_id = None
+        raise
+    if holder is not None:
+        _active_job_id = None
+        active = await find_job(holder["job_id"]) if holder.get("job_id") else None
+        raise TrainingInProgressError(active or {"job_id": holder.get("job_id"), "status": "running"})
+
+    _jobs[job["job_id"]] = job
+    await _save_job(dict(job))
+    _spawn(_run_job(job))
+    return get_job_status(job["job_id"])
+
+
+def _serialize(job: Dict) -> Dict:
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in job.items()}
+
+
+def get_job_status(job_id: str) -> Optional[Dict]:
+    """Trạng thái job đang giữ trong bộ nhớ (None nếu không có)"""
+    job = _jobs.get(job_id)
+    return _serialize(job) if job is not None else None
+
+
+async def find_job(job_id: str) -> Optional[Dict]:
+    """Trạng thái job, tìm trong bộ nhớ trước rồi tới MongoDB"""
+    job = get_job_status(job_id)
+    if job is not None:
+        return job
+    document = await training_job_collection.find_one({"_id": job_id})
+    if document is None:
+        return None
+    document["job_id"] = document.pop("_id")
+    return _serialize(document)
+
+
+def list_jobs() -> List[Dict]:
+    """Các job trong bộ nhớ, mới nhất trước"""
+    return [_serialize(job) for job in reversed(list(_jobs.values()))]
+
+
+async def _run_fold_in_schedule(interval_seconds: float) -> None:
+    """Định kỳ fold-in user/sản phẩm mới, bỏ qua lượt trùng với job khác"""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await start_training_job("fold_in")
+        except TrainingInProgressError:
+            logger.info("Skipping scheduled fold-in, another training job is active")
+        except Exception as e:
+            logger.error(f"Error starting scheduled fold-in: {str(e)}")
+
+
+def start_fold_in_schedule(interval_minutes: float = FOLD_IN_INTERVAL_MINUTES) -> None:
+    """Bật fold-in định kỳ nếu interval_minutes > 0"""
+    global _fold_in_schedule
+    if interval_minutes > 0 and (_fold_in_schedule is None or _fold_in_schedule.done()):
+        _fold_in_schedule = asyncio.ensure_future(_run_fold_in_schedule(interval_minutes * 60))
+
+
+def _seconds_until(at: str) -> float:
+    """Số giây tới lần kế tiếp đồng hồ chỉ at ("HH:MM")"""
+    hour, minute = (int(part) for part in at.split(":"))
+    now = datetime.now()
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+async def _materialized_since(since: datetime) -> bool:
+    """Đã có lần materialize xong cho phiên bản model đang phục vụ kể từ since (ở bất kỳ worker nào)"""
+    version = registry.get_scorer().version or "legacy"
+    document = await training_job_collection.find_one({
+        "kind": "materialize",
+        "status": "done",
+        "finished_at": {"$gte": since},
+        "result.version": version,
+    }, {"_id": 1})
+    return document is not None
+
+
+async def _run_materialize_schedule(at: str) -> None:
+    """
+    Tính trước top-N mỗi ngày một lần
+
+    Mọi uvicorn worker đều chạy lịch này nhưng mỗi đêm chỉ một lần materialize: worker
+    thấy một materialize khác đang chạy thì bỏ lượt, lượt trùng với job loại khác được
+    thử lại sau ít phút và bị bỏ nếu phiên bản model hiện tại đã được materialize từ giờ hẹn.
+    """
+    while True:
+        delay = _seconds_until(at)
+        scheduled_at = datetime.now() + timedelta(seconds=delay)
+        await asyncio.sleep(delay)
+        while True:
+            try:
+                if await _materialized_since(scheduled_at):
+                    logger.info("Skipping scheduled materialization, already done for the serving model")
+                    break
+                await start_training_job("materialize")
+                break
+            except TrainingInProgressError as e:
+                if e.job.get("kind") == "materialize":
+                    logger.info("Skipping scheduled materialization, another worker is running it")
+                    break
+                logger.info("Scheduled materialization waiting for another training job")
+                await asyncio.sleep(300)
+            except Exception as e:
+                logger.error(f"Error starting scheduled materialization: {str(e)}")
+                break
+
+
+def start_materialize_schedule(at: str = MATERIALIZE_AT) -> None:
+    """Bật tính trước top-N hằng ngày nếu có giờ chạy"""
+    global _materialize_schedule
+    if at and (_materialize_schedule is None or _materialize_schedule.done()):
+        _seconds_until(at)  # Kiểm tra định dạng ngay khi khởi động
+        _materialize_schedule = asyncio.ensure_future(_run_materialize_schedule(at))
+
+
+def shutdown_executor() -> None:
+    """Dừng các lịch chạy định kỳ và process huấn luyện khi service tắt"""
+    global _executor
+    for schedule in (_fold_in_schedule, _materialize_schedule):
+        if schedule is not None:
+            schedule.cancel()
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
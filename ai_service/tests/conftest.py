@@ -0,0 +1,7 @@
+# tests/conftest.py
+# Chạy từ thư mục ai_service: python -m pytest -q tests
+# Các module import theo thư mục gốc ai_service (database.mongo, models..., utils...)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,195 @@
+# tests/test_behavior_aggregation.py
+# Engine "aggregation" phải cho cùng kết quả với engine "python" của UserBehaviorAnalyzer
+#
+# Cần MongoDB 5.0+ ($setWindowFields) tại TEST_MONGO_URI (mặc định mongodb://localhost:27017),
+# không có thì bỏ qua. Mỗi lần chạy dùng một database tạm và xóa khi xong.
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+import utils.behavior_aggregation as behavior_aggregation
+import utils.product_catalog as product_catalog_module
+import utils.product_features as product_features
+import utils.user_behavior_analyzer as user_behavior_analyzer
+from utils.behavior_aggregation import aggregate_user_profile, compare_engines
+from utils.product_catalog import ProductCatalogIndex
+from utils.user_behavior_analyzer import (
+    KEYWORD_STOPWORDS, TOP_BRANDS, TOP_CATEGORIES, TOP_KEYWORDS, UserBehaviorAnalyzer,
+)
+
+MONGO_URI = os.getenv("TEST_MONGO_URI", "mongodb://localhost:27017")
+ANALYSIS_DAYS = 30
+MAX_ACTIONS = 40
+
+
+def _server_version():
+    try:
+        client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=1000)
+        try:
+            return tuple(client.server_info()["versionArray"][:2])
+        finally:
+            client.close()
+    except PyMongoError:
+        return None
+
+
+_version = _server_version()
+pytestmark = pytest.mark.skipif(
+    _version is None or _version < (5, 0),
+    reason=f"needs MongoDB 5.0+ at {MONGO_URI} (TEST_MONGO_URI)",
+)
+
+RICH_USER = ObjectId("64b000000000000000000001")
+CAPPED_USER = ObjectId("64b000000000000000000002")
+MISSING_PRODUCTS_USER = ObjectId("64b000000000000000000003")
+IDLE_USER = ObjectId("64b000000000000000000004")
+USERS = [RICH_USER, CAPPED_USER, MISSING_PRODUCTS_USER, IDLE_USER]
+
+ACTION_TYPES = ["view_product", "click_product", "add_to_cart", "add_to_wishlist", "purchase"]
+
+
+def _products():
+    """Sản phẩm cố định, id theo thứ tự p0, p1, ..."""
+    oid = lambda index: ObjectId(f"64a0000000000000000000{index:02x}")
+    # "Đảo" chỉ xuất hiện với cách viết hoa/thường khác nhau ở mỗi sản phẩm: từng biến thể
+    # đứng ngoài top keyword, gộp theo str.lower() thì đứng đầu
+    island = ["Đảo", "ĐẢO", "đảo", "ĐẢo", "đẢO", "Đảo"]
+    products = []
+    for index in range(30):
+        product = {
+            "_id": oid(index),
+            "name": f"Sản phẩm Mẫu{index % 7} Chất lượng {'Jean' if index % 3 else 'JEAN'}",
+            # Hai category và hai brand có cùng tổng trọng số: thứ tự phải theo lần gặp đầu tiên
+            "category": ["Áo", "Quần", "Giày", None, ""][index % 5],
+            "brand": ["Nike", "Adidas", "Việt Tiến"][index % 3],
+            "price": [0, 99000, 250000.5, "1000", None, 15][index % 6],
+            "keywords": [island[index % len(island)], f"kw{index}", " Thể Thao "],
+            "tags": ["the", "and", f"tag{index % 4}", "ab"] if index % 2 else "Mùa Hè",
+        }
+        if index % 10 == 9:
+            del product["keywords"]
+        products.append(product)
+    return products
+
+
+def _actions(now: datetime):
+    products = _products()
+    actions = []
+    tick = iter(range(1, 10_000))
+
+    def add(customer_id, product_id, action_type, minutes_ago=None):
+        # Thời điểm khác nhau cho mọi action để thứ tự mới nhất trước là duy nhất
+        minutes = next(tick) if minutes_ago is None else minutes_ago
+        actions.append({
+            "customer_id": customer_id,
+            "product_id": product_id,
+            "action_type": action_type,
+            "timestamp": now - timedelta(minutes=minutes, seconds=next(tick)),
+        })
+
+    for index, product in enumerate(products):
+        for repeat in range(1 + index % 3):
+            add(RICH_USER, str(product["_id"]), ACTION_TYPES[(index + repeat) % 5])
+    # product_id dạng ObjectId, id sai, không có, sản phẩm đã xóa, action không được tính
+    add(RICH_USER, products[4]["_id"], "purchase")
+    add(RICH_USER, "not-an-id", "view_product")
+    add(RICH_USER, None, "click_product")
+    add(RICH_USER, str(ObjectId()), "add_to_cart")
+    add(RICH_USER, str(products[1]["_id"]), "search")
+    # Ngoài cửa sổ thời gian
+    add(RICH_USER, str(products[2]["_id"]), "purchase", minutes_ago=(ANALYSIS_DAYS + 2) * 24 * 60)
+
+    for index in range(MAX_ACTIONS * 2):
+        add(CAPPED_USER, str(products[(index * 7) % len(products)]["_id"]), ACTION_TYPES[index % 5])
+
+    for _ in range(3):
+        add(MISSING_PRODUCTS_USER, str(ObjectId()), "view_product")
+    return actions
+
+
+def _run(monkeypatch, check):
+    """Nạp dữ liệu vào database tạm, trỏ các module tới đó rồi chạy check()"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def main():
+        client = AsyncIOMotorClient(MONGO_URI)
+        db = client[f"test_behavior_{uuid.uuid4().hex[:12]}"]
+        try:
+            monkeypatch.setattr(behavior_aggregation, "user_action_collection", db.useractions)
+            monkeypatch.setattr(behavior_aggregation, "product_collection", db.products)
+            monkeypatch.setattr(user_behavior_analyzer, "user_action_collection", db.useractions)
+            monkeypatch.setattr(product_catalog_module, "product_collection", db.products)
+            monkeypatch.setattr(product_features, "product_catalog", ProductCatalogIndex())
+
+            await db.products.insert_many(_products())
+            await db.useractions.insert_many(_actions(datetime.utcnow()))
+            await check()
+        finally:
+            await client.drop_database(db.name)
+            client.close()
+
+    asyncio.run(main())
+
+
+async def _both_engines(analyzer: UserBehaviorAnalyzer, customer_id: ObjectId):
+    end_date = datetime.utcnow()
+    start_date = end_date - timedelta(days=ANALYSIS_DAYS)
+    actions = await analyzer._get_user_actions(str(customer_id), start_date, end_date)
+    python = None
+    if actions:
+        details = await analyzer._get_product_details(actions)
+        python = analyzer._aggregate_actions(actions, details)
+    aggregation = await aggregate_user_profile(
+        str(customer_id), start_date, end_date, analyzer.ACTION_WEIGHTS, analyzer.max_actions,
+        TOP_CATEGORIES, TOP_BRANDS, TOP_KEYWORDS, KEYWORD_STOPWORDS
+    )
+    return python, aggregation
+
+
+def test_engines_produce_same_aggregates(monkeypatch):
+    async def check():
+        analyzer = UserBehaviorAnalyzer(max_actions=MAX_ACTIONS)
+        for customer_id in USERS:
+            python, aggregation = await _both_engines(analyzer, customer_id)
+            assert aggregation == python, customer_id
+            if python is not None:
+                # Thứ tự action_counts quyết định preferred_action khi bằng số lần
+                assert list(aggregation["action_counts"]) == list(python["action_counts"])
+
+    _run(monkeypatch, check)
+
+
+def test_ties_keep_first_seen_order(monkeypatch):
+    async def check():
+        python, aggregation = await _both_engines(UserBehaviorAnalyzer(max_actions=MAX_ACTIONS), RICH_USER)
+        assert aggregation["categories"] == python["categories"]
+        assert aggregation["brands"] == python["brands"]
+        assert len(aggregation["categories"]) > 1 and len(aggregation["brands"]) > 1
+
+    _run(monkeypatch, check)
+
+
+def test_keywords_are_merged_with_unicode_case_folding(monkeypatch):
+    async def check():
+        python, aggregation = await _both_engines(UserBehaviorAnalyzer(max_actions=MAX_ACTIONS), RICH_USER)
+        assert aggregation["keywords"] == python["keywords"]
+        assert "đảo" in aggregation["keywords"]
+        assert not {"Đảo", "ĐẢO", "ĐẢo", "đẢO"} & set(aggregation["keywords"])
+        assert not set(KEYWORD_STOPWORDS) & set(aggregation["keywords"])
+
+    _run(monkeypatch, check)
+
+
+def test_compare_engines_reports_no_mismatch(monkeypatch):
+    async def check():
+        report = await compare_engines([str(customer_id) for customer_id in USERS], ANALYSIS_DAYS)
+        assert report["users"] == len(USERS)
+        assert report["mismatches"] == []
+
+    _run(monkeypatch, check)
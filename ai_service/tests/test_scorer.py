@@ -0,0 +1,142 @@
+# tests/test_scorer.py
+# SVDScorer phải cho cùng điểm và cùng thứ tự top-N với surprise SVD.predict
+import numpy as np
+import pandas as pd
+import pytest
+
+surprise = pytest.importorskip("surprise")
+
+from models.recommendation.scorer import SVDScorer, top_n_indices, top_n_matrix
+
+RATING_SCALE = (1, 5)
+UNKNOWN_USER = "u-unknown"
+UNKNOWN_ITEMS = ["p-unknown-1", "p-unknown-2", "p-unknown-3"]
+CUSTOMER_IDS = ["u0", "u7", "u29", UNKNOWN_USER]
+
+
+def _ratings(seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    rows = []
+    for user in range(30):
+        for item in rng.choice(40, size=12, replace=False):
+            # Nhiều điểm 5 để một số dự đoán vượt rating_scale và bị cắt
+            rating = 5 if item < 5 else int(rng.integers(1, 6))
+            rows.append((f"u{user}", f"p{item}", rating))
+    return pd.DataFrame(rows, columns=["user", "item", "rating"])
+
+
+def _fit(biased: bool):
+    data = surprise.Dataset.load_from_df(_ratings(), surprise.Reader(rating_scale=RATING_SCALE))
+    model = surprise.SVD(n_factors=8, n_epochs=40, lr_all=0.02, biased=biased, random_state=0)
+    model.fit(data.build_full_trainset())
+    return model
+
+
+@pytest.fixture(scope="module", params=[True, False], ids=["biased", "unbiased"])
+def fitted(request):
+    model = _fit(request.param)
+    return model, SVDScorer.from_surprise(model)
+
+
+def _product_ids(model):
+    trainset = model.trainset
+    known = [trainset.to_raw_iid(inner) for inner in range(trainset.n_items)]
+    # Sản phẩm chưa biết xen giữa để kiểm tra thứ tự khi bằng điểm
+    return known[:10] + UNKNOWN_ITEMS[:1] + known[10:] + UNKNOWN_ITEMS[1:]
+
+
+def _seen(model, customer_id):
+    """Sản phẩm user đã đánh giá trong tập huấn luyện (user chưa biết: vài sản phẩm cố định)"""
+    trainset = model.trainset
+    try:
+        inner = trainset.to_inner_uid(customer_id)
+    except ValueError:
+        return {"p1", "p2", UNKNOWN_ITEMS[0]}
+    return {trainset.to_raw_iid(item) for item, _ in trainset.ur[inner]}
+
+
+def _legacy_top(model, customer_id, product_ids, top_n, seen=()):
+    """Cách cũ: predict từng sản phẩm chưa xem rồi sorted(..., reverse=True)"""
+    candidates = [pid for pid in product_ids if pid not in seen]
+    predictions = [(pid, model.predict(customer_id, pid).est) for pid in candidates]
+    return [pid for pid, _ in sorted(predictions, key=lambda x: x[1], reverse=True)[:top_n]]
+
+
+def test_scores_match_predict(fitted):
+    model, scorer = fitted
+    product_ids = _product_ids(model)
+    for customer_id in CUSTOMER_IDS:
+        expected = [model.predict(customer_id, pid).est for pid in product_ids]
+        np.testing.assert_allclose(scorer.score_products(customer_id, product_ids), expected, rtol=0, atol=1e-9)
+
+
+def test_scores_are_clipped_to_rating_scale(fitted):
+    model, scorer = fitted
+    scores = scorer.score_users(CUSTOMER_IDS)
+    assert scores.min() >= RATING_SCALE[0] and scores.max() <= RATING_SCALE[1]
+    raw = [model.predict(cid, pid, clip=False).est for cid in CUSTOMER_IDS for pid in _product_ids(model)]
+    # Dữ liệu được chọn để có dự đoán vượt rating_scale, nếu không test trên không kiểm tra việc cắt
+    assert max(raw) > RATING_SCALE[1]
+
+
+def test_score_users_matches_score_items(fitted):
+    model, scorer = fitted
+    customer_ids = CUSTOMER_IDS
+    matrix = scorer.score_users(customer_ids)
+    for row, customer_id in enumerate(customer_ids):
+        np.testing.assert_allclose(matrix[row], scorer.score_items(customer_id), rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize("top_n", [1, 5, 20, 100])
+def test_top_n_order_matches_predict(fitted, top_n):
+    model, scorer = fitted
+    product_ids = _product_ids(model)
+    for customer_id in CUSTOMER_IDS:
+        scores = scorer.score_products(customer_id, product_ids)
+        top = [product_ids[i] for i in top_n_indices(scores, top_n)]
+        assert top == _legacy_top(model, customer_id, product_ids, top_n)
+
+
+@pytest.mark.parametrize("top_n", [1, 5, 20, 100])
+def test_top_n_with_exclude_matches_predict(fitted, top_n):
+    model, scorer = fitted
+    product_ids = _product_ids(model)
+    for customer_id in CUSTOMER_IDS:
+        seen = _seen(model, customer_id)
+        exclude = np.isin(np.asarray(product_ids), list(seen))
+        scores = scorer.score_products(customer_id, product_ids)
+        top = [product_ids[i] for i in top_n_indices(scores, top_n, exclude=exclude)]
+        assert top == _legacy_top(model, customer_id, product_ids, top_n, seen)
+
+
+@pytest.mark.parametrize("top_n", [1, 5, 20, 100])
+def test_top_n_matrix_matches_top_n_indices(fitted, top_n):
+    model, scorer = fitted
+    product_ids = _product_ids(model)
+    customer_ids = CUSTOMER_IDS
+    item_indices = scorer.item_indices(product_ids)
+    known = item_indices >= 0
+
+    scores = np.empty((len(customer_ids), len(product_ids)))
+    scores[:] = np.asarray([scorer.unknown_item_score(cid) for cid in customer_ids])[:, None]
+    scores[:, known] = scorer.score_users(customer_ids, item_indices[known])
+    rng = np.random.default_rng(1)
+    exclude = rng.random(scores.shape) < 0.3
+
+    for with_exclude in (None, exclude):
+        top = top_n_matrix(scores, top_n, with_exclude)
+        for row in range(len(customer_ids)):
+            row_exclude = None if with_exclude is None else with_exclude[row]
+            expected = top_n_indices(scores[row], top_n, exclude=row_exclude)
+            assert top[row][top[row] >= 0].tolist() == expected.tolist()
+
+
+def test_save_and_load_round_trip(fitted, tmp_path):
+    model, scorer = fitted
+    scorer.save(str(tmp_path))
+    loaded = SVDScorer.load(str(tmp_path))
+    product_ids = _product_ids(model)
+    for customer_id in CUSTOMER_IDS:
+        np.testing.assert_array_equal(
+            loaded.score_products(customer_id, product_ids), scorer.score_products(customer_id, product_ids)
+        )
@@ -0,0 +1,107 @@
+# tests/test_text_preprocessing.py
+# SequenceEncoder phải cho kết quả giống hệt Tokenizer.texts_to_sequences + pad_sequences của Keras
+import json
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+text = pytest.importorskip("tensorflow.keras.preprocessing.text")
+sequence = pytest.importorskip("tensorflow.keras.preprocessing.sequence")
+
+from utils.text_preprocessing import SequenceEncoder, clean_texts
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "sentiment_models")
+
+CORPUS = [
+    "sản_phẩm rất tốt giao hàng nhanh",
+    "Sản_phẩm TỐT, đóng gói cẩn_thận!",
+    "hàng kém chất_lượng , không nên mua",
+    "giao hàng chậm nhưng sản_phẩm tốt",
+    "shop tư_vấn nhiệt_tình sẽ ủng_hộ tiếp",
+    "không hài_lòng   về chất_lượng sản_phẩm",
+    "tốt tốt tốt rất tốt",
+    "áo đẹp vải mát mặc thoải_mái",
+]
+
+SAMPLES = CORPUS + [
+    "",
+    "   ",
+    "từ_lạ hoàn_toàn không_có trong từ_điển",
+    "SẢN_PHẨM Rất Tốt ... giao   hàng\tnhanh",
+    "tốt " * 40,
+    "không nên mua hàng kém chất_lượng sản_phẩm rất tốt giao hàng nhanh đóng gói cẩn_thận shop",
+    "mua/bán (giá) #tốt @shop 100% hài_lòng",
+]
+
+TOKENIZER_CONFIGS = {
+    "default": {},
+    "oov": {"oov_token": "<OOV>"},
+    "num_words": {"num_words": 10},
+    "num_words_oov": {"num_words": 10, "oov_token": "<OOV>"},
+    "no_filters": {"filters": "", "oov_token": "<OOV>"},
+    "case_sensitive": {"lower": False, "oov_token": "<OOV>"},
+}
+
+
+@pytest.fixture(params=list(TOKENIZER_CONFIGS), ids=list(TOKENIZER_CONFIGS))
+def tokenizer(request):
+    tokenizer = text.Tokenizer(**TOKENIZER_CONFIGS[request.param])
+    tokenizer.fit_on_texts(CORPUS)
+    return tokenizer
+
+
+def _keras(tokenizer, texts, maxlen):
+    return sequence.pad_sequences(tokenizer.texts_to_sequences(texts), maxlen=maxlen)
+
+
+def test_encode_matches_texts_to_sequences(tokenizer):
+    encoder = SequenceEncoder.from_tokenizer(tokenizer)
+    for sample in SAMPLES:
+        assert encoder.encode(sample) == tokenizer.texts_to_sequences([sample])[0], sample
+
+
+@pytest.mark.parametrize("maxlen", [1, 4, 8, 100])
+def test_encode_batch_matches_pad_sequences(tokenizer, maxlen):
+    # maxlen nhỏ: cắt bớt phía đầu chuỗi; maxlen lớn: đệm 0 phía đầu chuỗi
+    expected = _keras(tokenizer, SAMPLES, maxlen)
+    actual = SequenceEncoder.from_tokenizer(tokenizer).encode_batch(SAMPLES, maxlen)
+    assert actual.dtype == expected.dtype
+    np.testing.assert_array_equal(actual, expected)
+
+
+def test_config_round_trip(tokenizer):
+    encoder = SequenceEncoder.from_tokenizer(tokenizer)
+    # Cấu hình được lưu dạng JSON cạnh model (xem utils/tflite_backend.py)
+    restored = SequenceEncoder.from_config(json.loads(json.dumps(encoder.to_config(), ensure_ascii=False)))
+    np.testing.assert_array_equal(restored.encode_batch(SAMPLES, 12), _keras(tokenizer, SAMPLES, 12))
+    assert restored.matches_tokenizer(tokenizer, SAMPLES, 12)
+
+
+def test_char_level_tokenizer_is_rejected():
+    tokenizer = text.Tokenizer(char_level=True)
+    tokenizer.fit_on_texts(CORPUS)
+    with pytest.raises(ValueError):
+        SequenceEncoder.from_tokenizer(tokenizer)
+
+
+def test_production_tokenizer_matches_keras():
+    """Tokenizer và maxlen của model sentiment đang dùng, trên văn bản đã qua clean_texts"""
+    try:
+        with open(os.path.join(MODEL_DIR, "tokenizer.pickle"), "rb") as handle:
+            tokenizer = pickle.load(handle)
+        with open(os.path.join(MODEL_DIR, "model_metadata.pickle"), "rb") as handle:
+            maxlen = pickle.load(handle)["maxlen"]
+    except (OSError, pickle.UnpicklingError, ImportError, AttributeError, KeyError) as e:
+        pytest.skip(f"production tokenizer not available: {e}")
+
+    texts = clean_texts(SAMPLES + [
+        "Sản phẩm rất tốt, giao hàng nhanh, đóng gói cẩn thận. Sẽ ủng hộ shop dài dài!!!",
+        "Hàng không giống hình, chất lượng kém, không nên mua 👎",
+        "San pham tot, gia re",
+        " ".join(["tuyệt vời"] * 200),
+    ])
+    expected = _keras(tokenizer, texts, maxlen)
+    actual = SequenceEncoder.from_tokenizer(tokenizer).encode_batch(texts, maxlen)
+    np.testing.assert_array_equal(actual, expected)
@@ -0,0 +1,299 @@
+# utils/behavior_aggregation.py
+# Tính profile hành vi của một user bằng một aggregation pipeline trên MongoDB
+#
+# Cho cùng kết quả với UserBehaviorAnalyzer._aggregate_actions (engine "python"):
+# cùng tập actions (cửa sổ thời gian, mới nhất trước, giới hạn số action), cùng trọng số,
+# cùng cách tách keyword và cùng thứ tự khi bằng điểm (phần tử gặp trước đứng trước,
+# giống Counter.most_common). Actions được gom theo sản phẩm trước khi $lookup, nên mỗi
+# sản phẩm chỉ được tra một lần; keyword được gộp chữ hoa/thường lần cuối bằng Python.
+#
+# So sánh kết quả và thời gian của hai engine trên dữ liệu thật, chạy từ thư mục ai_service:
+#     python -m utils.behavior_aggregation --users 200 --days 30
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from loguru import logger
+
+from database.mongo import product_collection, user_action_collection
+
+# Vị trí trong một sản phẩm < giá trị này, dùng để ghép (thứ tự action, vị trí keyword) thành một số
+_POSITION_SCALE = 1_000_000
+
+
+def _falsy(expression) -> Dict:
+    """Giá trị "rỗng" theo Python (None, thiếu, False, 0, "", [])"""
+    return {"$in": [{"$ifNull": [expression, None]}, [None, False, 0, "", []]]}
+
+
+def _as_terms(expression) -> Dict:
+    """keywords/tags: list giữ nguyên, giá trị đơn khác rỗng thành [giá trị], còn lại []"""
+    return {"$cond": [
+        {"$isArray": expression},
+        expression,
+        {"$cond": [_falsy(expression), [], [expression]]},
+    ]}
+
+
+def _name_words(expression) -> Dict:
+    """Các từ dài hơn 3 ký tự trong tên sản phẩm (tách theo khoảng trắng)"""
+    return {"$cond": [
+        {"$eq": [{"$type": expression}, "string"]},
+        {"$filter": {
+            "input": {"$map": {
+                "input": {"$regexFindAll": {"input": expression, "regex": r"\S+"}},
+                "in": "$$this.match",
+            }},
+            "cond": {"$gt": [{"$strLenCP": "$$this"}, 3]},
+        }},
+        [],
+    ]}
+
+
+def build_profile_pipeline(customer_id: ObjectId, start_date: datetime, end_date: datetime,
+                           action_weights: Dict[str, float], max_actions: int,
+                           top_categories: int, top_brands: int, top_keywords: int,
+                           stopwords: List[str]) -> List[Dict]:
+    """
+    Pipeline cho một user: $match cửa sổ thời gian -> $lookup products -> $facet theo từng chiều
+
+    Args:
+        customer_id: ObjectId của user
+        start_date: Thời điểm bắt đầu
+        end_date: Thời điểm kết thúc
+        action_weights: Trọng số của từng loại action (cũng là các loại action được tính)
+        max_actions: Số action gần nhất tối đa (0 = không giới hạn)
+        top_categories: Số category trả về
+        top_brands: Số brand trả về
+        top_keywords: Số keyword trả về
+        stopwords: Các keyword bị bỏ qua
+    """
+    weight = {"$switch": {
+        "branches": [
+            {"case": {"$eq": ["$action_type", action]}, "then": value}
+            for action, value in action_weights.items()
+        ],
+        "default": 1,
+    }}
+
+    pipeline = [
+        {"$match": {
+            "customer_id": customer_id,
+            "timestamp": {"$gte": start_date, "$lte": end_date},
+            "action_type": {"$in": list(action_weights.keys())},
+        }},
+        {"$sort": {"timestamp": -1}},
+    ]
+    if max_actions:
+        pipeline.append({"$limit": max_actions})
+    pipeline += [
+        # Đánh số thứ tự action (mới nhất = 1) để giữ thứ tự gặp trước như bản Python,
+        # không gom cả cửa sổ vào một document (giới hạn 16MB của BSON)
+        {"$setWindowFields": {"sortBy": {"timestamp": -1}, "output": {"rank": {"$documentNumber": {}}}}},
+        # Gom theo sản phẩm trước khi $lookup: mỗi sản phẩm chỉ tra một lần
+        {"$group": {
+            "_id": "$product_id",
+            "weight": {"$sum": weight},
+            "count": {"$sum": 1},
+            "first_seen": {"$min": "$rank"},
+            "actions": {"$push": {"action_type": "$action_type", "rank": "$rank"}},
+        }},
+        {"$addFields": {"product_oid": {"$convert": {
+            "input": "$_id", "to": "objectId", "onError": None, "onNull": None
+        }}}},
+        {"$lookup": {
+            "from": product_collection.name,
+            "let": {"product_oid": "$product_oid"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$_id", "$$product_oid"]}}},
+                {"$project": {"name": 1, "category": 1, "brand": 1, "price": 1, "keywords": 1, "tags": 1}},
+            ],
+            "as": "product",
+        }},
+        {"$addFields": {"product": {"$arrayElemAt": ["$product", 0]}}},
+    ]
+
+    def top_values(field: str, limit: int) -> List[Dict]:
+        return [
+            {"$match": {"$expr": {"$not": [_falsy(f"$product.{field}")]}}},
+            {"$group": {"_id": f"$product.{field}", "score": {"$sum": "$weight"},
+                        "first_seen": {"$min": "$first_seen"}}},
+            {"$sort": {"score": -1, "first_seen": 1}},
+            {"$limit": limit},
+        ]
+
+    # $toLower của MongoDB chỉ đổi chữ ASCII nên không cắt top ở đây: mọi keyword được trả
+    # về và gộp lại bằng str.lower() trong _merge_keywords (ví dụ "Đà"/"đà" cộng chung)
+    keyword_stages = [
+        {"$match": {"product": {"$type": "object"}}},
+        {"$project": {
+            "first_seen": 1,
+            "weight": 1,
+            "terms": {"$concatArrays": [
+                _as_terms("$product.keywords"),
+                _as_terms("$product.tags"),
+                _name_words("$product.name"),
+            ]},
+        }},
+        {"$unwind": {"path": "$terms", "includeArrayIndex": "position"}},
+        {"$match": {"terms": {"$type": "string", "$ne": ""}}},
+        {"$group": {
+            "_id": {"$toLower": {"$trim": {"input": "$terms"}}},
+            "score": {"$sum": "$weight"},
+            "first_seen": {"$min": {"$add": [{"$multiply": ["$first_seen", _POSITION_SCALE]}, "$position"]}},
+        }},
+        {"$match": {"$expr": {"$and": [
+            {"$gt": [{"$strLenCP": "$_id"}, 2]},
+            {"$not": [{"$in": ["$_id", stopwords]}]},
+        ]}}},
+    ]
+
+    pipeline.append({"$facet": {
+        "actions": [
+            {"$unwind": "$actions"},
+            {"$group": {"_id": "$actions.action_type", "count": {"$sum": 1},
+                        "first_seen": {"$min": "$actions.rank"}}},
+            {"$sort": {"first_seen": 1}},
+        ],
+        "categories": top_values("category", top_categories),
+        "brands": top_values("brand", top_brands),
+        "keywords": keyword_stages,
+        # Giá được tính theo từng action như bản Python (sản phẩm xem nhiều lần được tính nhiều lần)
+        "price": [
+            {"$match": {"product.price": {"$type": "number", "$ne": 0}}},
+            {"$group": {"_id": None, "min": {"$min": "$product.price"}, "max": {"$max": "$product.price"},
+                        "total": {"$sum": {"$multiply": ["$product.price", "$count"]}},
+                        "count": {"$sum": "$count"}}},
+        ],
+    }})
+    return pipeline
+
+
+def _merge_keywords(rows: List[Dict], stopwords: List[str], limit: int) -> List[str]:
+    """Gộp keyword theo str.lower() (chữ hoa ngoài ASCII) rồi lấy top theo điểm, gặp trước đứng trước"""
+    scores: Dict[str, float] = defaultdict(float)
+    first_seen: Dict[str, int] = {}
+    for row in rows:
+        keyword = row["_id"].lower()
+        if len(keyword) <= 2 or keyword in stopwords:
+            continue
+        scores[keyword] += row["score"]
+        first_seen[keyword] = min(first_seen.get(keyword, row["first_seen"]), row["first_seen"])
+    return sorted(scores, key=lambda keyword: (-scores[keyword], first_seen[keyword]))[:limit]
+
+
+async def aggregate_user_profile(customer_id: str, start_date: datetime, end_date: datetime,
+                                 action_weights: Dict[str, float], max_actions: int,
+                                 top_categories: int, top_brands: int, top_keywords: int,
+                                 stopwords: List[str]) -> Optional[Dict]:
+    """
+    Chạy pipeline và đổi kết quả về cùng dạng với UserBehaviorAnalyzer._aggregate_actions
+
+    Returns:
+        Dict categories/brands/keywords/price_range/action_counts/hourly_activity,
+        None nếu user không có action nào trong khoảng thời gian
+    """
+    pipeline = build_profile_pipeline(
+        ObjectId(customer_id), start_date, end_date, action_weights, max_actions,
+        top_categories, top_brands, top_keywords, stopwords
+    )
+    results = await user_action_collection.aggregate(pipeline, allowDiskUse=True).to_list(length=1)
+    if not results or not results[0]["actions"]:
+        return None
+    facets = results[0]
+
+    price_range = {"min": 0, "max": 0, "avg": 0}
+    if facets["price"]:
+        price = facets["price"][0]
+        price_range = {
+            "min": round(float(price["min"]), 2),
+            "max": round(float(price["max"]), 2),
+            "avg": round(float(price["total"]) / price["count"], 2),
+        }
+
+    return {
+        "categories": [row["_id"] for row in facets["categories"]],
+        "brands": [row["_id"] for row in facets["brands"]],
+        "keywords": _merge_keywords(facets["keywords"], stopwords, top_keywords),
+        "price_range": price_range,
+        "action_counts": {row["_id"]: row["count"] for row in facets["actions"]},
+        # Bản Python chưa thống kê theo giờ, giữ nguyên để hai engine cho cùng kết quả
+        "hourly_activity": {},
+    }
+
+
+# Các trường phụ thuộc thời điểm chạy, bỏ qua khi so sánh hai engine
+_VOLATILE_FIELDS = ("created_at", "updated_at", "analysis_period")
+
+
+def _comparable(profile: Dict) -> Dict:
+    profile = {key: value for key, value in profile.items() if key not in _VOLATILE_FIELDS}
+    profile["statistics"] = {key: value for key, value in profile["statistics"].items()
+                             if key != "last_activity_date"}
+    return profile
+
+
+async def compare_engines(customer_ids: List[str], analysis_days: int = 30) -> Dict[str, Any]:
+    """
+    Chạy cả hai engine cho từng user, so sánh kết quả và thời gian
+
+    Returns:
+        Số user, các user cho kết quả khác nhau, thời gian trung bình mỗi user của từng engine
+    """
+    from utils.user_behavior_analyzer import UserBehaviorAnalyzer
+
+    analyzer = UserBehaviorAnalyzer()
+    seconds = {"python": 0.0, "aggregation": 0.0}
+    mismatches = []
+    for customer_id in customer_ids:
+        profiles = {}
+        for engine in seconds:
+            started = time.perf_counter()
+            profiles[engine] = await analyzer.analyze_user_behavior(customer_id, analysis_days, engine)
+            seconds[engine] += time.perf_counter() - started
+        if _comparable(profiles["python"]) != _comparable(profiles["aggregation"]):
+            mismatches.append(customer_id)
+
+    count = max(1, len(customer_ids))
+    return {
+        "users": len(customer_ids),
+        "mismatches": mismatches,
+        "python_ms_per_user": round(seconds["python"] / count * 1000, 2),
+        "aggregation_ms_per_user": round(seconds["aggregation"] / count * 1000, 2),
+        "speedup": round(seconds["python"] / seconds["aggregation"], 2) if seconds["aggregation"] else None,
+    }
+
+
+async def _sample_customer_ids(count: int, analysis_days: int) -> List[str]:
+    """Các user có action trong khoảng thời gian phân tích"""
+    since = datetime.utcnow() - timedelta(days=analysis_days)
+    rows = await user_action_collection.aggregate([
+        {"$match": {"timestamp": {"$gte": since}}},
+        {"$group": {"_id": "$customer_id"}},
+        {"$limit": count},
+    ]).to_list(length=count)
+    return [str(row["_id"]) for row in rows if ObjectId.is_valid(str(row["_id"]))]
+
+
+async def _benchmark(customer_ids: List[str], count: int, analysis_days: int) -> Dict[str, Any]:
+    customer_ids = customer_ids or await _sample_customer_ids(count, analysis_days)
+    return await compare_engines(customer_ids, analysis_days)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the python and aggregation behavior engines")
+    parser.add_argument("--users", type=int, default=100, help="Number of active users to sample")
+    parser.add_argument("--days", type=int, default=30, help="Analysis window in days")
+    parser.add_argument("--customer-id", action="append", default=[], help="Benchmark these users instead")
+    args = parser.parse_args()
+
+    report = asyncio.run(_benchmark(args.customer_id, args.users, args.days))
+    logger.info(f"Behavior engine benchmark: {report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# utils/inference_executor.py
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from loguru import logger
+
+
+class InferenceQueueFullError(RuntimeError):
+    """Hàng đợi inference đã đầy, caller nên thử lại sau"""
+
+
+class InferenceExecutor:
+    """
+    Chạy các tác vụ inference (blocking) trên thread pool riêng
+
+    Event loop chỉ await kết quả nên các endpoint khác (ghi log hành vi,
+    recommendation) không bị chặn khi model đang chạy. Số tác vụ chạy đồng thời
+    và số tác vụ được phép chờ đều có giới hạn.
+    """
+
+    def __init__(self, max_workers: int = 1, max_concurrency: int = 1, max_queue: int = 100,
+                 name: str = "inference"):
+        """
+        Args:
+            max_workers: Số thread trong pool
+            max_concurrency: Số tác vụ chạy đồng thời tối đa
+            max_queue: Số tác vụ chờ tối đa, vượt quá sẽ bị từ chối ngay
+            name: Tên dùng cho thread và log
+        """
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._waiting = 0
+        self._running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.total_wait_seconds = 0.0
+        self.total_run_seconds = 0.0
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        Chạy func(*args, **kwargs) trên thread pool và trả về kết quả
+
+        Raises:
+            InferenceQueueFullError: Khi số tác vụ đang chờ vượt quá max_queue
+        """
+        if self._waiting >= self.max_queue and self._semaphore.locked():
+            self.rejected += 1
+            raise InferenceQueueFullError(
+                f"{self.name} queue is full ({self._waiting} waiting, {self._running} running)"
+            )
+
+        queued_at = time.perf_counter()
+        self._waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting -= 1
+
+        started_at = time.perf_counter()
+        self.total_wait_seconds += started_at - queued_at
+        self._running += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._running -= 1
+            self.completed += 1
+            self.total_run_seconds += time.perf_counter() - started_at
+            self._semaphore.release()
+
+    def shutdown(self) -> None:
+        """Dừng thread pool"""
+        logger.info(f"Shutting down {self.name} executor")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê tình trạng hàng đợi và thời gian chạy"""
+        return {
+            "max_workers": self.max_workers,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "waiting": self._waiting,
+            "running": self._running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+            "avg_run_ms": round(self.total_run_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+        }
@@ -0,0 +1,134 @@
+# utils/micro_batcher.py
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+
+class MicroBatcher:
+    """
+    Gom các yêu cầu đơn lẻ từ nhiều request đồng thời thành một lô
+
+    Mỗi lô được gửi đi khi đủ max_batch_size phần tử hoặc khi phần tử đầu tiên
+    đã chờ quá max_wait_ms. Kết quả của lô được trả lại cho từng caller qua future.
+    """
+
+    def __init__(self, batch_func: Callable[[List[Any]], Awaitable[List[Any]]],
+                 max_batch_size: int = 64, max_wait_ms: float = 10, max_in_flight: int = 2,
+                 name: str = "micro-batcher"):
+        """
+        Args:
+            batch_func: Hàm async nhận danh sách đầu vào, trả về danh sách kết quả cùng thứ tự
+            max_batch_size: Số phần tử tối đa trong một lô
+            max_wait_ms: Thời gian chờ tối đa (ms) trước khi gửi một lô chưa đầy
+            max_in_flight: Số lô tối đa một lần submit_many được gửi đi cùng lúc
+            name: Tên dùng cho log
+        """
+        self.batch_func = batch_func
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000
+        self.name = name
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.batches = 0
+        self.items = 0
+        self.full_batches = 0
+        self.timeout_batches = 0
+
+    async def submit(self, item: Any) -> Any:
+        """Gửi một phần tử và chờ kết quả của nó"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush(reason="size")
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush, "timeout")
+
+        return await future
+
+    async def submit_many(self, items: List[Any]) -> List[Any]:
+        """
+        Gửi nhiều phần tử, kết quả trả về theo đúng thứ tự đầu vào
+
+        Các phần tử được chia thành từng lô max_batch_size và chỉ max_in_flight lô
+        được gửi đi cùng lúc, các lô sau chờ tới lượt thay vì làm đầy hàng đợi của
+        batch_func. Khi một lô lỗi, các lô chưa gửi bị hủy.
+        """
+        if not items:
+            return []
+        chunks = [items[start:start + self.max_batch_size] for start in range(0, len(items), self.max_batch_size)]
+        results: List[List[Any]] = [[] for _ in chunks]
+        slots = asyncio.Semaphore(self.max_in_flight)
+
+        async def run_chunk(index: int, chunk: List[Any]) -> None:
+            async with slots:
+                results[index] = await asyncio.gather(*(self.submit(item) for item in chunk))
+
+        tasks = [asyncio.ensure_future(run_chunk(index, chunk)) for index, chunk in enumerate(chunks)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return [result for chunk_results in results for result in chunk_results]
+
+    def _flush(self, reason: str) -> None:
+        """Tách các phần tử đang chờ thành lô và gửi đi"""
+        if reason == "timeout":
+            self._timer = None
+
+        # Khi flush do đủ kích thước chỉ gửi các lô đầy, phần dư tiếp tục chờ timer
+        while len(self._pending) >= self.max_batch_size or (reason == "timeout" and self._pending):
+            batch = self._pending[:self.max_batch_size]
+            del self._pending[:len(batch)]
+
+            self.batches += 1
+            self.items += len(batch)
+            if len(batch) == self.max_batch_size:
+                self.full_batches += 1
+            else:
+                self.timeout_batches += 1
+
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        if not self._pending and self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        elif self._pending and self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush, "timeout")
+
+    async def _run_batch(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """Chạy batch_func cho một lô và trả kết quả về từng future"""
+        items = [item for item, _ in batch]
+        try:
+            results = await self.batch_func(items)
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            logger.error(f"{self.name}: batch of {len(batch)} items failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê số lô và tỉ lệ lấp đầy lô"""
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "max_in_flight": self.max_in_flight,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "items": self.items,
+            "full_batches": self.full_batches,
+            "timeout_batches": self.timeout_batches,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "fill_ratio": round(self.items / (self.batches * self.max_batch_size), 4) if self.batches else 0.0,
+        }
@@ -0,0 +1,284 @@
+# utils/product_catalog.py
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+from scipy import sparse
+
+from database.mongo import product_collection
+
+# Khoảng thời gian giữa hai lần lấy sản phẩm mới/sửa (giây) và giữa hai lần tải lại toàn bộ
+REFRESH_SECONDS = float(os.getenv("PRODUCT_CATALOG_REFRESH_SECONDS", "30"))
+FULL_RELOAD_SECONDS = float(os.getenv("PRODUCT_CATALOG_FULL_RELOAD_SECONDS", "3600"))
+# Dùng MongoDB change stream (cần replica set, Atlas có sẵn) thay cho việc hỏi updated_at định kỳ
+USE_CHANGE_STREAM = os.getenv("PRODUCT_CATALOG_CHANGE_STREAM", "false").lower() in ("1", "true", "yes")
+
+CATALOG_PROJECTION = {
+    "_id": 1, "keywords": 1, "tags": 1, "name": 1, "category": 1, "brand": 1, "price": 1, "updated_at": 1
+}
+
+
+class CatalogSnapshot:
+    """
+    Ảnh chụp catalog tại một thời điểm, không bị sửa sau khi tạo
+
+    Mỗi cột là một mảng theo cùng thứ tự sản phẩm. Các cấu trúc tính từ catalog
+    (chỉ số trong model, ma trận keyword, ...) được lưu trong cache của snapshot
+    nên tự mất khi catalog đổi sang snapshot mới.
+    """
+
+    def __init__(self, product_ids: np.ndarray, keywords: List[List[str]], tags: List[List[str]],
+                 names: List[str], categories: List[Any], brands: List[Any], prices: np.ndarray,
+                 version: int):
+        self.product_ids = product_ids
+        self.keywords = keywords
+        self.tags = tags
+        self.names = names
+        self.categories = categories
+        self.brands = brands
+        self.prices = prices
+        self.version = version
+        self.positions = {pid: index for index, pid in enumerate(product_ids.tolist())}
+        self._cache: Dict[Any, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self.product_ids)
+
+    def position(self, product_id: str) -> Optional[int]:
+        """Vị trí của sản phẩm trong snapshot, None nếu không có"""
+        return self.positions.get(str(product_id))
+
+    def get_product(self, product_id: str) -> Optional[Dict]:
+        """Thông tin của một sản phẩm (cùng dạng document trong products)"""
+        index = self.position(product_id)
+        if index is None:
+            return None
+        price = self.prices[index]
+        return {
+            "_id": self.product_ids[index],
+            "name": self.names[index],
+            "category": self.categories[index],
+            "brand": self.brands[index],
+            "price": None if np.isnan(price) else float(price),
+            "keywords": self.keywords[index],
+            "tags": self.tags[index],
+        }
+
+    def keyword_matrix(self) -> Tuple[sparse.csr_matrix, np.ndarray]:
+        """
+        Ma trận thưa keyword x sản phẩm (CSR) và danh sách keyword tương ứng
+
+        Phần tử (k, p) là số lần keyword k xuất hiện trong keywords của sản phẩm p.
+        Ma trận được lưu theo chiều keyword để phép nhân với vector điểm của sản
+        phẩm cho ra tổng điểm của từng keyword.
+        """
+        return self.cached("keyword_matrix", self._build_keyword_matrix)
+
+    def _build_keyword_matrix(self) -> Tuple[sparse.csr_matrix, np.ndarray]:
+        vocabulary: Dict[str, int] = {}
+        indptr = [0]
+        indices: List[int] = []
+        for keywords in self.keywords:
+            for keyword in keywords:
+                if isinstance(keyword, str) and keyword:
+                    indices.append(vocabulary.setdefault(keyword, len(vocabulary)))
+            indptr.append(len(indices))
+
+        product_keyword = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float64), np.asarray(indices, dtype=np.int64), np.asarray(indptr)),
+            shape=(len(self.product_ids), len(vocabulary)),
+        )
+        # Cộng các keyword trùng trong cùng sản phẩm, chuyển sang keyword x sản phẩm
+        product_keyword.sum_duplicates()
+        return product_keyword.T.tocsr(), np.asarray(list(vocabulary), dtype=object)
+
+    def cached(self, key: Any, build: Callable[[], Any], owner: Any = None) -> Any:
+        """
+        Lấy cấu trúc dẫn xuất theo key, tính một lần cho mỗi snapshot
+
+        Args:
+            key: Tên cấu trúc
+            build: Hàm tạo cấu trúc khi chưa có
+            owner: Đối tượng mà cấu trúc phụ thuộc (ví dụ model), đổi owner thì tính lại
+        """
+        entry = self._cache.get(key)
+        if entry is None or entry[0] is not owner:
+            entry = (owner, build())
+            self._cache[key] = entry
+        return entry[1]
+
+
+def _as_list(value: Any) -> List[str]:
+    """keywords/tags có thể là list, chuỗi hoặc không có"""
+    if not value:
+        return []
+    return list(value) if isinstance(value, list) else [value]
+
+
+def _build_snapshot(products: Iterable[Dict], version: int) -> CatalogSnapshot:
+    """Tạo snapshot từ danh sách document sản phẩm"""
+    products = list(products)
+    prices = np.full(len(products), np.nan)
+    for index, product in enumerate(products):
+        price = product.get("price")
+        if isinstance(price, (int, float)) and not isinstance(price, bool):
+            prices[index] = float(price)
+    return CatalogSnapshot(
+        product_ids=np.asarray([str(p["_id"]) for p in products], dtype=str),
+        keywords=[_as_list(p.get("keywords")) for p in products],
+        tags=[_as_list(p.get("tags")) for p in products],
+        names=[p.get("name") for p in products],
+        categories=[p.get("category") for p in products],
+        brands=[p.get("brand") for p in products],
+        prices=prices,
+        version=version,
+    )
+
+
+class ProductCatalogIndex:
+    """
+    Catalog sản phẩm dùng chung trong process cho các API recommendation
+
+    Tải toàn bộ products một lần, sau đó chỉ lấy các sản phẩm có updated_at mới
+    hơn lần trước (hoặc nhận thay đổi qua change stream). Sản phẩm bị xóa được
+    loại ra ở lần tải lại toàn bộ định kỳ (hoặc ngay lập tức với change stream).
+    """
+
+    def __init__(self, refresh_seconds: float = REFRESH_SECONDS,
+                 full_reload_seconds: float = FULL_RELOAD_SECONDS,
+                 use_change_stream: bool = USE_CHANGE_STREAM):
+        """
+        Args:
+            refresh_seconds: Khoảng thời gian tối thiểu giữa hai lần lấy thay đổi
+            full_reload_seconds: Khoảng thời gian giữa hai lần tải lại toàn bộ
+            use_change_stream: Nhận thay đổi qua change stream thay cho polling
+        """
+        self.refresh_seconds = refresh_seconds
+        self.full_reload_seconds = full_reload_seconds
+        self.use_change_stream = use_change_stream
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._documents: Dict[str, Dict] = {}
+        self._watermark: Optional[datetime] = None
+        self._last_refresh = 0.0
+        self._last_full_reload = 0.0
+        self._dirty = False
+        self._lock = asyncio.Lock()
+        self._stream_task: Optional[asyncio.Task] = None
+        self.full_reloads = 0
+        self.incremental_refreshes = 0
+        self.changes_applied = 0
+
+    async def get_snapshot(self) -> CatalogSnapshot:
+        """Lấy snapshot hiện tại, làm mới nếu đã quá thời gian"""
+        if self._dirty:
+            self._publish()
+        if not self._needs_full_reload() and not self._needs_refresh():
+            return self._snapshot
+
+        async with self._lock:
+            if self._needs_full_reload():
+                await self._full_reload()
+            elif self._needs_refresh():
+                await self._incremental_refresh()
+            if self.use_change_stream and not self._streaming():
+                self._stream_task = asyncio.ensure_future(self._watch_changes())
+        return self._snapshot
+
+    def _streaming(self) -> bool:
+        return self._stream_task is not None and not self._stream_task.done()
+
+    def _needs_full_reload(self) -> bool:
+        return self._snapshot is None or time.monotonic() - self._last_full_reload >= self.full_reload_seconds
+
+    def _needs_refresh(self) -> bool:
+        # Change stream đang cập nhật liên tục thì không cần hỏi updated_at
+        return not self._streaming() and time.monotonic() - self._last_refresh >= self.refresh_seconds
+
+    async def _full_reload(self) -> None:
+        """Tải lại toàn bộ catalog"""
+        started = time.perf_counter()
+        documents: Dict[str, Dict] = {}
+        async for product in product_collection.find({}, CATALOG_PROJECTION):
+            documents[str(product["_id"])] = product
+        self._documents = documents
+        self._watermark = max((p["updated_at"] for p in documents.values() if p.get("updated_at")), default=None)
+        self._dirty = False
+        self._publish()
+        self._last_full_reload = self._last_refresh = time.monotonic()
+        self.full_reloads += 1
+        logger.info(f"Loaded product catalog: {len(documents)} products "
+                    f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    async def _incremental_refresh(self) -> None:
+        """Chỉ lấy các sản phẩm được tạo/sửa sau lần làm mới trước"""
+        query = {"updated_at": {"$gte": self._watermark}} if self._watermark is not None else {}
+        # $gte để không bỏ sót sản phẩm sửa cùng thời điểm với mốc, bỏ qua các document không đổi
+        changed = [product async for product in product_collection.find(query, CATALOG_PROJECTION)
+                   if self._documents.get(str(product["_id"])) != product]
+        self._last_refresh = time.monotonic()
+        self.incremental_refreshes += 1
+        if changed:
+            self._apply_changes(changed, [])
+            self._publish()
+
+    def _apply_changes(self, upserted: List[Dict], deleted_ids: List[str]) -> None:
+        """Cập nhật danh sách document, snapshot mới được tạo ở lần đọc kế tiếp"""
+        for product in upserted:
+            self._documents[str(product["_id"])] = product
+            if product.get("updated_at") and (self._watermark is None or product["updated_at"] > self._watermark):
+                self._watermark = product["updated_at"]
+        for product_id in deleted_ids:
+            self._documents.pop(product_id, None)
+        self.changes_applied += len(upserted) + len(deleted_ids)
+        self._dirty = True
+        logger.info(f"Product catalog updated: {len(upserted)} upserted, {len(deleted_ids)} deleted")
+
+    def _publish(self) -> None:
+        """Đổi sang snapshot mới (một phép gán, request đang chạy vẫn dùng snapshot cũ)"""
+        self._dirty = False
+        version = self._snapshot.version + 1 if self._snapshot is not None else 1
+        self._snapshot = _build_snapshot(self._documents.values(), version)
+
+    async def _watch_changes(self) -> None:
+        """Nhận thay đổi của products qua change stream"""
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        try:
+            async with product_collection.watch(pipeline, full_document="updateLookup") as stream:
+                logger.info("Watching product changes with a change stream")
+                async for change in stream:
+                    product_id = str(change["documentKey"]["_id"])
+                    document = change.get("fullDocument")
+                    if change["operationType"] == "delete" or document is None:
+                        self._apply_changes([], [product_id])
+                    else:
+                        self._apply_changes([{k: document.get(k) for k in CATALOG_PROJECTION}], [])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Ví dụ MongoDB không phải replica set: quay về polling updated_at
+            logger.warning(f"Product change stream stopped, falling back to polling: {str(e)}")
+            self.use_change_stream = False
+
+    def invalidate(self) -> None:
+        """Buộc tải lại toàn bộ ở lần truy cập kế tiếp"""
+        self._last_full_reload = 0.0
+        self._last_refresh = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê catalog"""
+        return {
+            "products": len(self._snapshot) if self._snapshot is not None else 0,
+            "version": self._snapshot.version if self._snapshot is not None else 0,
+            "watermark": self._watermark.isoformat() if self._watermark else None,
+            "change_stream": self._streaming(),
+            "full_reloads": self.full_reloads,
+            "incremental_refreshes": self.incremental_refreshes,
+            "changes_applied": self.changes_applied,
+        }
+
+
+product_catalog = ProductCatalogIndex()
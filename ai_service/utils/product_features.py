@@ -0,0 +1,98 @@
+# utils/product_features.py
+# Đặc trưng sản phẩm dùng khi phân tích hành vi user, lấy từ catalog dùng chung (utils/product_catalog.py)
+#
+# Đặc trưng của mỗi sản phẩm được tách một lần cho mỗi snapshot catalog và lưu trong cache của
+# snapshot, nên sản phẩm mới/sửa/xóa được cập nhật cùng lúc với catalog mà không cần query
+# MongoDB hay tách lại name/keywords/tags cho từng action.
+from typing import Any, Dict, Iterable
+
+from utils.product_catalog import CatalogSnapshot, product_catalog
+
+
+def extract_product_features(product: Dict) -> Dict[str, Any]:
+    """
+    Đặc trưng của một sản phẩm dùng khi cộng trọng số hành vi
+
+    Returns:
+        Dict category, brand, price (None nếu không có), keywords (keywords + tags +
+        từ dài hơn 3 ký tự trong tên, đã lower/strip, giữ thứ tự và phần tử lặp)
+    """
+    terms = []
+    for field in ("keywords", "tags"):
+        value = product.get(field)
+        if value:
+            terms.extend(value if isinstance(value, list) else [value])
+
+    if product.get("name"):
+        terms.extend(word for word in product["name"].lower().split() if len(word) > 3)
+
+    price = product.get("price")
+    return {
+        "category": product.get("category") or None,
+        "brand": product.get("brand") or None,
+        "price": float(price) if price and isinstance(price, (int, float)) else None,
+        "keywords": [term.lower().strip() for term in terms if term and isinstance(term, str)],
+    }
+
+
+class ProductFeatureIndex:
+    """
+    Đặc trưng sản phẩm theo product_id, tính từ snapshot catalog hiện tại
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.built = 0
+
+    def _features(self, snapshot: CatalogSnapshot) -> Dict[str, Dict[str, Any]]:
+        # Dict được điền dần, mất cùng snapshot khi catalog đổi
+        return snapshot.cached("behavior_features", dict)
+
+    async def get_many(self, product_ids: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+        """
+        Đặc trưng của các sản phẩm
+
+        Args:
+            product_ids: ID sản phẩm (string hoặc ObjectId, có thể lặp)
+
+        Returns:
+            {str(product_id): đặc trưng}, bỏ qua id sai hoặc sản phẩm không có trong catalog
+        """
+        snapshot = await product_catalog.get_snapshot()
+        cache = self._features(snapshot)
+        features = {}
+        for product_id in dict.fromkeys(str(product_id) for product_id in product_ids):
+            value = cache.get(product_id)
+            if value is None:
+                product = snapshot.get_product(product_id)
+                if product is None:
+                    continue
+                value = cache[product_id] = extract_product_features(product)
+                self.built += 1
+            else:
+                self.hits += 1
+            features[product_id] = value
+        return features
+
+    async def get_all(self) -> Dict[str, Dict[str, Any]]:
+        """Đặc trưng của mọi sản phẩm trong catalog: {str(_id): đặc trưng}"""
+        snapshot = await product_catalog.get_snapshot()
+        return await self.get_many(snapshot.product_ids.tolist())
+
+    def stats(self) -> Dict[str, Any]:
+        """Số lần dùng lại/tính mới đặc trưng và trạng thái catalog"""
+        lookups = self.hits + self.built
+        return {
+            "hits": self.hits,
+            "built": self.built,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "catalog": product_catalog.stats(),
+        }
+
+
+product_feature_index = ProductFeatureIndex()
+
+
+def get_product_cache_stats() -> Dict[str, Any]:
+    """Thống kê đặc trưng sản phẩm dùng khi phân tích hành vi"""
+    return product_feature_index.stats()
@@ -1,15 +1,19 @@
-import tensorflow as tf
 import numpy as np
 import pickle
 import os
-import re
+import json
 import unicodedata
-from tensorflow.keras.preprocessing.sequence import pad_sequences
 from loguru import logger
 from typing import Tuple, Dict, Any
 import time
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, List
+from utils.sentiment_cache import SentimentCache
+from utils.inference_executor import InferenceExecutor
+from utils.micro_batcher import MicroBatcher
+from utils.text_preprocessing import clean_text, clean_texts, SequenceEncoder, segment_cache_info
+from utils.tflite_backend import TFLiteSentimentModel, TFLITE_MODEL_PATH, TOKENIZER_CONFIG_PATH
 
 # Đường dẫn file
 MODEL_PATH = "models/sentiment_models/CNN-LSTM-model.keras"
@@ -17,30 +21,110 @@ TOKENIZER_PATH = "models/sentiment_models/tokenizer.pickle"
 LABEL_MAPPING_PATH = "models/sentiment_models/label_mapping.pickle"
 METADATA_PATH = "models/sentiment_models/model_metadata.pickle"
 
+# Backend chạy model: "keras" (mặc định) hoặc "tflite" (nhẹ hơn, không cần import TensorFlow đầy đủ)
+BACKEND = os.getenv("SENTIMENT_BACKEND", "keras").lower()
+BACKENDS = ("keras", "tflite")
+if BACKEND not in BACKENDS:
+    # Báo lỗi ngay khi khởi động thay vì mọi văn bản đều thành "unknown"
+    raise ValueError(f"Unsupported SENTIMENT_BACKEND '{BACKEND}', expected one of {BACKENDS}")
+
+# Kích thước lô cố định cho mỗi lần chạy model (giữ shape ổn định để tránh retrace)
+PREDICT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "64"))
+
+# Cấu hình cache kết quả: giới hạn kích thước, thời gian sống và file SQLite (tùy chọn)
+CACHE_MAX_SIZE = int(os.getenv("SENTIMENT_CACHE_SIZE", "10000"))
+CACHE_TTL_SECONDS = float(os.getenv("SENTIMENT_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_DB_PATH = os.getenv("SENTIMENT_CACHE_DB", "")
+CACHE_DB_MAX_ENTRIES = int(os.getenv("SENTIMENT_CACHE_DB_MAX_ENTRIES", "200000"))
+
+# Cấu hình executor chạy model ngoài event loop
+INFERENCE_WORKERS = max(1, int(os.getenv("SENTIMENT_WORKERS", "1")))
+INFERENCE_MAX_CONCURRENCY = int(os.getenv("SENTIMENT_MAX_CONCURRENCY", str(INFERENCE_WORKERS)))
+INFERENCE_MAX_QUEUE = int(os.getenv("SENTIMENT_MAX_QUEUE", "100"))
+# Số thread TF dùng cho mỗi op, mặc định chia đều số CPU cho các worker
+INTRA_OP_THREADS = int(os.getenv("SENTIMENT_INTRA_OP_THREADS", str(max(1, (os.cpu_count() or 1) // INFERENCE_WORKERS))))
+
+# Cấu hình micro-batching: gom văn bản từ các request đồng thời thành một lần chạy model
+MICROBATCH_SIZE = int(os.getenv("SENTIMENT_MICROBATCH_SIZE", str(PREDICT_BATCH_SIZE)))
+MICROBATCH_WAIT_MS = float(os.getenv("SENTIMENT_MICROBATCH_WAIT_MS", "10"))
+# Số lô một request (ví dụ một store nhiều review) được gửi cùng lúc, các lô sau chờ tới lượt
+MICROBATCH_IN_FLIGHT = int(os.getenv("SENTIMENT_MICROBATCH_IN_FLIGHT", str(INFERENCE_MAX_CONCURRENCY + 1)))
+
+# Chế độ một lượt: chỉ chạy thêm biến thể không dấu khi độ tin cậy của văn bản gốc thấp
+SINGLE_PASS = os.getenv("SENTIMENT_SINGLE_PASS", "false").lower() in ("1", "true", "yes")
+CONFIDENCE_THRESHOLD = float(os.getenv("SENTIMENT_CONFIDENCE_THRESHOLD", "0.9"))
+
+# Ghi đè phiên bản model lưu kèm kết quả trong database (đổi giá trị để chấm lại toàn bộ)
+MODEL_VERSION_OVERRIDE = os.getenv("SENTIMENT_MODEL_VERSION", "")
+
+if BACKEND == "keras":
+    import tensorflow as tf
+    
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(INTRA_OP_THREADS)
+    except RuntimeError as e:
+        # TF runtime đã được khởi tạo trước đó, giữ nguyên cấu hình hiện tại
+        logger.warning(f"Could not set TensorFlow intra-op threads: {str(e)}")
+
 # Biến toàn cục để lưu trữ model và metadata
 _model = None
 _tokenizer = None
 _label_mapping = None
 _metadata = None
 _inverse_label_mapping = None
-_sentiment_cache = {}
+_encoder = None
+_sentiment_cache = SentimentCache(
+    max_size=CACHE_MAX_SIZE,
+    ttl_seconds=CACHE_TTL_SECONDS,
+    db_path=CACHE_DB_PATH,
+    db_max_entries=CACHE_DB_MAX_ENTRIES,
+    namespace=lambda: _cache_namespace(),
+)
+# Thống kê số lần bỏ qua lượt phân tích thứ hai (biến thể không dấu)
+_pass_stats = {
+    "texts": 0,
+    "second_pass_runs": 0,
+    "skipped_no_diacritics": 0,
+    "skipped_confident": 0,
+}
+_pass_stats_lock = threading.Lock()
+_inference_executor = InferenceExecutor(
+    max_workers=INFERENCE_WORKERS,
+    max_concurrency=INFERENCE_MAX_CONCURRENCY,
+    max_queue=INFERENCE_MAX_QUEUE,
+    name="sentiment-inference",
+)
 
 def _load_resources() -> bool:
     """Tải các tài nguyên cần thiết cho model (lazy loading)"""
-    global _model, _tokenizer, _label_mapping, _metadata, _inverse_label_mapping
+    global _model, _tokenizer, _label_mapping, _metadata, _inverse_label_mapping, _encoder
     
     try:
         # Tải model nếu chưa có
         if _model is None:
-            logger.info(f"Loading sentiment analysis model from {MODEL_PATH}")
-            _model = tf.keras.models.load_model(MODEL_PATH)
+            if BACKEND == "tflite":
+                logger.info(f"Loading TFLite sentiment analysis model from {TFLITE_MODEL_PATH}")
+                _model = TFLiteSentimentModel(TFLITE_MODEL_PATH, num_threads=INTRA_OP_THREADS)
+            else:
+                logger.info(f"Loading sentiment analysis model from {MODEL_PATH}")
+                _model = tf.keras.models.load_model(MODEL_PATH)
+        
+        # Backend TFLite đọc từ điển từ JSON để không phải unpickle Keras Tokenizer
+        if _encoder is None and BACKEND == "tflite" and os.path.exists(TOKENIZER_CONFIG_PATH):
+            logger.info(f"Loading tokenizer config from {TOKENIZER_CONFIG_PATH}")
+            with open(TOKENIZER_CONFIG_PATH, 'r', encoding='utf-8') as handle:
+                _encoder = SequenceEncoder.from_config(json.load(handle))
         
         # Tải tokenizer nếu chưa có
-        if _tokenizer is None:
+        if _encoder is None and _tokenizer is None:
             logger.info(f"Loading tokenizer from {TOKENIZER_PATH}")
             with open(TOKENIZER_PATH, 'rb') as handle:
                 _tokenizer = pickle.load(handle)
         
+        # Bảng tra từ điển để tokenize + đệm trực tiếp vào mảng NumPy
+        if _encoder is None:
+            _encoder = SequenceEncoder.from_tokenizer(_tokenizer)
+        
         # Tải ánh xạ nhãn nếu chưa có
         if _label_mapping is None:
             logger.info(f"Loading label mapping from {LABEL_MAPPING_PATH}")
@@ -64,40 +148,6 @@ def _load_resources() -> bool:
         logger.error(f"Failed to load sentiment analysis resources: {str(e)}")
         return False
 
-def clean_text(text: str) -> str:
-    """
-    Làm sạch văn bản tiếng Việt theo cách giống như trong quá trình huấn luyện
-    
-    Args:
-        text: Văn bản đầu vào cần làm sạch
-        
-    Returns:
-        Văn bản đã được làm sạch
-    """
-    if not isinstance(text, str):
-        return ""
-    
-    # Chuyển thành chữ thường
-    text = text.lower()
-    
-    # Loại bỏ URL
-    text = re.sub(r'http\S+', '', text)
-    
-    # Thay thế dấu câu bằng khoảng trắng
-    text = re.sub(r'[^\w\s]', ' ', text)
-    
-    # Chuẩn hóa khoảng trắng
-    text = re.sub(r'\s+', ' ', text).strip()
-    
-    # Xử lý tiếng Việt với thư viện underthesea nếu có
-    try:
-        from underthesea import word_tokenize
-        text = " ".join(word_tokenize(text))
-    except ImportError:
-        logger.warning("Thư viện underthesea không có sẵn, bỏ qua tokenization từ")
-    
-    return text
-
 def remove_diacritics(text: str) -> str:
     """
     Loại bỏ dấu khỏi văn bản tiếng Việt
@@ -131,11 +181,11 @@ def analyze_sentiment(text: str) -> Tuple[str, float]:
         logger.warning("Empty or invalid input text for sentiment analysis")
         return "unknown", 0.0
     
-    # Kiểm tra cache
-    cache_key = text[:100]  # Sử dụng 100 ký tự đầu làm key
-    if cache_key in _sentiment_cache:
+    # Kiểm tra cache (key là hash của toàn bộ văn bản)
+    cached = _sentiment_cache.get(text)
+    if cached is not None:
         logger.debug(f"Using cached result for text: '{text[:30]}...'")
-        return _sentiment_cache[cache_key]
+        return cached
         
     # Tải model và tài nguyên
     if not _load_resources():
@@ -143,21 +193,11 @@ def analyze_sentiment(text: str) -> Tuple[str, float]:
         return "unknown", 0.0
     
     try:
-        # Bước 1: Phân tích với văn bản gốc
-        result_original = _analyze_text_variant(text, False)
-        
-        # Bước 2: Phân tích với văn bản không dấu
-        result_no_diacritics = _analyze_text_variant(text, True)
-        
-        # Chọn kết quả có độ tin cậy cao hơn
-        if result_no_diacritics[1] > result_original[1]:
-            result = result_no_diacritics
-            # logger.debug(f"Using no-diacritics version with higher confidence: {result[1]:.4f} > {result_original[1]:.4f}")
-        else:
-            result = result_original
+        # Phân tích văn bản gốc, chỉ chạy biến thể không dấu khi cần
+        result = _score_texts([text])[0]
         print(f"text:{text} Result: {result}")
         # Lưu kết quả vào cache
-        _sentiment_cache[cache_key] = result
+        _sentiment_cache.set(text, result)
         
         # elapsed = time.time() - start_time
         # logger.debug(f"Sentiment analysis completed in {elapsed:.3f}s: {result[0]} ({result[1]:.4f})")
@@ -168,45 +208,214 @@ def analyze_sentiment(text: str) -> Tuple[str, float]:
         logger.error(f"Error in sentiment analysis: {str(e)}")
         return "unknown", 0.0
 
-def _analyze_text_variant(text: str, remove_dia: bool = False) -> Tuple[str, float]:
+def _label_from_prediction(prediction: np.ndarray) -> Tuple[str, float]:
     """
-    Phân tích một biến thể của văn bản (có dấu hoặc không dấu)
+    Chuyển vector xác suất thành (nhãn cảm xúc, độ tin cậy)
     
     Args:
-        text: Văn bản đầu vào
-        remove_dia: Có loại bỏ dấu hay không
+        prediction: Vector xác suất của một mẫu
         
     Returns:
         Tuple gồm (nhãn cảm xúc, độ tin cậy)
     """
-    # Đảm bảo model đã được tải
-    if not _load_resources():
-        return "unknown", 0.0
+    # Lấy chỉ số nhãn có xác suất cao nhất
+    predicted_idx = int(np.argmax(prediction))
+    sentiment = _inverse_label_mapping.get(predicted_idx, "unknown")
+    confidence = float(prediction[predicted_idx])
+    return sentiment, confidence
+
+def _predict_padded(padded: np.ndarray) -> np.ndarray:
+    """
+    Chạy model trên mảng đã đệm theo từng lô có kích thước cố định
     
-    # Làm sạch văn bản
-    cleaned_text = clean_text(text)
+    Lô cuối được đệm thêm hàng 0 tới lũy thừa của 2 gần nhất (tối đa
+    PREDICT_BATCH_SIZE) để số shape đầu vào khác nhau luôn nhỏ, kết quả của
+    các hàng đệm sẽ bị bỏ đi.
     
-    # Loại bỏ dấu nếu cần
-    if remove_dia:
-        cleaned_text = remove_diacritics(cleaned_text)
+    Args:
+        padded: Mảng (số mẫu, maxlen) đã tokenize và đệm
+        
+    Returns:
+        Mảng xác suất (số mẫu, số lớp)
+    """
+    total = padded.shape[0]
+    outputs = []
+    for start in range(0, total, PREDICT_BATCH_SIZE):
+        chunk = padded[start:start + PREDICT_BATCH_SIZE]
+        size = chunk.shape[0]
+        target = min(PREDICT_BATCH_SIZE, 1 << (size - 1).bit_length())
+        if size < target:
+            filler = np.zeros((target - size, padded.shape[1]), dtype=padded.dtype)
+            chunk = np.concatenate([chunk, filler])
+        prediction = _model.predict_on_batch(chunk)
+        outputs.append(np.asarray(prediction)[:size])
+    return np.concatenate(outputs)
+
+def _texts_to_padded(cleaned_texts: List[str]) -> np.ndarray:
+    """
+    Tokenize và đệm các văn bản đã làm sạch thành mảng int32 (số mẫu, maxlen),
+    kết quả giống hệt texts_to_sequences + pad_sequences của Keras
+    
+    Args:
+        cleaned_texts: Danh sách văn bản đã làm sạch
+        
+    Returns:
+        Mảng đầu vào cho model
+    """
+    return _encoder.encode_batch(cleaned_texts, _metadata['maxlen'])
+
+def _score_texts(texts: List[str]) -> List[Tuple[str, float]]:
+    """
+    Phân tích cảm xúc cho các văn bản (không dùng cache)
     
-    # Tokenize và đệm chuỗi
-    sequence = _tokenizer.texts_to_sequences([cleaned_text])
-    padded = pad_sequences(sequence, maxlen=_metadata['maxlen'])
+    Mỗi văn bản chỉ được làm sạch một lần. Biến thể không dấu chỉ được tạo khi
+    văn bản thực sự có dấu, và ở chế độ một lượt (SENTIMENT_SINGLE_PASS) chỉ
+    chạy khi độ tin cậy của văn bản gốc thấp hơn CONFIDENCE_THRESHOLD.
     
-    # Dự đoán
-    prediction = _model.predict(padded, verbose=0)[0]
+    Args:
+        texts: Danh sách văn bản hợp lệ
+        
+    Returns:
+        Danh sách (nhãn cảm xúc, độ tin cậy) theo đúng thứ tự đầu vào
+    """
+    # Làm sạch một lần, biến thể không dấu lấy từ văn bản đã làm sạch
+    cleaned = clean_texts(texts)
+    no_diacritics = [remove_diacritics(text) for text in cleaned]
+    has_variant = [variant != text for text, variant in zip(cleaned, no_diacritics)]
+    count = len(texts)
     
-    # Lấy chỉ số nhãn có xác suất cao nhất
-    predicted_idx = np.argmax(prediction)
+    if SINGLE_PASS:
+        # Lượt 1: văn bản gốc; lượt 2: chỉ các văn bản có dấu và độ tin cậy thấp
+        original_results = [_label_from_prediction(p) for p in _predict_padded(_texts_to_padded(cleaned))]
+        second_idx = [j for j in range(count) if has_variant[j] and original_results[j][1] < CONFIDENCE_THRESHOLD]
+        second_predictions = (
+            _predict_padded(_texts_to_padded([no_diacritics[j] for j in second_idx])) if second_idx else []
+        )
+    else:
+        # Chạy văn bản gốc và các biến thể không dấu trong cùng một mảng
+        second_idx = [j for j in range(count) if has_variant[j]]
+        predictions = _predict_padded(_texts_to_padded(cleaned + [no_diacritics[j] for j in second_idx]))
+        original_results = [_label_from_prediction(p) for p in predictions[:count]]
+        second_predictions = predictions[count:]
     
-    # Lấy nhãn và độ tin cậy
-    sentiment = _inverse_label_mapping.get(predicted_idx, "unknown")
-    confidence = float(prediction[predicted_idx])
+    results = list(original_results)
+    for j, prediction in zip(second_idx, second_predictions):
+        result_no_diacritics = _label_from_prediction(prediction)
+        # Chọn kết quả có độ tin cậy cao hơn
+        if result_no_diacritics[1] > results[j][1]:
+            results[j] = result_no_diacritics
     
-    logger.debug(f"Variant {'no-diacritics' if remove_dia else 'original'}: {sentiment} ({confidence:.4f})")
+    skipped_no_diacritics = count - sum(has_variant)
+    with _pass_stats_lock:
+        _pass_stats["texts"] += count
+        _pass_stats["second_pass_runs"] += len(second_idx)
+        _pass_stats["skipped_no_diacritics"] += skipped_no_diacritics
+        _pass_stats["skipped_confident"] += count - skipped_no_diacritics - len(second_idx)
     
-    return sentiment, confidence
+    return results
+
+def analyze_sentiment_batch(texts: List[str]) -> List[Tuple[str, float]]:
+    """
+    Phân tích cảm xúc cho nhiều văn bản cùng lúc
+    
+    Tất cả văn bản được làm sạch, tokenize và đệm vào một mảng rồi chạy model
+    theo lô cố định, thay vì gọi predict cho từng câu.
+    
+    Args:
+        texts: Danh sách văn bản cần phân tích
+        
+    Returns:
+        Danh sách (nhãn cảm xúc, độ tin cậy) theo đúng thứ tự đầu vào
+    """
+    results: List[Tuple[str, float]] = [("unknown", 0.0)] * len(texts)
+    
+    # Gom các văn bản hợp lệ (loại bỏ trùng lặp)
+    positions: Dict[str, List[int]] = {}
+    for i, text in enumerate(texts):
+        if not text or not isinstance(text, str) or text.strip() == "":
+            continue
+        positions.setdefault(text, []).append(i)
+    
+    # Lấy các kết quả đã có trong cache, phần còn lại mới cần chạy model
+    cached = _sentiment_cache.get_many(positions.keys())
+    pending: Dict[str, List[int]] = {}
+    for text, indexes in positions.items():
+        if text in cached:
+            for i in indexes:
+                results[i] = cached[text]
+        else:
+            pending[text] = indexes
+    
+    if not pending:
+        return results
+    
+    if not _load_resources():
+        logger.error("Failed to load sentiment analysis resources")
+        return results
+    
+    try:
+        unique_texts = list(pending.keys())
+        
+        scored = _score_texts(unique_texts)
+        
+        new_results: Dict[str, Tuple[str, float]] = {}
+        for text, result in zip(unique_texts, scored):
+            new_results[text] = result
+            for i in pending[text]:
+                results[i] = result
+        
+        _sentiment_cache.set_many(new_results)
+        logger.debug(f"Batch sentiment analysis: {len(unique_texts)} texts, {len(texts)} requested")
+        return results
+        
+    except Exception as e:
+        logger.error(f"Error in batch sentiment analysis: {str(e)}")
+        return results
+
+async def _run_inference_batch(texts: List[str]) -> List[Tuple[str, float]]:
+    """Chạy một lô đã gom bởi micro-batcher trên executor riêng"""
+    return await _inference_executor.run(analyze_sentiment_batch, texts)
+
+_micro_batcher = MicroBatcher(
+    _run_inference_batch,
+    max_batch_size=MICROBATCH_SIZE,
+    max_wait_ms=MICROBATCH_WAIT_MS,
+    max_in_flight=MICROBATCH_IN_FLIGHT,
+    name="sentiment-batcher",
+)
+
+async def analyze_sentiment_async(text: str) -> Tuple[str, float]:
+    """
+    Phiên bản async của analyze_sentiment
+    
+    Văn bản được gom chung với các request đồng thời khác bởi micro-batcher,
+    model chạy trên executor riêng.
+    
+    Args:
+        text: Nội dung văn bản cần phân tích
+        
+    Returns:
+        Tuple gồm (nhãn cảm xúc, độ tin cậy)
+    """
+    return await _micro_batcher.submit(text)
+
+async def analyze_sentiment_batch_async(texts: List[str]) -> List[Tuple[str, float]]:
+    """
+    Phiên bản async của analyze_sentiment_batch, các văn bản đi qua micro-batcher
+    nên có thể được gộp lô với request khác, model chạy trên executor riêng để
+    không chặn event loop. Danh sách dài được gửi dần từng lô (tối đa
+    SENTIMENT_MICROBATCH_IN_FLIGHT lô cùng lúc) nên không tự làm đầy hàng đợi.
+    
+    Args:
+        texts: Danh sách văn bản cần phân tích
+        
+    Returns:
+        Danh sách (nhãn cảm xúc, độ tin cậy) theo đúng thứ tự đầu vào
+        
+    Raises:
+        InferenceQueueFullError: Khi hàng đợi inference đã đầy
+    """
+    return await _micro_batcher.submit_many(texts)
 
 def get_model_info() -> Dict[str, Any]:
     """
@@ -221,6 +430,7 @@ def get_model_info() -> Dict[str, Any]:
     return {
         "status": "ok",
         "model_type": "CNN-LSTM hybrid",
+        "backend": BACKEND,
         "version": _metadata.get('version', "unknown"),
         "training_dataset": _metadata.get('training_dataset', "unknown"),
         "vocab_size": _metadata.get('max_features', 0),
@@ -229,13 +439,92 @@ def get_model_info() -> Dict[str, Any]:
         "embedding_dims": _metadata.get('embedding_dims', 0)
     }
 
+def get_model_version() -> str:
+    """
+    Phiên bản của bộ phân tích, được lưu kèm kết quả sentiment của từng review
+
+    Gồm version trong metadata, backend và chế độ single-pass vì đổi một trong
+    các yếu tố này có thể làm thay đổi kết quả.
+
+    Returns:
+        Chuỗi phiên bản, hoặc SENTIMENT_MODEL_VERSION nếu được đặt
+    """
+    global _metadata
+    if MODEL_VERSION_OVERRIDE:
+        return MODEL_VERSION_OVERRIDE
+
+    # Chỉ cần metadata, không phải tải cả model
+    if _metadata is None:
+        with open(METADATA_PATH, 'rb') as handle:
+            _metadata = pickle.load(handle)
+
+    version = f"{_metadata.get('version', 'unknown')}-{BACKEND}"
+    if SINGLE_PASS:
+        version += "-single-pass"
+    return version
+
+def _cache_namespace() -> str:
+    """Phiên bản model dùng trong key của cache (metadata lỗi thì model cũng không chạy được)"""
+    try:
+        return get_model_version()
+    except Exception:
+        return f"unknown-{BACKEND}"
+
 def clear_cache() -> None:
     """Xóa cache kết quả phân tích cảm xúc"""
-    global _sentiment_cache
-    cache_size = len(_sentiment_cache)
-    _sentiment_cache = {}
+    cache_size = _sentiment_cache.clear()
     logger.info(f"Cleared sentiment analysis cache ({cache_size} entries)")
 
+def get_cache_stats() -> Dict[str, Any]:
+    """
+    Lấy thống kê của cache kết quả phân tích cảm xúc
+    
+    Returns:
+        Dictionary chứa kích thước, hit/miss của cache
+    """
+    stats = _sentiment_cache.stats()
+    stats["segmentation"] = segment_cache_info()
+    return stats
+
+def get_executor_stats() -> Dict[str, Any]:
+    """
+    Lấy thống kê của executor chạy model (hàng đợi, thời gian chờ/chạy)
+    
+    Returns:
+        Dictionary chứa thông tin executor
+    """
+    return _inference_executor.stats()
+
+def shutdown_inference_executor() -> None:
+    """Dừng thread pool chạy model khi service tắt"""
+    _inference_executor.shutdown()
+
+def get_pass_stats() -> Dict[str, Any]:
+    """
+    Lấy thống kê số lần chạy/bỏ qua biến thể không dấu
+    
+    Returns:
+        Dictionary chứa số văn bản đã phân tích, số lần chạy lượt thứ hai và số
+        lần bỏ qua (do không có dấu hoặc do độ tin cậy đã đủ cao)
+    """
+    with _pass_stats_lock:
+        stats = dict(_pass_stats)
+    stats["single_pass"] = SINGLE_PASS
+    stats["confidence_threshold"] = CONFIDENCE_THRESHOLD
+    stats["second_pass_skip_rate"] = (
+        round(1 - stats["second_pass_runs"] / stats["texts"], 4) if stats["texts"] else 0.0
+    )
+    return stats
+
+def get_batcher_stats() -> Dict[str, Any]:
+    """
+    Lấy thống kê của micro-batcher (số lô, tỉ lệ lấp đầy lô)
+    
+    Returns:
+        Dictionary chứa thông tin micro-batcher
+    """
+    return _micro_batcher.stats()
+
 
 def filter_stores_with_negative_comments(analysis_result: List[Dict]) -> List[Dict]:
     """
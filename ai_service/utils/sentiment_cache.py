@@ -0,0 +1,223 @@
+# utils/sentiment_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from loguru import logger
+
+from utils.ttl_cache import TTLCache
+
+SentimentResult = Tuple[str, float]
+
+
+def text_hash(text: str) -> str:
+    """Tạo key từ toàn bộ nội dung văn bản (sha256)"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class SentimentCache:
+    """
+    Cache kết quả phân tích cảm xúc
+
+    - Key là hash của toàn bộ văn bản, không còn trùng giữa các review có chung phần đầu
+    - Tầng bộ nhớ: LRU + TTL có giới hạn kích thước
+    - Tầng đĩa (tùy chọn): SQLite, giữ kết quả qua các lần khởi động lại và
+      dùng chung giữa các uvicorn worker
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        ttl_seconds: float = 0,
+        db_path: Optional[str] = None,
+        db_max_entries: int = 200000,
+        namespace: Optional[Callable[[], str]] = None,
+    ):
+        """
+        Args:
+            max_size: Số kết quả tối đa giữ trong bộ nhớ
+            ttl_seconds: Thời gian sống của kết quả (giây), 0 = không hết hạn
+            db_path: Đường dẫn file SQLite, None/rỗng = chỉ dùng bộ nhớ
+            db_max_entries: Số kết quả tối đa lưu trên đĩa
+            namespace: Hàm trả về phiên bản model, được ghép vào key để kết quả của
+                phiên bản cũ (kể cả trên đĩa) không bị dùng lại sau khi đổi model
+        """
+        self.ttl_seconds = float(ttl_seconds or 0)
+        self.db_path = db_path or None
+        self.db_max_entries = int(db_max_entries)
+        self.namespace = namespace
+        self._memory = TTLCache(max_size=max_size, ttl_seconds=self.ttl_seconds)
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes_since_prune = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+
+        if self.db_path:
+            self._open_db()
+
+    def _open_db(self) -> None:
+        """Mở (hoặc tạo) file SQLite làm tầng lưu trữ trên đĩa"""
+        try:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            # WAL cho phép nhiều worker đọc song song trong khi một worker ghi
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sentiment_cache ("
+                "key TEXT PRIMARY KEY, label TEXT NOT NULL, "
+                "confidence REAL NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_sentiment_cache_created_at "
+                "ON sentiment_cache (created_at)"
+            )
+            conn.commit()
+            self._conn = conn
+            logger.info(f"Sentiment cache persisted at {self.db_path}")
+        except Exception as e:
+            logger.error(f"Failed to open sentiment cache database {self.db_path}: {str(e)}")
+            self._conn = None
+
+    def _key(self, text: str) -> str:
+        """Key của văn bản trong cache, theo phiên bản model nếu có namespace"""
+        if self.namespace is None:
+            return text_hash(text)
+        return text_hash(f"{self.namespace()}\n{text}")
+
+    def get(self, text: str) -> Optional[SentimentResult]:
+        """Lấy kết quả đã cache cho một văn bản"""
+        return self.get_many([text]).get(text)
+
+    def get_many(self, texts: Iterable[str]) -> Dict[str, SentimentResult]:
+        """
+        Lấy kết quả đã cache cho nhiều văn bản
+
+        Args:
+            texts: Danh sách văn bản
+
+        Returns:
+            Dict văn bản -> (nhãn, độ tin cậy) cho các văn bản có trong cache
+        """
+        found: Dict[str, SentimentResult] = {}
+        missing: Dict[str, str] = {}
+        for text in texts:
+            key = self._key(text)
+            result = self._memory.get(key)
+            if result is not None:
+                found[text] = result
+            else:
+                missing[key] = text
+
+        if missing and self._conn is not None:
+            stored = self._db_get_many(list(missing.keys()))
+            for key, result in stored.items():
+                self._memory.set(key, result)
+                found[missing[key]] = result
+            # get_many được gọi từ nhiều thread của executor, += không nguyên tử
+            with self._db_lock:
+                self.disk_hits += len(stored)
+                self.disk_misses += len(missing) - len(stored)
+
+        return found
+
+    def set(self, text: str, result: SentimentResult) -> None:
+        """Lưu kết quả cho một văn bản"""
+        self.set_many({text: result})
+
+    def set_many(self, results: Dict[str, SentimentResult]) -> None:
+        """Lưu kết quả cho nhiều văn bản"""
+        rows = []
+        for text, (label, confidence) in results.items():
+            key = self._key(text)
+            self._memory.set(key, (label, confidence))
+            rows.append((key, label, float(confidence)))
+
+        if rows and self._conn is not None:
+            self._db_set_many(rows)
+
+    def _db_get_many(self, keys: List[str]) -> Dict[str, SentimentResult]:
+        """Đọc kết quả từ SQLite theo danh sách key"""
+        found: Dict[str, SentimentResult] = {}
+        min_created = time.time() - self.ttl_seconds if self.ttl_seconds else 0
+        try:
+            with self._db_lock:
+                # SQLite giới hạn số tham số mỗi câu truy vấn
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    placeholders = ",".join("?" * len(chunk))
+                    cursor = self._conn.execute(
+                        f"SELECT key, label, confidence FROM sentiment_cache "
+                        f"WHERE key IN ({placeholders}) AND created_at >= ?",
+                        (*chunk, min_created),
+                    )
+                    for key, label, confidence in cursor:
+                        found[key] = (label, confidence)
+        except Exception as e:
+            logger.error(f"Error reading sentiment cache database: {str(e)}")
+        return found
+
+    def _db_set_many(self, rows: List[Tuple[str, str, float]]) -> None:
+        """Ghi kết quả xuống SQLite, định kỳ dọn các bản ghi cũ"""
+        now = time.time()
+        try:
+            with self._db_lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sentiment_cache (key, label, confidence, created_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(key, label, confidence, now) for key, label, confidence in rows],
+                )
+                self._writes_since_prune += len(rows)
+                if self._writes_since_prune >= 1000:
+                    self._prune_db(now)
+                    self._writes_since_prune = 0
+                self._conn.commit()
+        except Exception as e:
+            logger.error(f"Error writing sentiment cache database: {str(e)}")
+
+    def _prune_db(self, now: float) -> None:
+        """Xóa bản ghi hết hạn và giữ số bản ghi trên đĩa trong giới hạn"""
+        if self.ttl_seconds:
+            self._conn.execute(
+                "DELETE FROM sentiment_cache WHERE created_at < ?", (now - self.ttl_seconds,)
+            )
+        self._conn.execute(
+            "DELETE FROM sentiment_cache WHERE key IN ("
+            "SELECT key FROM sentiment_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.db_max_entries,),
+        )
+
+    def clear(self) -> int:
+        """Xóa toàn bộ cache (bộ nhớ và đĩa), trả về số phần tử đã xóa trong bộ nhớ"""
+        size = self._memory.clear()
+        if self._conn is not None:
+            try:
+                with self._db_lock:
+                    self._conn.execute("DELETE FROM sentiment_cache")
+                    self._conn.commit()
+            except Exception as e:
+                logger.error(f"Error clearing sentiment cache database: {str(e)}")
+        return size
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def stats(self) -> Dict:
+        """Thống kê hit/miss của cả hai tầng cache"""
+        stats = {"memory": self._memory.stats(), "persistent": self._conn is not None}
+        if self._conn is not None:
+            with self._db_lock:
+                hits, misses = self.disk_hits, self.disk_misses
+            stats["disk"] = {
+                "path": self.db_path,
+                "hits": hits,
+                "misses": misses,
+                "max_entries": self.db_max_entries,
+            }
+        return stats
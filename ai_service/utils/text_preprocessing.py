@@ -0,0 +1,193 @@
+# utils/text_preprocessing.py
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+# Số câu đã tách từ được ghi nhớ (các review ngắn lặp lại rất nhiều)
+SEGMENT_CACHE_SIZE = int(os.getenv("SENTIMENT_SEGMENT_CACHE_SIZE", "50000"))
+
+# Biên dịch sẵn các pattern dùng trong clean_text
+_URL_PATTERN = re.compile(r'http\S+')
+_PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+try:
+    from underthesea import word_tokenize as _word_tokenize
+except ImportError:
+    _word_tokenize = None
+    logger.warning("Thư viện underthesea không có sẵn, bỏ qua tokenization từ")
+
+
+@lru_cache(maxsize=SEGMENT_CACHE_SIZE)
+def _segment(text: str) -> str:
+    """Tách từ tiếng Việt (có ghi nhớ kết quả cho các câu lặp lại)"""
+    return " ".join(_word_tokenize(text))
+
+
+def clean_text(text: str) -> str:
+    """
+    Làm sạch văn bản tiếng Việt theo cách giống như trong quá trình huấn luyện
+
+    Args:
+        text: Văn bản đầu vào cần làm sạch
+
+    Returns:
+        Văn bản đã được làm sạch
+    """
+    if not isinstance(text, str):
+        return ""
+
+    # Chuyển thành chữ thường, loại bỏ URL, thay dấu câu bằng khoảng trắng
+    text = text.lower()
+    text = _URL_PATTERN.sub('', text)
+    text = _PUNCTUATION_PATTERN.sub(' ', text)
+
+    # Chuẩn hóa khoảng trắng
+    text = _WHITESPACE_PATTERN.sub(' ', text).strip()
+
+    # Tách từ bằng underthesea nếu có
+    if _word_tokenize is not None:
+        text = _segment(text)
+
+    return text
+
+
+def clean_texts(texts: List[str]) -> List[str]:
+    """Làm sạch nhiều văn bản"""
+    return [clean_text(text) for text in texts]
+
+
+def segment_cache_info() -> Dict[str, Any]:
+    """Thống kê cache tách từ"""
+    info = _segment.cache_info()
+    total = info.hits + info.misses
+    return {
+        "size": info.currsize,
+        "max_size": info.maxsize,
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_rate": round(info.hits / total, 4) if total else 0.0,
+    }
+
+
+class SequenceEncoder:
+    """
+    Chuyển văn bản đã làm sạch thành mảng chỉ số từ (batch, maxlen) kiểu int32
+
+    Cho kết quả giống hệt Tokenizer.texts_to_sequences + pad_sequences (mặc định
+    padding='pre', truncating='pre') của Keras nhưng tra thẳng từ điển và ghi
+    vào mảng NumPy cấp phát sẵn.
+    """
+
+    def __init__(self, word_index: Dict[str, int], num_words: Optional[int] = None,
+                 oov_token: Optional[str] = None, filters: str = '', lower: bool = True,
+                 split: str = ' '):
+        """
+        Args:
+            word_index: Từ điển từ -> chỉ số của tokenizer
+            num_words: Chỉ giữ các từ có chỉ số nhỏ hơn num_words (None = giữ tất cả)
+            oov_token: Token thay thế cho từ không có trong từ điển
+            filters: Các ký tự bị thay bằng ký tự split
+            lower: Có chuyển thành chữ thường hay không
+            split: Ký tự phân tách từ
+        """
+        self.word_index = word_index
+        self.num_words = num_words
+        self.oov_token = oov_token
+        self.filters = filters
+        self.lower = lower
+        self.split = split
+        self._translate_table = str.maketrans({c: split for c in filters})
+
+        oov_index = word_index.get(oov_token) if oov_token is not None else None
+        self._default = oov_index if oov_token is not None else None
+
+        # Áp dụng giới hạn num_words ngay khi tạo bảng tra
+        self._lookup: Dict[str, int] = {}
+        for word, index in word_index.items():
+            if num_words and index >= num_words:
+                if oov_index is not None:
+                    self._lookup[word] = oov_index
+            else:
+                self._lookup[word] = index
+
+    @classmethod
+    def from_tokenizer(cls, tokenizer: Any) -> "SequenceEncoder":
+        """Tạo encoder từ Keras Tokenizer đã huấn luyện"""
+        if getattr(tokenizer, "char_level", False) or getattr(tokenizer, "analyzer", None) is not None:
+            raise ValueError("SequenceEncoder only supports word-level tokenizers without a custom analyzer")
+        return cls(
+            word_index=tokenizer.word_index,
+            num_words=tokenizer.num_words,
+            oov_token=tokenizer.oov_token,
+            filters=tokenizer.filters,
+            lower=tokenizer.lower,
+            split=tokenizer.split,
+        )
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "SequenceEncoder":
+        """Tạo encoder từ cấu hình đã lưu bằng to_config (không cần import Keras)"""
+        return cls(**config)
+
+    def to_config(self) -> Dict[str, Any]:
+        """Cấu hình có thể lưu dạng JSON để tạo lại encoder"""
+        return {
+            "word_index": self.word_index,
+            "num_words": self.num_words,
+            "oov_token": self.oov_token,
+            "filters": self.filters,
+            "lower": self.lower,
+            "split": self.split,
+        }
+
+    def encode(self, text: str) -> List[int]:
+        """Chuyển một văn bản thành danh sách chỉ số từ"""
+        if self.lower:
+            text = text.lower()
+        words = text.translate(self._translate_table).split(self.split)
+        lookup = self._lookup.get
+        default = self._default
+        return [i for i in (lookup(w, default) for w in words if w) if i is not None]
+
+    def encode_batch(self, texts: List[str], maxlen: int) -> np.ndarray:
+        """
+        Chuyển nhiều văn bản thành mảng (batch, maxlen) đã đệm
+
+        Args:
+            texts: Danh sách văn bản đã làm sạch
+            maxlen: Độ dài chuỗi đầu vào của model
+
+        Returns:
+            Mảng int32, đệm 0 và cắt bớt ở phía đầu chuỗi
+        """
+        padded = np.zeros((len(texts), maxlen), dtype=np.int32)
+        for row, text in enumerate(texts):
+            sequence = self.encode(text)
+            if not sequence:
+                continue
+            sequence = sequence[-maxlen:]
+            padded[row, maxlen - len(sequence):] = sequence
+        return padded
+
+    def matches_tokenizer(self, tokenizer: Any, texts: List[str], maxlen: int) -> bool:
+        """
+        Kiểm tra kết quả có giống hệt đường Keras (dùng khi kiểm thử offline)
+
+        Args:
+            tokenizer: Keras Tokenizer gốc
+            texts: Văn bản mẫu đã làm sạch
+            maxlen: Độ dài chuỗi đầu vào của model
+
+        Returns:
+            True nếu hai mảng giống hệt nhau
+        """
+        from tensorflow.keras.preprocessing.sequence import pad_sequences
+
+        expected = pad_sequences(tokenizer.texts_to_sequences(texts), maxlen=maxlen)
+        actual = self.encode_batch(texts, maxlen)
+        return expected.dtype == actual.dtype and np.array_equal(expected, actual)
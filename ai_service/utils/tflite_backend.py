@@ -0,0 +1,256 @@
+# utils/tflite_backend.py
+# Chuyển model sentiment CNN-LSTM sang TFLite và chạy inference bằng TFLite Interpreter
+#
+# Chuyển đổi (cần TensorFlow đầy đủ), chạy từ thư mục ai_service:
+#     python -m utils.tflite_backend --quantization float16 --samples reviews.txt
+#
+# Sau đó đặt SENTIMENT_BACKEND=tflite để utils.sentiment_analysis dùng file .tflite
+# và tokenizer_config.json thay cho Keras.
+import argparse
+import json
+import os
+import pickle
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+KERAS_MODEL_PATH = "models/sentiment_models/CNN-LSTM-model.keras"
+TFLITE_MODEL_PATH = os.getenv("SENTIMENT_TFLITE_PATH", "models/sentiment_models/CNN-LSTM-model.tflite")
+TOKENIZER_CONFIG_PATH = os.getenv("SENTIMENT_TOKENIZER_CONFIG", "models/sentiment_models/tokenizer_config.json")
+TOKENIZER_PATH = "models/sentiment_models/tokenizer.pickle"
+METADATA_PATH = "models/sentiment_models/model_metadata.pickle"
+
+# int8 là lượng tử hóa dynamic-range (trọng số int8, activation float)
+QUANTIZATION_MODES = ("none", "float16", "int8")
+
+
+def _load_interpreter_class():
+    """Ưu tiên runtime nhẹ (tflite_runtime / ai_edge_litert), không có thì dùng tf.lite của TensorFlow"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+class TFLiteSentimentModel:
+    """
+    Chạy model sentiment đã chuyển sang TFLite
+
+    Có cùng hàm predict_on_batch với Keras model nên utils.sentiment_analysis
+    dùng được cả hai backend như nhau.
+    """
+
+    def __init__(self, model_path: str = TFLITE_MODEL_PATH, num_threads: Optional[int] = None):
+        """
+        Args:
+            model_path: Đường dẫn file .tflite
+            num_threads: Số thread cho interpreter (None = mặc định)
+        """
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"TFLite model not found at {model_path}. Run utils.tflite_backend first.")
+        interpreter_class = _load_interpreter_class()
+        self.model_path = model_path
+        self._interpreter = interpreter_class(model_path=model_path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = int(self._input["shape"][0])
+        # Interpreter không an toàn khi gọi từ nhiều thread cùng lúc
+        self._lock = threading.Lock()
+        logger.info(f"Loaded TFLite sentiment model from {model_path} using {interpreter_class.__module__}")
+
+    def predict_on_batch(self, padded: np.ndarray) -> np.ndarray:
+        """
+        Dự đoán cho một lô đã tokenize và đệm
+
+        Model có kích thước lô cố định (lúc chuyển đổi) nên đầu vào được chia
+        nhỏ hoặc đệm thêm hàng 0 cho vừa, kết quả của hàng đệm bị bỏ đi.
+
+        Args:
+            padded: Mảng (số mẫu, maxlen)
+
+        Returns:
+            Mảng xác suất (số mẫu, số lớp)
+        """
+        batch = np.asarray(padded, dtype=self._input["dtype"])
+        outputs = []
+        with self._lock:
+            for start in range(0, batch.shape[0], self._batch_size):
+                chunk = batch[start:start + self._batch_size]
+                size = chunk.shape[0]
+                if size < self._batch_size:
+                    filler = np.zeros((self._batch_size - size, batch.shape[1]), dtype=batch.dtype)
+                    chunk = np.concatenate([chunk, filler])
+                self._interpreter.set_tensor(self._input["index"], np.ascontiguousarray(chunk))
+                self._interpreter.invoke()
+                outputs.append(self._interpreter.get_tensor(self._output["index"])[:size])
+        return np.concatenate(outputs)
+
+
+def convert_to_tflite(keras_model: Any, output_path: str, quantization: str = "none",
+                      batch_size: int = 16) -> str:
+    """
+    Chuyển Keras model sang TFLite flatbuffer
+
+    Args:
+        keras_model: Model Keras đã tải
+        output_path: Đường dẫn file .tflite đầu ra
+        quantization: "none", "float16" hoặc "int8" (trọng số int8)
+        batch_size: Kích thước lô cố định của model TFLite
+
+    Returns:
+        Đường dẫn file đã ghi
+    """
+    import tensorflow as tf
+
+    if quantization not in QUANTIZATION_MODES:
+        raise ValueError(f"Unsupported quantization '{quantization}', expected one of {QUANTIZATION_MODES}")
+
+    input_spec = keras_model.inputs[0]
+    input_dtype = tf.as_dtype(input_spec.dtype)
+    maxlen = int(input_spec.shape[1])
+
+    # Bọc model với đầu vào có kích thước lô cố định để LSTM được gộp thành
+    # op UnidirectionalSequenceLSTM của TFLite thay vì vòng lặp TensorList
+    fixed_input = tf.keras.Input(shape=(maxlen,), batch_size=batch_size, dtype=input_dtype)
+    fixed_model = tf.keras.Model(fixed_input, keras_model(fixed_input))
+
+    def build_converter(select_tf_ops: bool):
+        converter = tf.lite.TFLiteConverter.from_keras_model(fixed_model)
+        if quantization != "none":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == "float16":
+            converter.target_spec.supported_types = [tf.float16]
+        if select_tf_ops:
+            # Một số biến thể LSTM cần op của TensorFlow (flex delegate, không có trong tflite_runtime)
+            converter.target_spec.supported_ops = [
+                tf.lite.OpsSet.TFLITE_BUILTINS,
+                tf.lite.OpsSet.SELECT_TF_OPS,
+            ]
+            converter._experimental_lower_tensor_list_ops = False
+        return converter
+
+    try:
+        flatbuffer = build_converter(select_tf_ops=False).convert()
+    except Exception as e:
+        logger.warning(f"Builtin-only conversion failed ({str(e)}), retrying with SELECT_TF_OPS")
+        flatbuffer = build_converter(select_tf_ops=True).convert()
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "wb") as handle:
+        handle.write(flatbuffer)
+    logger.info(f"Wrote TFLite model ({len(flatbuffer) / 1024:.1f} KB, quantization={quantization}) to {output_path}")
+    return output_path
+
+
+def export_tokenizer_config(tokenizer: Any, output_path: str = TOKENIZER_CONFIG_PATH) -> str:
+    """Lưu từ điển tokenizer dạng JSON để backend TFLite không cần import Keras"""
+    from utils.text_preprocessing import SequenceEncoder
+
+    config = SequenceEncoder.from_tokenizer(tokenizer).to_config()
+    with open(output_path, "w", encoding="utf-8") as handle:
+        json.dump(config, handle, ensure_ascii=False)
+    logger.info(f"Wrote tokenizer config to {output_path}")
+    return output_path
+
+
+def compare_backends(keras_model: Any, tflite_model: TFLiteSentimentModel, padded: np.ndarray,
+                     batch_size: int = 64) -> Dict[str, Any]:
+    """
+    So sánh kết quả và tốc độ của model TFLite với model Keras gốc
+
+    Args:
+        keras_model: Model Keras
+        tflite_model: Model TFLite
+        padded: Dữ liệu mẫu đã đệm
+        batch_size: Kích thước lô khi chạy
+
+    Returns:
+        Báo cáo gồm tỉ lệ trùng nhãn, sai lệch xác suất và thời gian chạy
+    """
+    def run(model) -> Tuple[np.ndarray, float]:
+        start = time.perf_counter()
+        outputs = [np.asarray(model.predict_on_batch(padded[i:i + batch_size]))
+                   for i in range(0, len(padded), batch_size)]
+        return np.concatenate(outputs), time.perf_counter() - start
+
+    # Chạy thử một lô để loại bỏ thời gian khởi tạo
+    keras_model.predict_on_batch(padded[:batch_size])
+    tflite_model.predict_on_batch(padded[:batch_size])
+
+    keras_probs, keras_seconds = run(keras_model)
+    tflite_probs, tflite_seconds = run(tflite_model)
+    diff = np.abs(keras_probs - tflite_probs)
+    label_agreement = float(np.mean(np.argmax(keras_probs, axis=1) == np.argmax(tflite_probs, axis=1)))
+
+    return {
+        "samples": int(len(padded)),
+        "label_agreement": round(label_agreement, 6),
+        "max_abs_prob_diff": round(float(diff.max()), 6),
+        "mean_abs_prob_diff": round(float(diff.mean()), 6),
+        "keras_ms_per_sample": round(keras_seconds / len(padded) * 1000, 4),
+        "tflite_ms_per_sample": round(tflite_seconds / len(padded) * 1000, 4),
+    }
+
+
+def _load_sample_texts(samples_path: Optional[str], tokenizer: Any, count: int) -> List[str]:
+    """Đọc văn bản mẫu (mỗi dòng một review); không có file thì sinh ngẫu nhiên từ từ điển"""
+    if samples_path:
+        with open(samples_path, "r", encoding="utf-8") as handle:
+            texts = [line.strip() for line in handle if line.strip()]
+        return texts[:count]
+
+    logger.warning("No sample file given, using random vocabulary sequences for the accuracy report")
+    rng = np.random.default_rng(0)
+    vocab = [word for word, index in tokenizer.word_index.items() if not tokenizer.num_words or index < tokenizer.num_words]
+    return [" ".join(rng.choice(vocab, size=rng.integers(3, 60))) for _ in range(count)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert the sentiment model to TFLite and report accuracy delta")
+    parser.add_argument("--keras-model", default=KERAS_MODEL_PATH)
+    parser.add_argument("--output", default=TFLITE_MODEL_PATH)
+    parser.add_argument("--quantization", choices=QUANTIZATION_MODES, default="none")
+    parser.add_argument("--samples", help="Text file with one review per line for the accuracy report")
+    parser.add_argument("--sample-count", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=16, help="Fixed batch size of the exported model")
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    from utils.text_preprocessing import SequenceEncoder, clean_texts
+
+    keras_model = tf.keras.models.load_model(args.keras_model)
+    with open(TOKENIZER_PATH, "rb") as handle:
+        tokenizer = pickle.load(handle)
+    with open(METADATA_PATH, "rb") as handle:
+        metadata = pickle.load(handle)
+
+    texts = clean_texts(_load_sample_texts(args.samples, tokenizer, args.sample_count))
+    padded = SequenceEncoder.from_tokenizer(tokenizer).encode_batch(texts, metadata["maxlen"])
+
+    convert_to_tflite(keras_model, args.output, args.quantization, batch_size=args.batch_size)
+    export_tokenizer_config(tokenizer)
+
+    report = compare_backends(keras_model, TFLiteSentimentModel(args.output), padded)
+    report["quantization"] = args.quantization
+    report["model_size_kb"] = round(os.path.getsize(args.output) / 1024, 1)
+
+    report_path = os.path.splitext(args.output)[0] + ".report.json"
+    with open(report_path, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2)
+    logger.info(f"Accuracy report written to {report_path}: {report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# utils/ttl_cache.py
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable
+
+
+class TTLCache:
+    """
+    Cache trong bộ nhớ có giới hạn kích thước (LRU) và thời gian sống (TTL)
+
+    An toàn khi dùng từ nhiều thread (ví dụ thread pool chạy model).
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 0):
+        """
+        Args:
+            max_size: Số phần tử tối đa, vượt quá sẽ loại phần tử ít dùng nhất
+            ttl_seconds: Thời gian sống của mỗi phần tử (giây), 0 = không hết hạn
+        """
+        self.max_size = max(1, int(max_size))
+        self.ttl_seconds = float(ttl_seconds or 0)
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Lấy giá trị theo key, trả về default nếu không có hoặc đã hết hạn"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at and expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Lưu giá trị, loại bỏ phần tử cũ nhất nếu vượt giới hạn"""
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else 0
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Xóa một phần tử khỏi cache"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self) -> int:
+        """Xóa toàn bộ cache, trả về số phần tử đã xóa"""
+        with self._lock:
+            size = len(self._data)
+            self._data.clear()
+        return size
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê hit/miss của cache"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
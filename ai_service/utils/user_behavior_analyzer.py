@@ -1,12 +1,34 @@
 # utils/user_behavior_analyzer.py
+import os
 from datetime import datetime, timedelta
 from bson import ObjectId
 from collections import Counter, defaultdict
-from typing import List, Dict
-from database.mongo import user_action_collection, product_collection
+from typing import List, Dict, Optional
+from database.mongo import user_action_collection
+from utils.behavior_aggregation import aggregate_user_profile
+from utils.product_features import product_feature_index
+
+# Số action gần nhất tối đa đọc cho một user trong một lần phân tích (0 = không giới hạn)
+MAX_ACTIONS_PER_USER = int(os.getenv("BEHAVIOR_MAX_ACTIONS_PER_USER", "5000"))
+
+# Chỉ đọc các trường cần cho phân tích (khớp index customer_id/timestamp/action_type/product_id)
+ACTION_PROJECTION = {"_id": 0, "action_type": 1, "product_id": 1, "timestamp": 1}
+
+# Cách tính profile: "python" = đọc actions + sản phẩm rồi cộng trong Python,
+# "aggregation" = một aggregation pipeline trên MongoDB (xem utils/behavior_aggregation.py)
+BEHAVIOR_ENGINE = os.getenv("BEHAVIOR_ENGINE", "python")
+BEHAVIOR_ENGINES = ("python", "aggregation")
+
+# Số phần tử giữ lại cho mỗi chiều và các từ bị bỏ qua khi chọn keyword
+TOP_CATEGORIES = 10
+TOP_BRANDS = 5
+TOP_KEYWORDS = 15
+KEYWORD_STOPWORDS = ['the', 'and', 'for', 'with', 'from', 'this', 'that']
 
 class UserBehaviorAnalyzer:
-    def __init__(self):
+    def __init__(self, max_actions: int = MAX_ACTIONS_PER_USER, engine: str = BEHAVIOR_ENGINE):
+        self.max_actions = max_actions
+        self.engine = engine
         self.ACTION_WEIGHTS = {
             "view_product": 1,
             "click_product": 2,
@@ -15,11 +37,31 @@ class UserBehaviorAnalyzer:
             "purchase": 10
         }
     
-    async def analyze_user_behavior(self, user_id: str, analysis_days: int = 30) -> Dict:
-        """Phân tích behavior của user và tạo dữ liệu cho recommendation"""
+    async def analyze_user_behavior(self, user_id: str, analysis_days: int = 30,
+                                    engine: Optional[str] = None) -> Dict:
+        """
+        Phân tích behavior của user và tạo dữ liệu cho recommendation
+
+        Args:
+            user_id: ID của user
+            analysis_days: Số ngày gần nhất được phân tích
+            engine: "python" hoặc "aggregation" (None = self.engine)
+        """
+        engine = engine or self.engine
+        if engine not in BEHAVIOR_ENGINES:
+            raise ValueError(f"Unsupported behavior engine '{engine}', expected one of {BEHAVIOR_ENGINES}")
         
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=analysis_days)
+
+        if engine == "aggregation":
+            aggregates = await aggregate_user_profile(
+                user_id, start_date, end_date, self.ACTION_WEIGHTS, self.max_actions,
+                TOP_CATEGORIES, TOP_BRANDS, TOP_KEYWORDS, KEYWORD_STOPWORDS
+            )
+            if aggregates is None:
+                return self._create_empty_recommendation(user_id, start_date, end_date, analysis_days)
+            return self._build_recommendation_data(user_id, aggregates, start_date, end_date, analysis_days)
         
         # 1. Lấy tất cả user actions trong khoảng thời gian
         user_actions = await self._get_user_actions(user_id, start_date, end_date)
@@ -37,41 +79,33 @@ class UserBehaviorAnalyzer:
         
         return recommendation_data
     
-    async def _get_user_actions(self, user_id: str, start_date: datetime, end_date: datetime) -> List[Dict]:
-        """Lấy user actions trong khoảng thời gian"""
+    async def _get_user_actions(self, user_id: str, start_date: datetime, end_date: datetime,
+                                limit: Optional[int] = None) -> List[Dict]:
+        """
+        Lấy user actions trong khoảng thời gian, mới nhất trước
+
+        Args:
+            user_id: ID của user
+            start_date: Thời điểm bắt đầu
+            end_date: Thời điểm kết thúc
+            limit: Số action tối đa (None = self.max_actions, 0 = không giới hạn)
+        """
+        limit = self.max_actions if limit is None else limit
         cursor = user_action_collection.find({
             "customer_id": ObjectId(user_id),
+            "timestamp": {"$gte": start_date, "$lte": end_date},
             "action_type": {"$in": list(self.ACTION_WEIGHTS.keys())}
-        })
+        }, ACTION_PROJECTION).sort("timestamp", -1)
+        if limit:
+            cursor = cursor.limit(limit)
         
         actions = await cursor.to_list(length=None)
         print(f"📊 Found {len(actions)} actions for user {user_id}")
         return actions
     
     async def _get_product_details(self, user_actions: List[Dict]) -> Dict:
-        """Lấy thông tin chi tiết của các sản phẩm user tương tác"""
-        """Lấy thông tin chi tiết của các sản phẩm user tương tác"""
-
-        def safe_objectid(value):
-            try:
-                return ObjectId(value)
-            except (errors.InvalidId, TypeError):
-                return None
-
-        product_ids = list(set(filter(None, [safe_objectid(action["product_id"]) for action in user_actions])))
-
-        cursor = product_collection.find(
-            {"_id": {"$in": product_ids}},
-            {
-                "name": 1, "category": 1, "brand": 1, "price": 1, 
-                "keywords": 1, "tags": 1, "description": 1
-            }
-        )
-        
-        products = await cursor.to_list(length=None)
-        print("products",product_ids,products)
-        print(f"📦 Found details for {len(products)} products")
-        return {str(p["_id"]): p for p in products}
+        """Lấy đặc trưng của các sản phẩm user tương tác từ catalog sản phẩm dùng chung"""
+        return await product_feature_index.get_many(action["product_id"] for action in user_actions)
     
     async def _create_recommendation_data(
         self, user_id: str, user_actions: List[Dict], 
@@ -79,7 +113,21 @@ class UserBehaviorAnalyzer:
         end_date: datetime, analysis_days: int
     ) -> Dict:
         """Tạo dữ liệu recommendation từ phân tích user behavior"""
-        
+        aggregates = self._aggregate_actions(user_actions, product_details)
+        return self._build_recommendation_data(user_id, aggregates, start_date, end_date, analysis_days)
+
+    def _aggregate_actions(self, user_actions: List[Dict], product_details: Dict) -> Dict:
+        """
+        Cộng trọng số categories/brands/keywords và thống kê actions (engine "python")
+
+        Args:
+            user_actions: Actions của user, mới nhất trước
+            product_details: {product_id: đặc trưng} (xem utils/product_features.extract_product_features)
+
+        Returns:
+            Dict top categories/brands/keywords, price_range, action_counts, hourly_activity
+            (cùng dạng với kết quả của engine "aggregation")
+        """
         # Phân tích categories với trọng số
         category_scores = defaultdict(float)
         brand_scores = defaultdict(float)
@@ -89,7 +137,6 @@ class UserBehaviorAnalyzer:
         hourly_activity = defaultdict(int)
         
         recent_product_ids = []  # Sản phẩm tương tác gần đây
-        print("user_actions",product_details)
         for action in user_actions:
             action_type = action["action_type"]
             product_id = str(action["product_id"])
@@ -107,54 +154,35 @@ class UserBehaviorAnalyzer:
                 product = product_details[product_id]
                 
                 # Categories với trọng số
-                if product.get("category"):
+                if product["category"]:
                     category_scores[product["category"]] += weight
                 
                 # Brands với trọng số  
-                if product.get("brand"):
+                if product["brand"]:
                     brand_scores[product["brand"]] += weight
                 
-                # Keywords/Tags với trọng số
-                keywords = []
-                if product.get("keywords"):
-                    if isinstance(product["keywords"], list):
-                        keywords.extend(product["keywords"])
-                    else:
-                        keywords.append(product["keywords"])
-                
-                if product.get("tags"):
-                    if isinstance(product["tags"], list):
-                        keywords.extend(product["tags"])
-                    else:
-                        keywords.append(product["tags"])
-                
-                # Extract keywords from name and description
-                if product.get("name"):
-                    name_words = product["name"].lower().split()
-                    keywords.extend([word for word in name_words if len(word) > 3])
-                
-                for keyword in keywords:
-                    if keyword and isinstance(keyword, str):
-                        keyword_scores[keyword.lower().strip()] += weight
+                # Keywords/Tags/từ trong tên (đã chuẩn hóa sẵn trong cache) với trọng số
+                for keyword in product["keywords"]:
+                    keyword_scores[keyword] += weight
                 
                 # Giá sản phẩm
-                if product.get("price") and isinstance(product["price"], (int, float)):
-                    price_list.append(float(product["price"]))
+                if product["price"] is not None:
+                    price_list.append(product["price"])
         
         # Tính toán kết quả phân tích
         
         # 1. Top categories (sắp xếp theo trọng số)
-        top_categories = [cat for cat, _ in Counter(category_scores).most_common(10)]
+        top_categories = [cat for cat, _ in Counter(category_scores).most_common(TOP_CATEGORIES)]
         
         # 2. Top brands
-        top_brands = [brand for brand, _ in Counter(brand_scores).most_common(5)]
+        top_brands = [brand for brand, _ in Counter(brand_scores).most_common(TOP_BRANDS)]
         
         # 3. Top keywords (lọc bỏ từ không có ý nghĩa)
         filtered_keywords = {
             k: v for k, v in keyword_scores.items() 
-            if len(k) > 2 and k not in ['the', 'and', 'for', 'with', 'from', 'this', 'that']
+            if len(k) > 2 and k not in KEYWORD_STOPWORDS
         }
-        top_keywords = [kw for kw, _ in Counter(filtered_keywords).most_common(15)]
+        top_keywords = [kw for kw, _ in Counter(filtered_keywords).most_common(TOP_KEYWORDS)]
         
         # 4. Price range analysis
         price_analysis = {"min": 0, "max": 0, "avg": 0}
@@ -164,6 +192,23 @@ class UserBehaviorAnalyzer:
                 "max": round(max(price_list), 2), 
                 "avg": round(sum(price_list) / len(price_list), 2)
             }
+
+        return {
+            "categories": top_categories,
+            "brands": top_brands,
+            "keywords": top_keywords,
+            "price_range": price_analysis,
+            "action_counts": dict(action_counts),
+            "hourly_activity": dict(hourly_activity),
+        }
+
+    def _build_recommendation_data(
+        self, user_id: str, aggregates: Dict, start_date: datetime,
+        end_date: datetime, analysis_days: int
+    ) -> Dict:
+        """Tạo document recommendation từ kết quả cộng trọng số (dùng chung cho mọi engine)"""
+        action_counts = aggregates["action_counts"]
+        hourly_activity = aggregates["hourly_activity"]
         
         # 5. Behavior analysis
         most_active_hour = max(hourly_activity.items(), key=lambda x: x[1])[0] if hourly_activity else 0
@@ -183,10 +228,10 @@ class UserBehaviorAnalyzer:
             "customer_id": ObjectId(user_id),
             
             # Dữ liệu để query
-            "keywords": top_keywords,
-            "categories": top_categories,
-            "brands": top_brands,
-            "price_range": price_analysis,
+            "keywords": aggregates["keywords"],
+            "categories": aggregates["categories"],
+            "brands": aggregates["brands"],
+            "price_range": aggregates["price_range"],
             
             # Metadata phân tích
             "behavior_analysis": {
@@ -16,6 +16,10 @@ const recommendationSchema = new mongoose.Schema({
         max: Number,
         avg: Number
     },
+    // Top sản phẩm do AI service tính trước từ model recommendation
+    recommended_product_ids: [String],
+    recommended_model_version: String,
+    recommended_at: Date,
     behavior_analysis: {
         most_active_time: String, // ví dụ "18:00"
         preferred_action: String, // ví dụ "add_to_cart"
@@ -1,10 +1,73 @@
 const axios = require('axios');
+const readline = require('readline');
 const mongoose = require('mongoose');
 const UserAction = require('../models/userAction.model');
 const Notification = require('../models/notification.model');
 const { log_action_type } = require('../common/Constant');
 
 const LOG_API_URL = 'http://160.250.133.57:8080/api'; // Cấu hình host Python
+// Số lần gửi lại các store còn thiếu khi Python báo bận (lỗi retryable) và thời gian chờ giữa các lần
+const ANALYZE_MAX_RETRIES = 3;
+const ANALYZE_RETRY_DELAY_MS = 30 * 1000;
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+const notifyNegativeComments = async (storeData) => {
+    const { store_id, negative_comments } = storeData;
+    const negative_comment_ids = negative_comments?.map(item => item._id)
+    if (negative_comments?.length > 0) {
+        await Notification.create({
+            store_id: new mongoose.Types.ObjectId(store_id),
+            customer_id: new mongoose.Types.ObjectId(negative_comments.customer_id),
+            product_id: new mongoose.Types.ObjectId(negative_comments.product_id),
+            type: 'negative_comments',
+            title: 'Bình luận tiêu cực trong tuần qua',
+            content: `Bạn có ${negative_comments.length} bình luận tiêu cực.`,
+            data: negative_comments, // nếu cần chi tiết từng comment
+            is_created_by_ai: true,
+            negative_comment_ids: negative_comment_ids,
+            created_at: new Date()
+        });
+
+        console.log(`→ Thông báo đã gửi cho store ${store_id}: ${negative_comments.length} comment tiêu cực.`);
+    }
+};
+
+// Gửi danh sách store sang Python, xử lý từng dòng NDJSON ngay khi nhận được.
+// Trả về các store_id đã nhận và lỗi làm dừng stream (null nếu stream chạy hết)
+const streamStoreComments = async (storeIds, onStore) => {
+    const received = new Set();
+    let response;
+    try {
+        response = await axios.post(`${LOG_API_URL}/reviews/analyze`, {
+            store_ids: storeIds,
+            stream: true
+        }, { responseType: 'stream' });
+    } catch (error) {
+        // 503: hàng đợi inference đầy, thử lại sau
+        return { received, error: { message: error.message, retryable: error.response?.status === 503 } };
+    }
+
+    const lines = readline.createInterface({ input: response.data, crlfDelay: Infinity });
+    try {
+        for await (const line of lines) {
+            if (!line.trim()) continue;
+            const storeData = JSON.parse(line);
+            if (!storeData.store_id) {
+                // Python dừng giữa chừng, các store sau dòng này chưa được phân tích
+                return { received, error: { message: storeData.error, retryable: Boolean(storeData.retryable) } };
+            }
+            received.add(String(storeData.store_id));
+            await onStore(storeData);
+        }
+    } catch (error) {
+        // Mất kết nối giữa chừng: các store chưa nhận được gửi lại ở lần sau
+        return { received, error: { message: error.message, retryable: true } };
+    } finally {
+        response.data.destroy();
+    }
+    return { received, error: null };
+};
 
 const analyzeWeeklyComments = async () => {
     try {
@@ -24,37 +87,24 @@ const analyzeWeeklyComments = async () => {
             return;
         }
 
-        // 2. Gửi danh sách store_id sang Python
-        const response = await axios.post(`${LOG_API_URL}/reviews/analyze`, {
-            store_ids: commentActions
-        });
-
-        // 3. Xử lý kết quả trả về: [{ store_id, negative_comments: [ { content, sentiment, ... } ] }]
-        if (response.status === 200 && Array.isArray(response.data)) {
-            const analyzedResults = response.data;
-
-            for (const storeData of analyzedResults) {
-                const { store_id, negative_comments } = storeData;
-                const negative_comment_ids = negative_comments?.map(item => item._id)
-                if (negative_comments?.length > 0) {
-                    await Notification.create({
-                        store_id: new mongoose.Types.ObjectId(store_id),
-                        customer_id: new mongoose.Types.ObjectId(negative_comments.customer_id),
-                        product_id: new mongoose.Types.ObjectId(negative_comments.product_id),
-                        type: 'negative_comments',
-                        title: 'Bình luận tiêu cực trong tuần qua',
-                        content: `Bạn có ${negative_comments.length} bình luận tiêu cực.`,
-                        data: negative_comments, // nếu cần chi tiết từng comment
-                        is_created_by_ai: true,
-                        negative_comment_ids: negative_comment_ids,
-                        created_at: new Date()
-                    });
+        // 2. Gửi danh sách store_id sang Python, nhận kết quả dạng NDJSON (mỗi dòng một store)
+        // 3. Xử lý từng store ngay khi Python phân tích xong: { store_id, negative_comments: [ { content, sentiment, ... } ] }
+        //    Nếu Python dừng giữa chừng vì bận, gửi lại các store chưa nhận được
+        let remaining = commentActions.map(String);
+        for (let attempt = 0; remaining.length > 0; attempt++) {
+            const { received, error } = await streamStoreComments(remaining, notifyNegativeComments);
+            remaining = remaining.filter(storeId => !received.has(storeId));
+            if (!error || remaining.length === 0) break;
 
-                    console.log(`→ Thông báo đã gửi cho store ${store_id}: ${negative_comments.length} comment tiêu cực.`);
-                }
+            if (!error.retryable || attempt >= ANALYZE_MAX_RETRIES) {
+                console.error(`❌ Python service dừng giữa chừng: ${error.message}. `
+                    + `Bỏ qua ${remaining.length} store chưa phân tích:`, remaining);
+                break;
             }
-        } else {
-            console.error('❌ Python service trả về không hợp lệ:', response.data);
+            const delay = ANALYZE_RETRY_DELAY_MS * (attempt + 1);
+            console.warn(`⚠️ Python service bận (${error.message}), `
+                + `thử lại ${remaining.length} store sau ${delay / 1000}s`);
+            await sleep(delay);
         }
     } catch (error) {
         console.error('❌ Lỗi khi xử lý bình luận tiêu cực:', error.message);